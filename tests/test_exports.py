@@ -33,6 +33,25 @@ def test_export_onnx():
     YOLO(file)(SOURCE, imgsz=32)  # exported model inference
 
 
+def test_export_onnx_mask_gather():
+    """Test combine_mask ONNX export with mask_gather and dynamic axes, box-local mask crops of the top detections."""
+    import numpy as np
+    import onnxruntime
+
+    file = YOLO("yolo11n-seg-combine_mask.yaml").export(
+        format="onnx", dynamic=True, half=False, mask_gather=True, max_det=300, imgsz=64
+    )
+    session = onnxruntime.InferenceSession(file)
+    for imgsz, n in (64, 84), (640, 300):  # fewer anchors than max_det at 64
+        det, masks = session.run(None, {"images": np.zeros((2, 3, imgsz, imgsz), dtype=np.float32)})
+        assert det.shape == (2, n, 6)  # xyxy, score, class
+        assert masks.shape == (2, n, 28, 28)  # one mask_crop x mask_crop crop per detection
+    assert masks.size < 2 * 80 * (640 // 4) ** 2  # smaller than the dense class planes at imgsz 640
+    for result in YOLO(file, task="segment")(SOURCE, imgsz=64, conf=0.01):  # exported model inference
+        assert result.masks is None or len(result.masks) == len(result.boxes)
+    Path(file).unlink()  # cleanup
+
+
 @pytest.mark.skipif(not TORCH_1_13, reason="OpenVINO requires torch>=1.13")
 def test_export_openvino():
     """Test YOLO exports to OpenVINO format for model inference compatibility."""
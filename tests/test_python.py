@@ -2,6 +2,7 @@
 
 import contextlib
 import csv
+import time
 import urllib
 from copy import copy
 from pathlib import Path
@@ -322,6 +323,125 @@ def test_data_utils():
     zip_directory(TMP / "coco8/images/val")  # zip
 
 
+def test_data_utils_polygons2masks():
+    """Test that polygons are rasterized by pixel coverage and overlap masks keep the smallest instance on top."""
+    from ultralytics.data.utils import polygons2masks, polygons2masks_overlap
+
+    square = np.array([[8, 8], [48, 8], [48, 48], [8, 48]], dtype=np.float32)  # 40x40 pixels
+    segments = np.stack((square, square / 2 + 12, square + 200))  # inner square, outside the image
+    masks = polygons2masks((64, 64), segments, color=1, downsample_ratio=4)
+    assert masks.shape == (3, 16, 16) and masks.sum((1, 2)).tolist() == [100, 25, 0]
+    overlap, index = polygons2masks_overlap((64, 64), segments, downsample_ratio=4)
+    assert index.tolist() == [0, 1, 2] and (overlap == 2).sum() == 25 and (overlap == 1).sum() == 75
+
+
+def test_data_utils_label_store(tmp_path):
+    """Test that a LabelStore returns the labels it was built from, filtered, reordered and after pickling."""
+    import pickle
+
+    from ultralytics.data.utils import LabelStore
+
+    def label(i, cls, segments=()):
+        """Returns a label dictionary with one box per class."""
+        cls = np.array(cls, dtype=np.float32).reshape(-1, 1)
+        bboxes = np.full((len(cls), 4), i / 10, dtype=np.float32)
+        segments = [np.full((n, 2), i, dtype=np.float32) for n in segments]
+        return dict(im_file=f"{i}.jpg", shape=(10 + i, 20), cls=cls, bboxes=bboxes, segments=segments,
+                    keypoints=None, normalized=True, bbox_format="xywh")  # fmt: skip
+
+    labels = [label(0, [0, 2], (3, 5)), label(1, []), label(2, [1, 2, 2], (4, 3, 6))]
+    path, columns = tmp_path / "labels.store", LabelStore.pack(labels)
+    store = LabelStore(path, LabelStore.save(path, columns), [lb["im_file"] for lb in labels])
+    assert len(store) == 3 and str(list(store)) == str(labels)
+    merged = LabelStore.take(LabelStore.concat(columns, LabelStore.pack(labels[:1])), np.array([3, 2, 1]))
+    merged = LabelStore(path, None, ["0.jpg", "2.jpg", "1.jpg"], merged)
+    assert str(list(merged)) == str([labels[0], labels[2], labels[1]])
+    store.update(include_class=[2], single_cls=True)
+    store = pickle.loads(pickle.dumps(store.select([2, 0])))  # maps the file again
+    assert store.shapes.tolist() == [[12, 20], [10, 20]] and store[0]["cls"].tolist() == [[0], [0]]
+    assert [len(s) for s in store[0]["segments"]] == [3, 6] and [len(s) for s in store[1]["segments"]] == [5]
+
+
+def test_yolo_bbox2segment(tmp_path, monkeypatch):
+    """Test that yolo_bbox2segment writes the segments predicted for the pixel boxes of a LabelStore dataset."""
+    from types import SimpleNamespace
+
+    import ultralytics
+    from ultralytics.data.converter import yolo_bbox2segment
+
+    class SAM:
+        """Stand-in for the SAM model, predicting each pixel xyxy box as a rectangle polygon."""
+
+        def __init__(self, model):
+            """Ignores the model file."""
+
+        def __call__(self, im, bboxes, **kwargs):
+            """Returns the boxes as normalized polygons of one Results."""
+            h, w = im.shape[:2]
+            xyn = [np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]]) / [w, h] for x1, y1, x2, y2 in bboxes]
+            return [SimpleNamespace(masks=SimpleNamespace(xyn=xyn))]
+
+    monkeypatch.setattr(ultralytics, "SAM", SAM)
+    (tmp_path / "images").mkdir()
+    (tmp_path / "labels").mkdir()
+    for i in range(2):
+        Image.new("RGB", (80, 40)).save(tmp_path / "images" / f"{i}.jpg")
+        (tmp_path / "labels" / f"{i}.txt").write_text(f"{i} 0.5 0.5 0.5 0.5\n")
+    yolo_bbox2segment(tmp_path / "images", save_dir=tmp_path / "segments")
+    for i in range(2):
+        line = np.array((tmp_path / "segments" / f"{i}.txt").read_text().split(), dtype=float)
+        assert np.allclose(line, [i, 0.25, 0.25, 0.75, 0.25, 0.75, 0.75, 0.25, 0.75])
+
+
+def test_data_utils_read_image_header(tmp_path):
+    """Test that image sizes read from JPEG and PNG headers match PIL, and that PIL is needed for other EXIF images."""
+    from ultralytics.data.utils import exif_size, read_image_header
+
+    im = Image.new("RGB", (61, 37))
+    for i, (suffix, rotation) in enumerate(
+        (("jpg", 1), ("jpg", 6), ("jpg", None), ("png", None), ("png", 6), ("bmp", 1))
+    ):
+        exif = Image.Exif()
+        exif[274] = rotation or 1
+        im.save(tmp_path / f"{i}.{suffix}", **({"exif": exif.tobytes()} if rotation else {}))
+        header = read_image_header(tmp_path / f"{i}.{suffix}")
+        pil = Image.open(tmp_path / f"{i}.{suffix}")
+        fast = suffix == "jpg" or (suffix == "png" and not rotation)  # no eXIf chunk
+        assert header == ((pil.format.lower(), exif_size(pil)) if fast else None)
+
+
+def test_utils_ops_crops2masks():
+    """Test that box-local mask crops expand to the same masks as dense rasterization."""
+    from ultralytics.data.utils import polygon2crop, polygons2masks
+    from ultralytics.utils.ops import crops2masks
+
+    segments = np.array(
+        [[[8, 8], [48, 8], [48, 40], [8, 48]], [[30, 2], [62, 20], [40, 60], [20, 30]]], dtype=np.float32
+    )
+    dense = torch.from_numpy(polygons2masks((64, 64), segments, color=1, downsample_ratio=4))
+    crops, rois = [], []
+    for s in segments:
+        crop, (x0, y0) = polygon2crop((64, 64), s, downsample_ratio=4)
+        crops.append(torch.from_numpy(crop).to(torch.uint8).flatten())
+        rois.append([x0, y0, x0 + crop.shape[1], y0 + crop.shape[0]])
+    crops, rois = torch.cat(crops), torch.tensor(rois)
+    assert torch.equal(crops2masks(crops, rois, (16, 16)), dense.to(torch.uint8))
+    assert torch.equal(crops2masks(crops, rois, (16, 16), index=torch.tensor([1])), dense[1:].to(torch.uint8))
+
+
+def test_utils_ops_paste_mask_crops():
+    """Test that pixel-aligned mask crops paste back to the thresholded mask inside their boxes and empty outside."""
+    from ultralytics.utils.ops import paste_mask_crops
+
+    planes = torch.randn(2, 16, 16)
+    boxes = torch.tensor([[4.0, 2.0, 12.0, 10.0], [0.0, 8.0, 8.0, 16.0]])
+    crops = torch.stack([p[int(y1) : int(y2), int(x1) : int(x2)] for p, (x1, y1, x2, y2) in zip(planes, boxes)])
+    expected = torch.zeros(2, 16, 16, dtype=torch.bool)
+    expected[0, 2:10, 4:12], expected[1, 8:16, 0:8] = crops[0] > 0, crops[1] > 0
+    assert torch.equal(paste_mask_crops(crops, boxes, (16, 16)).bool(), expected)
+    assert paste_mask_crops(crops[:0], boxes[:0], (16, 16)).shape == (0, 16, 16)
+
+
 @pytest.mark.skipif(not ONLINE, reason="environment is offline")
 def test_data_converter():
     """Test dataset conversion functions from COCO to YOLO format and class mappings."""
@@ -412,6 +532,8 @@ def test_utils_torchutils():
 def test_utils_ops():
     """Test utility operations functions for coordinate transformation and normalization."""
     from ultralytics.utils.ops import (
+        crop_mask,
+        crop_mask_mean,
         ltwh2xywh,
         ltwh2xyxy,
         make_divisible,
@@ -437,6 +559,143 @@ def test_utils_ops():
     boxes[:, 4] = torch.randn(10) * 30
     torch.allclose(boxes, xyxyxyxy2xywhr(xywhr2xyxyxyxy(boxes)), rtol=1e-3)
 
+    masks, xy = torch.rand(10, 20, 30), torch.rand(10, 2) * 40 - 5
+    boxes = torch.cat([xy, xy + torch.rand(10, 2) * 20], 1)  # partially outside the masks
+    assert torch.allclose(crop_mask_mean(masks, boxes), crop_mask(masks, boxes).mean(dim=(1, 2)), atol=1e-6)
+
+
+def test_utils_ops_combine_mask():
+    """Test that combine_mask RoI upsampling matches cropping and upsampling the full class planes."""
+    from ultralytics.utils.ops import (
+        combine_mask_planes,
+        crop_mask,
+        paste_masks,
+        process_combine_mask,
+        process_combine_mask_batch,
+        process_combine_mask_native,
+        scale_masks,
+    )
+
+    shape, protos = (480, 640), torch.randn(8, 120, 160)
+    xy, wh = torch.rand(20, 2) * torch.tensor([640, 480]), torch.rand(20, 2) * 200
+    boxes = torch.cat([xy - wh / 2, xy + wh / 2], 1).clamp(0, 480)
+    cls = torch.randint(0, 8, (20,)).float()
+
+    masks = crop_mask(protos[cls.long()], boxes / 4)
+    expected = torch.nn.functional.interpolate(masks[None], shape, mode="bilinear", align_corners=False)[0] > 0
+    assert torch.equal(process_combine_mask(protos, cls, boxes, shape, upsample=True), expected)
+    crops, rois = process_combine_mask(protos, cls, boxes, shape, upsample=True, compact=True)
+    assert torch.equal(paste_masks(crops, rois, shape), expected)
+    preds = [torch.cat([boxes, torch.rand(20, 1), cls[:, None]], 1)[i::2] for i in range(2)]
+    batched = process_combine_mask_batch(torch.stack([protos, protos]), preds, shape)
+    assert torch.equal(torch.cat(batched), torch.cat([expected[0::2], expected[1::2]]))
+    planes = [protos[x[:, 5].long().unique()] for x in preds]  # lazy head, only the planes of the kept classes
+    index = [x[:, 5].long().unique(return_inverse=True)[1] for x in preds]
+    assert all(map(torch.equal, process_combine_mask_batch(planes, preds, shape, index=index), batched))
+    conv, feats = torch.nn.Conv2d(4, 8, 1), torch.randn(4, 120, 160)
+    lazy, index = combine_mask_planes(feats, conv.weight, conv.bias, cls)
+    assert torch.allclose(lazy[index], conv(feats)[cls.long()], atol=1e-5)
+    assert process_combine_mask(protos, cls[:0], boxes[:0], shape, upsample=True).shape == (0, *shape)
+
+    planes = torch.nn.functional.interpolate(protos[None], shape, mode="bilinear", align_corners=False)[0]
+    expected = crop_mask(planes[cls.long()], boxes) > 0  # upsample before cropping
+    assert torch.equal(process_combine_mask(protos, cls, boxes, shape, upsample=True, per_class=True), expected)
+
+    orig_shape = (960, 1280)  # retina masks
+    expected = crop_mask(scale_masks(protos[cls.long()][None], orig_shape)[0], boxes * 2) > 0
+    assert torch.equal(process_combine_mask_native(protos, cls, boxes * 2, orig_shape), expected)
+
+
+def test_utils_ops_stage_profiler(tmp_path):
+    """Test that nested stages are excluded from the self time of the stage around them."""
+    from ultralytics.utils.ops import StageProfiler
+
+    profiler = StageProfiler()
+    for i in range(2):
+        with profiler("outer"), profiler("inner", image=i):
+            time.sleep(0.01)
+    outer, inner = profiler.summary(images=2)[::-1]
+    assert inner["calls"] == outer["calls"] == 2 and inner["ms"] > 20 > outer["ms"]
+    assert abs(sum(r["ms"] for r in profiler.records if r["stage"] == "outer") - inner["ms"] - outer["ms"]) < 1e-6
+    profiler.save(tmp_path / "profile.csv", images=2)
+    assert len((tmp_path / "profile.csv").read_text().splitlines()) == 5 and (tmp_path / "profile.json").exists()
+
+
+def test_validator_match_predictions():
+    """Test that vectorized greedy matching matches the per-threshold loop on crowded images with duplicate labels."""
+    from ultralytics.engine.validator import BaseValidator
+    from ultralytics.utils.metrics import box_iou
+
+    validator = BaseValidator.__new__(BaseValidator)
+    validator.iouv = torch.linspace(0.5, 0.95, 10)
+    torch.manual_seed(0)
+    for nl, nd in (0, 5), (4, 0), (30, 200), (100, 600):
+        gt = torch.rand(nl, 2) * 200
+        gt = torch.cat((gt, gt + 30), 1).repeat(2, 1)  # duplicate labels give IoU ties
+        det = gt[torch.randint(0, max(len(gt), 1), (nd,))] + torch.randn(nd, 4) * 3 if nl else torch.rand(nd, 4)
+        true_classes, pred_classes = torch.randint(0, 3, (len(gt),)), torch.randint(0, 3, (nd,))
+        iou = box_iou(gt, det) * (true_classes[:, None] == pred_classes)
+        expected = torch.zeros(nd, 10, dtype=torch.bool)
+        for i, threshold in enumerate(validator.iouv.tolist()):
+            matches = np.array(np.nonzero(iou.numpy() >= threshold)).T
+            matches = matches[iou[matches[:, 0], matches[:, 1]].numpy().argsort(kind="stable")[::-1]]
+            matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+            matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+            expected[matches[:, 1], i] = True
+        assert torch.equal(validator.match_predictions(pred_classes, true_classes, iou), expected)
+
+
+def test_utils_metrics_packed_mask_iou():
+    """Test that bit-packed, box-pruned mask IoU matches the dense mask IoU."""
+    from ultralytics.utils.metrics import mask_iou, pack_masks, packed_mask_iou
+
+    gt, pred = torch.zeros(6, 40, 50), torch.zeros(8, 160, 200, dtype=torch.bool)
+    for i, m in enumerate(gt):
+        m[i * 5 : i * 5 + 12, i * 6 : i * 6 + 15] = 1
+    for i, m in enumerate(pred[:-1]):  # last mask empty
+        m[i * 18 : i * 18 + 60, i * 22 + 10 : i * 22 + 50] = True
+    resized = torch.nn.functional.interpolate(gt[None], (160, 200), mode="bilinear", align_corners=False)[0] > 0.5
+    expected = mask_iou(resized.view(6, -1).float(), pred.view(8, -1).float())
+    up = gt.repeat_interleave(4, 1).repeat_interleave(4, 2)
+    assert torch.equal(pack_masks(up, (40, 50))[0], pack_masks(gt)[0])  # area downsampling keeps pixel coverage
+    (gt, gt_boxes), (pred, pred_boxes) = pack_masks(gt, (160, 200), chunk=4), pack_masks(pred)
+    assert torch.allclose(packed_mask_iou(gt, pred, gt_boxes, pred_boxes, max_bytes=4096), expected)
+
+
+def test_utils_metrics_confusion_matrix_images():
+    """Test that a batched confusion matrix update matches per-image updates."""
+    from ultralytics.utils.metrics import ConfusionMatrix
+
+    torch.manual_seed(0)
+    images = []
+    for n in 3, 0, 5, 4:
+        gt = torch.rand(n, 2) * 50
+        gt = torch.cat((gt, gt + 20), 1)
+        dets = torch.cat((gt + torch.randn(n, 4), torch.rand(n, 1), torch.randint(0, 3, (n, 1))), 1)
+        images.append((dets if n != 4 else None, gt, torch.randint(0, 3, (n,)).float()))
+    batched, single = ConfusionMatrix(3), ConfusionMatrix(3)
+    batched.process_images(images)
+    for image in images:
+        single.process_batch(*image)
+    assert batched.matrix.sum() > 0 and np.array_equal(batched.matrix, single.matrix)
+
+
+def test_utils_metrics_ap_histogram():
+    """Test that incrementally accumulated AP histograms match ap_per_class within their error bound."""
+    from ultralytics.utils.metrics import APHistogram, ap_per_class
+
+    rng = np.random.default_rng(0)
+    conf, pred_cls, target_cls = rng.random(2000), rng.integers(0, 4, 2000), rng.integers(0, 3, 800)
+    tp = rng.random((2000, 10)) < conf[:, None] * np.linspace(0.9, 0.3, 10)
+    expected = ap_per_class(tp, conf, pred_cls, target_cls)[5]
+    for bins in 10**7, 100:  # one prediction per bin is exact
+        hist = APHistogram(4, bins=bins)
+        for i in np.array_split(np.arange(2000), 9):
+            hist.update(tp[i], conf[i], pred_cls[i], target_cls[i[i < 800]])
+        bound = hist.ap_error()
+        assert (np.abs(hist.ap_per_class()[5] - expected) <= bound + 1e-3).all()
+        assert (bound == 0).all() == (bins > 2000)
+
 
 def test_utils_files():
     """Test file handling utilities including file age, date, and paths with spaces."""
@@ -181,6 +181,7 @@ CFG_FRACTION_KEYS = frozenset(
         "conf",
         "iou",
         "fraction",
+        "scan_verify",
     }
 )
 CFG_INT_KEYS = frozenset(
@@ -196,6 +197,8 @@ CFG_INT_KEYS = frozenset(
         "line_width",
         "nbs",
         "save_period",
+        "ap_bins",
+        "mask_res_check",
     }
 )
 CFG_BOOL_KEYS = frozenset(
@@ -208,7 +211,10 @@ CFG_BOOL_KEYS = frozenset(
         "rect",
         "cos_lr",
         "overlap_mask",
+        "mask_per_class",
+        "lazy_mask",
         "val",
+        "val_shard",
         "save_json",
         "save_hybrid",
         "half",
@@ -232,8 +238,13 @@ CFG_BOOL_KEYS = frozenset(
         "dynamic",
         "simplify",
         "nms",
+        "mask_gather",
         "profile",
         "multi_scale",
+        "dist_val",
+        "pred_cache",
+        "val_profile",
+        "mask_crops",
     }
 )
 
@@ -10,7 +10,7 @@ import numpy as np
 import torch
 from PIL import Image
 
-from ultralytics.data.utils import polygons2masks, polygons2masks_overlap
+from ultralytics.data.utils import polygon2crop, polygons2masks, polygons2masks_overlap
 from ultralytics.utils import LOGGER, colorstr
 from ultralytics.utils.checks import check_version
 from ultralytics.utils.instance import Instances
@@ -1939,6 +1939,8 @@ class Format:
         return_obb (bool): Whether to return oriented bounding boxes.
         mask_ratio (int): Downsample ratio for masks.
         mask_overlap (bool): Whether to overlap masks.
+        return_cls_mask (bool): Whether to return the union mask of each present class for combine_mask training.
+        mask_crops (bool): Whether to return masks as box-local crops instead of dense masks, without mask_overlap.
         batch_idx (bool): Whether to keep batch indexes.
         bgr (float): The probability to return BGR images.
 
@@ -1946,6 +1948,8 @@ class Format:
         __call__: Formats labels dictionary with image, classes, bounding boxes, and optionally masks and keypoints.
         _format_img: Converts image from Numpy array to PyTorch tensor.
         _format_segments: Converts polygon points to bitmap masks.
+        _format_cls_masks: Merges instance masks into one mask per present class.
+        _format_mask_crops: Converts polygon points to box-local bitmap masks.
 
     Examples:
         >>> formatter = Format(bbox_format="xywh", normalize=True, return_mask=True)
@@ -1964,6 +1968,8 @@ class Format:
         return_obb=False,
         mask_ratio=4,
         mask_overlap=True,
+        return_cls_mask=False,
+        mask_crops=False,
         batch_idx=True,
         bgr=0.0,
     ):
@@ -1981,6 +1987,8 @@ class Format:
             return_obb (bool): If True, returns oriented bounding boxes.
             mask_ratio (int): Downsample ratio for masks.
             mask_overlap (bool): If True, allows mask overlap.
+            return_cls_mask (bool): If True, returns the union mask of each present class instead of instance masks.
+            mask_crops (bool): If True and mask_overlap is False, returns box-local mask crops instead of dense masks.
             batch_idx (bool): If True, keeps batch indexes.
             bgr (float): Probability of returning BGR images instead of RGB.
 
@@ -1992,6 +2000,8 @@ class Format:
             return_obb (bool): Whether to return oriented bounding boxes.
             mask_ratio (int): Downsample ratio for masks.
             mask_overlap (bool): Whether masks can overlap.
+            return_cls_mask (bool): Whether to return per-class union masks.
+            mask_crops (bool): Whether to return box-local mask crops.
             batch_idx (bool): Whether to keep batch indexes.
             bgr (float): The probability to return BGR images.
 
@@ -2007,6 +2017,8 @@ class Format:
         self.return_obb = return_obb
         self.mask_ratio = mask_ratio
         self.mask_overlap = mask_overlap
+        self.return_cls_mask = return_cls_mask  # combine_mask training only
+        self.mask_crops = mask_crops and not mask_overlap  # overlap masks are already one plane per image
         self.batch_idx = batch_idx  # keep the batch indexes
         self.bgr = bgr
 
@@ -2029,7 +2041,12 @@ class Format:
                 - 'img': Formatted image tensor.
                 - 'cls': Class label's tensor.
                 - 'bboxes': Bounding boxes tensor in the specified format.
-                - 'masks': Instance masks tensor (if return_mask is True).
+                - 'masks': Instance masks tensor (if return_mask is True and return_cls_mask is False).
+                - 'cls_masks': Union mask of each present class, replacing 'masks' (if return_cls_mask is True).
+                - 'cls_masks_cls': Class of each union mask (if return_cls_mask is True).
+                - 'cls_masks_idx': Batch index of each union mask (if return_cls_mask is True).
+                - 'mask_crops', 'mask_rois', 'cls_mask_crops', 'cls_mask_rois': Flat pixels and xyxy windows of the
+                  box-local instance and union masks replacing 'masks' and 'cls_masks' (if mask_crops is True).
                 - 'keypoints': Keypoints tensor (if return_keypoint is True).
                 - 'batch_idx': Batch index tensor (if batch_idx is True).
 
@@ -2048,15 +2065,22 @@ class Format:
         nl = len(instances)
 
         if self.return_mask:
-            if nl:
-                masks, instances, cls = self._format_segments(instances, cls, w, h)
-                masks = torch.from_numpy(masks)
+            if self.mask_crops:  # box-local masks, expanded by ops.crops2masks where needed
+                labels.update(self._format_mask_crops(instances.segments, cls, w, h))
             else:
-                masks = torch.zeros(
-                    1 if self.mask_overlap else nl, img.shape[0] // self.mask_ratio, img.shape[1] // self.mask_ratio
-                )
-            labels["masks"] = masks
-
+                if nl:
+                    masks, instances, cls = self._format_segments(instances, cls, w, h)
+                    masks = torch.from_numpy(masks)
+                else:
+                    masks = torch.zeros(
+                        1 if self.mask_overlap else nl, img.shape[0] // self.mask_ratio, img.shape[1] // self.mask_ratio
+                    )
+                if self.return_cls_mask:  # the union masks replace the instance masks
+                    labels["cls_masks"], labels["cls_masks_cls"] = self._format_cls_masks(masks, cls)
+                else:
+                    labels["masks"] = masks
+            if self.return_cls_mask:
+                labels["cls_masks_idx"] = torch.zeros(len(labels["cls_masks_cls"]))
 
         labels["img"] = self._format_img(img)
         labels["cls"] = torch.from_numpy(cls) if nl else torch.zeros(nl)
@@ -2142,6 +2166,73 @@ class Format:
 
         return masks, instances, cls
 
+    def _format_mask_crops(self, segments, cls, w, h):
+        """
+        Converts polygon segments to box-local bitmap masks, merged per present class instead if return_cls_mask.
+
+        Args:
+            segments (numpy.ndarray): Polygon segments of the instances with shape (N, M, 2).
+            cls (numpy.ndarray): Class labels for each instance.
+            w (int): Width of the image.
+            h (int): Height of the image.
+
+        Returns:
+            (Dict): 'mask_crops' with the flat uint8 pixels of the instance crops and 'mask_rois' with their (N, 4)
+                xyxy windows in the mask, end exclusive, or with return_cls_mask 'cls_mask_crops', 'cls_mask_rois' and
+                the sorted 'cls_masks_cls' of the union masks of each present class instead.
+        """
+        crops = [polygon2crop((h, w), segment, self.mask_ratio) for segment in segments]
+        rois = np.array([(x, y, x + c.shape[1], y + c.shape[0]) for c, (x, y) in crops], dtype=np.int32).reshape(-1, 4)
+        labels = {}
+        if not self.return_cls_mask:
+            labels["mask_crops"] = torch.from_numpy(
+                np.concatenate([c.reshape(-1) for c, _ in crops] + [[]]).astype(np.uint8)
+            )
+            labels["mask_rois"] = torch.from_numpy(rois)
+        else:
+            classes, inverse = np.unique(cls.reshape(-1), return_inverse=True)
+            cls_crops, cls_rois = [], np.zeros((len(classes), 4), dtype=np.int32)
+            for k in range(len(classes)):
+                members = [i for i in np.nonzero(inverse.reshape(-1) == k)[0] if crops[i][0].size]  # inside the image
+                if members:
+                    cls_rois[k, :2], cls_rois[k, 2:] = rois[members, :2].min(0), rois[members, 2:].max(0)
+                x0, y0, x1, y1 = cls_rois[k]
+                union = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+                for i in members:
+                    crop, (x, y) = crops[i]
+                    union[y - y0 : y - y0 + crop.shape[0], x - x0 : x - x0 + crop.shape[1]] |= crop
+                cls_crops.append(union.reshape(-1))
+            labels["cls_mask_crops"] = torch.from_numpy(np.concatenate(cls_crops + [[]]).astype(np.uint8))
+            labels["cls_mask_rois"] = torch.from_numpy(cls_rois)
+            labels["cls_masks_cls"] = torch.from_numpy(classes)
+        return labels
+
+    def _format_cls_masks(self, masks, cls):
+        """
+        Merges instance masks into one mask per class present in the image.
+
+        Args:
+            masks (torch.Tensor): Instance masks with shape (N, H, W), or (1, H, W) holding the 1-based index of the
+                instance at each pixel if mask_overlap is True.
+            cls (numpy.ndarray): Class labels for each instance.
+
+        Returns:
+            cls_masks (torch.Tensor): Union masks of the instances of each present class with shape (K, H, W).
+            classes (torch.Tensor): Sorted classes of the union masks with shape (K,).
+
+        Notes:
+            - With mask_overlap, each pixel belongs to the class of the instance kept in the overlap mask.
+        """
+        classes, inverse = np.unique(cls.reshape(-1), return_inverse=True)
+        inverse = torch.from_numpy(inverse.reshape(-1))
+        if self.mask_overlap:
+            slot = torch.cat((inverse.new_zeros(1), inverse + 1))[masks[0].long()]  # 1-based class slot per pixel
+            cls_masks = slot[None] == torch.arange(1, len(classes) + 1)[:, None, None]
+        else:
+            index = inverse.view(-1, 1, 1).expand_as(masks)
+            cls_masks = masks.new_zeros(len(classes), *masks.shape[1:]).scatter_reduce_(0, index, masks, "amax")
+        return cls_masks.to(torch.uint8), torch.from_numpy(classes)
+
 
 class RandomLoadText:
     """
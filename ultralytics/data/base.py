@@ -14,7 +14,7 @@ import numpy as np
 import psutil
 from torch.utils.data import Dataset
 
-from ultralytics.data.utils import FORMATS_HELP_MSG, HELP_URL, IMG_FORMATS
+from ultralytics.data.utils import FORMATS_HELP_MSG, HELP_URL, IMG_FORMATS, LabelStore
 from ultralytics.utils import DEFAULT_CFG, LOCAL_RANK, LOGGER, NUM_THREADS, TQDM
 
 
@@ -39,7 +39,7 @@ class BaseDataset(Dataset):
 
     Attributes:
         im_files (list): List of image file paths.
-        labels (list): List of label data dictionaries.
+        labels (list | LabelStore): List of label data dictionaries, or a `LabelStore` behaving like one.
         ni (int): Number of images in the dataset.
         ims (list): List of loaded images.
         npy_files (list): List of numpy file paths.
@@ -131,6 +131,9 @@ class BaseDataset(Dataset):
 
     def update_labels(self, include_class: Optional[list]):
         """Update labels to include only these classes (optional)."""
+        if isinstance(self.labels, LabelStore):  # filtered lazily when indexed
+            self.labels.update(include_class, self.single_cls)
+            return
         include_class_array = np.array(include_class).reshape(1, -1)
         for i in range(len(self.labels)):
             if include_class is not None:
@@ -264,11 +267,12 @@ class BaseDataset(Dataset):
         bi = np.floor(np.arange(self.ni) / self.batch_size).astype(int)  # batch index
         nb = bi[-1] + 1  # number of batches
 
-        s = np.array([x.pop("shape") for x in self.labels])  # hw
+        store = isinstance(self.labels, LabelStore)
+        s = self.labels.shapes if store else np.array([x.pop("shape") for x in self.labels])  # hw
         ar = s[:, 0] / s[:, 1]  # aspect ratio
         irect = ar.argsort()
         self.im_files = [self.im_files[i] for i in irect]
-        self.labels = [self.labels[i] for i in irect]
+        self.labels = self.labels.select(irect) if store else [self.labels[i] for i in irect]
         ar = ar[irect]
 
         # Set training image shapes
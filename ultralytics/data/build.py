@@ -9,7 +9,7 @@ import torch
 from PIL import Image
 from torch.utils.data import dataloader, distributed
 
-from ultralytics.data.dataset import GroundingDataset, YOLODataset, YOLOMultiModalDataset
+from ultralytics.data.dataset import GroundingDataset, YOLODataset, YOLOMultiModalDataset, YOLOShardDataset
 from ultralytics.data.loaders import (
     LOADERS,
     LoadImagesAndVideos,
@@ -86,6 +86,39 @@ class _RepeatSampler:
             yield from iter(self.sampler)
 
 
+class ShardSampler(torch.utils.data.Sampler):
+    """
+    Sampler giving each DDP rank every `world_size`-th chunk of `batch` consecutive indices, without padding.
+
+    Unlike `DistributedSampler` no index is repeated, so statistics merged across ranks cover the dataset exactly once,
+    and chunks stay aligned with the batches that share a rectangular validation shape.
+
+    Args:
+        dataset (Dataset): Dataset to shard.
+        batch (int): Batch size of the dataloader, also the `rect` batch size of the dataset.
+        rank (int, optional): Rank of this process, defaults to the current process group rank.
+        world_size (int, optional): Number of ranks, defaults to the current process group size.
+    """
+
+    def __init__(self, dataset, batch, rank=None, world_size=None):
+        """Initialize the sampler for one rank of `world_size`."""
+        self.n = len(dataset)
+        self.batch = batch
+        self.rank = torch.distributed.get_rank() if rank is None else rank
+        self.world_size = torch.distributed.get_world_size() if world_size is None else world_size
+
+    def __iter__(self):
+        """Yield the indices of this rank's chunks."""
+        for i in range(self.rank * self.batch, self.n, self.world_size * self.batch):
+            yield from range(i, min(i + self.batch, self.n))
+
+    def __len__(self):
+        """Return the number of indices assigned to this rank."""
+        return sum(
+            min(self.batch, self.n - i) for i in range(self.rank * self.batch, self.n, self.world_size * self.batch)
+        )
+
+
 def seed_worker(worker_id):  # noqa
     """Set dataloader worker seed https://pytorch.org/docs/stable/notes/randomness.html#dataloader."""
     worker_seed = torch.initial_seed() % 2**32
@@ -96,7 +129,7 @@ def seed_worker(worker_id):  # noqa
 def build_yolo_dataset(cfg, img_path, batch, data, mode="train", rect=False, stride=32, multi_modal=False):
     """Build YOLO Dataset."""
     dataset = YOLOMultiModalDataset if multi_modal else YOLODataset
-    return dataset(
+    dataset = dataset(
         img_path=img_path,
         imgsz=cfg.imgsz,
         batch_size=batch,
@@ -113,6 +146,7 @@ def build_yolo_dataset(cfg, img_path, batch, data, mode="train", rect=False, str
         data=data,
         fraction=cfg.fraction if mode == "train" else 1.0,
     )
+    return YOLOShardDataset(dataset) if mode == "val" and cfg.val_shard else dataset
 
 
 def build_grounding(cfg, img_path, json_file, batch, mode="train", rect=False, stride=32):
@@ -136,12 +170,17 @@ def build_grounding(cfg, img_path, json_file, batch, mode="train", rect=False, s
     )
 
 
-def build_dataloader(dataset, batch, workers, shuffle=True, rank=-1):
-    """Return an InfiniteDataLoader or DataLoader for training or validation set."""
+def build_dataloader(dataset, batch, workers, shuffle=True, rank=-1, shard=False):
+    """Return an InfiniteDataLoader or DataLoader for training or validation set, `shard` splits it across DDP ranks."""
     batch = min(batch, len(dataset))
     nd = torch.cuda.device_count()  # number of CUDA devices
     nw = min(os.cpu_count() // max(nd, 1), workers)  # number of workers
-    sampler = None if rank == -1 else distributed.DistributedSampler(dataset, shuffle=shuffle)
+    if rank == -1:
+        sampler = None
+    elif shard:  # disjoint, unpadded slices for sharded validation
+        sampler = ShardSampler(dataset, batch)
+    else:
+        sampler = distributed.DistributedSampler(dataset, shuffle=shuffle)
     generator = torch.Generator()
     generator.manual_seed(6148914691236517205 + RANK)
     return InfiniteDataLoader(
@@ -616,7 +616,8 @@ def yolo_bbox2segment(im_dir, save_dir=None, sam_model="sam_b.pt", device=None):
 
     LOGGER.info("Detection labels detected, generating segment labels by SAM model!")
     sam_model = SAM(sam_model)
-    for label in TQDM(dataset.labels, total=len(dataset.labels), desc="Generating segment labels"):
+    labels = list(dataset.labels)  # edited in place, LabelStore returns a new dict each time
+    for label in TQDM(labels, total=len(labels), desc="Generating segment labels"):
         h, w = label["shape"]
         boxes = label["bboxes"]
         if len(boxes) == 0:  # skip empty labels
@@ -629,7 +630,7 @@ def yolo_bbox2segment(im_dir, save_dir=None, sam_model="sam_b.pt", device=None):
 
     save_dir = Path(save_dir) if save_dir else Path(im_dir).parent / "labels-segment"
     save_dir.mkdir(parents=True, exist_ok=True)
-    for label in dataset.labels:
+    for label in labels:
         texts = []
         lb_name = Path(label["im_file"]).with_suffix(".txt").name
         txt_file = save_dir / lb_name
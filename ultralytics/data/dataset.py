@@ -1,18 +1,20 @@
 # Ultralytics 🚀 AGPL-3.0 License - https://ultralytics.com/license
 
+import hashlib
 import json
+import zlib
 from collections import defaultdict
 from itertools import repeat
-from multiprocessing.pool import ThreadPool
+from multiprocessing.pool import Pool, ThreadPool
 from pathlib import Path
 
 import cv2
 import numpy as np
 import torch
 from PIL import Image
-from torch.utils.data import ConcatDataset
+from torch.utils.data import ConcatDataset, Dataset
 
-from ultralytics.utils import LOCAL_RANK, NUM_THREADS, TQDM, colorstr
+from ultralytics.utils import DEFAULT_CFG, LOCAL_RANK, NUM_THREADS, TQDM, colorstr, is_dir_writeable
 from ultralytics.utils.ops import resample_segments
 from ultralytics.utils.torch_utils import TORCHVISION_0_18
 
@@ -30,16 +32,20 @@ from .base import BaseDataset
 from .utils import (
     HELP_URL,
     LOGGER,
+    LabelStore,
+    get_file_stats,
     get_hash,
     img2label_paths,
     load_dataset_cache_file,
+    read_tensors,
     save_dataset_cache_file,
     verify_image,
     verify_image_label,
+    write_tensors,
 )
 
 # Ultralytics dataset *.cache version, >= 1.0.0 for YOLOv8
-DATASET_CACHE_VERSION = "1.0.3"
+DATASET_CACHE_VERSION = "1.0.5"
 
 
 class YOLODataset(BaseDataset):
@@ -60,50 +66,81 @@ class YOLODataset(BaseDataset):
         self.use_keypoints = task == "pose"
         self.use_obb = task == "obb"
         self.data = data
+        self.scan_verify = getattr(kwargs.get("hyp", DEFAULT_CFG), "scan_verify", 1.0)  # fraction checked with PIL
         assert not (self.use_segments and self.use_keypoints), "Can not use both segments and keypoints."
         super().__init__(*args, **kwargs)
 
-    def cache_labels(self, path=Path("./labels.cache")):
+    def cache_labels(self, path=Path("./labels.cache"), stats=None, previous=None):
         """
         Cache dataset labels, check images and read shapes.
 
+        The labels are saved as the columns of a `LabelStore` next to the cache file, together with the path, size,
+        modification time and scan result of every image. Given the `previous` cache, only the images whose image or
+        label file is new or changed are verified and the labels of all other images are reused from its store.
+        Large scans run in a process pool; a deterministic `scan_verify` fraction of the images is checked with PIL
+        and the others only have their JPEG/PNG header read.
+
         Args:
             path (Path): Path where to save the cache file. Default is Path("./labels.cache").
+            stats (np.ndarray, optional): Image and label file stats returned by `get_stats`, computed if None.
+            previous (dict, optional): A stale cache with the columns of its `LabelStore` under "columns".
 
         Returns:
-            (dict): labels.
+            (dict): Scan results, with the `LabelStore` columns in memory under "columns".
         """
-        x = {"labels": []}
-        nm, nf, ne, nc, msgs = 0, 0, 0, 0, []  # number missing, found, empty, corrupt, messages
+        stats, key = self.get_stats(stats)
+        n = len(self.im_files)
+        results = np.zeros((n, 4), dtype=np.int8)  # number missing, found, empty, corrupt per image
+        reuse, msgs = np.zeros(n, dtype=bool), {}  # messages per image
+        if previous is not None:
+            old = previous["columns"]
+            rows = {f: i for i, f in enumerate(bytes(old["im_files"]).decode().split("\0"))}
+            j = np.array([rows.get(f, -1) for f in self.im_files], dtype=np.int64)  # image index in the previous cache
+            reuse = (j >= 0) & (old["file_stats"][j] == stats).all(1)  # unchanged image and label files
+            results[reuse] = old["file_results"][j[reuse]]
+            reused = np.zeros(len(rows), dtype=bool)
+            reused[j[reuse]] = True
+            msgs = {f: m for f, m in previous["msgs"].items() if reused[rows[f]]}
+        todo = np.flatnonzero(~reuse)
+
+        labels, new_msgs = [], []
+        nm, nf, ne, nc = 0, 0, 0, 0  # number missing, found, empty, corrupt
         desc = f"{self.prefix}Scanning {path.parent / path.stem}..."
-        total = len(self.im_files)
+        if previous is not None:
+            desc = f"{self.prefix}Scanning {len(todo)} new or changed of {n} images in {path.parent / path.stem}..."
         nkpt, ndim = self.data.get("kpt_shape", (0, 0))
         if self.use_keypoints and (nkpt <= 0 or ndim not in {2, 3}):
             raise ValueError(
                 "'kpt_shape' in data.yaml missing or incorrect. Should be a list with [number of "
                 "keypoints, number of dims (2 for x,y or 3 for x,y,visible)], i.e. 'kpt_shape: [17, 3]'"
             )
-        with ThreadPool(NUM_THREADS) as pool:
-            results = pool.imap(
+        im_files = [self.im_files[i] for i in todo]
+        check = [zlib.crc32(f.encode()) < self.scan_verify * 2**32 for f in im_files]  # deterministic sample
+        workers = Pool if len(todo) > 1000 else ThreadPool  # processes for label parsing unless startup dominates
+        with workers(NUM_THREADS) as pool:
+            verified = pool.imap(
                 func=verify_image_label,
                 iterable=zip(
-                    self.im_files,
-                    self.label_files,
+                    im_files,
+                    [self.label_files[i] for i in todo],
                     repeat(self.prefix),
                     repeat(self.use_keypoints),
                     repeat(len(self.data["names"])),
                     repeat(nkpt),
                     repeat(ndim),
+                    check,
                 ),
+                chunksize=max(1, min(64, len(todo) // (NUM_THREADS * 16))),
             )
-            pbar = TQDM(results, desc=desc, total=total)
-            for im_file, lb, shape, segments, keypoint, nm_f, nf_f, ne_f, nc_f, msg in pbar:
+            pbar = TQDM(verified, desc=desc, total=len(todo))
+            for i, (im_file, lb, shape, segments, keypoint, nm_f, nf_f, ne_f, nc_f, msg) in zip(todo, pbar):
                 nm += nm_f
                 nf += nf_f
                 ne += ne_f
                 nc += nc_f
+                results[i] = nm_f, nf_f, ne_f, nc_f
                 if im_file:
-                    x["labels"].append(
+                    labels.append(
                         {
                             "im_file": im_file,
                             "shape": shape,
@@ -116,30 +153,62 @@ class YOLODataset(BaseDataset):
                         }
                     )
                 if msg:
-                    msgs.append(msg)
+                    msgs[self.im_files[i]] = msg
+                    new_msgs.append(msg)
                 pbar.desc = f"{desc} {nf} images, {nm + ne} backgrounds, {nc} corrupt"
             pbar.close()
 
-        if msgs:
-            LOGGER.info("\n".join(msgs))
+        if new_msgs:
+            LOGGER.info("\n".join(new_msgs))
+        columns = LabelStore.pack(labels)
+        if reuse.any():  # merge the new labels into the reused rows of the previous store, in image order
+            valid = results[:, 3] == 0  # not corrupt
+            old_rows = np.cumsum(old["file_results"][:, 3] == 0) - 1  # row of each previous image in its store
+            source = np.zeros(n, dtype=np.int64)  # row of each image in the concatenated columns
+            source[reuse] = old_rows[j[reuse]]
+            source[todo[valid[todo]]] = len(old["shapes"]) + np.arange(len(labels))
+            columns = LabelStore.take(LabelStore.concat(old, columns), source[valid])
+        columns["im_files"] = np.frombuffer("\0".join(self.im_files).encode(), dtype=np.uint8)
+        columns["file_stats"], columns["file_results"] = stats, results
+        nm, nf, ne, nc = results.sum(0).tolist()
         if nf == 0:
             LOGGER.warning(f"{self.prefix}WARNING ⚠️ No labels found in {path}. {HELP_URL}")
-        x["hash"] = get_hash(self.label_files + self.im_files)
-        x["results"] = nf, nm, ne, nc, len(self.im_files)
+        x = {"hash": key}
+        x["results"] = nf, nm, ne, nc, n
         x["msgs"] = msgs  # warnings
+        so = columns["segment_offsets"]
+        x["counts"] = len(columns["cls"]), len(columns["bboxes"]), int((so[1:] > so[:-1]).sum())  # segments
+        x["index"] = LabelStore.save(path.with_suffix(".store"), columns) if is_dir_writeable(path.parent) else None
         save_dataset_cache_file(self.prefix, path, x, DATASET_CACHE_VERSION)
+        x["columns"] = columns
         return x
 
+    def get_stats(self, stats=None):
+        """Returns the size and modification time of every image and label file, and a hash of them and the paths."""
+        if stats is None:
+            stats = np.hstack((get_file_stats(self.im_files), get_file_stats(self.label_files)))  # n, 4
+        h = hashlib.sha256(stats.tobytes())
+        h.update("".join(self.label_files + self.im_files).encode())  # hash paths
+        return stats, h.hexdigest()
+
     def get_labels(self):
-        """Returns dictionary of labels for YOLO training."""
+        """Returns a memory-mapped `LabelStore` of the labels for YOLO training, updating a stale cache in place."""
         self.label_files = img2label_paths(self.im_files)
         cache_path = Path(self.label_files[0]).parent.with_suffix(".cache")
+        store_path = cache_path.with_suffix(".store")
+        stats, key = self.get_stats()
         try:
-            cache, exists = load_dataset_cache_file(cache_path), True  # attempt to load a *.cache file
+            cache = load_dataset_cache_file(cache_path)  # attempt to load a *.cache file
             assert cache["version"] == DATASET_CACHE_VERSION  # matches current version
-            assert cache["hash"] == get_hash(self.label_files + self.im_files)  # identical hash
-        except (FileNotFoundError, AssertionError, AttributeError):
-            cache, exists = self.cache_labels(cache_path), False  # run cache ops
+            labels = LabelStore(store_path, cache["index"], self.im_files)  # map the *.store file
+        except (FileNotFoundError, AssertionError, AttributeError, KeyError, ValueError):
+            cache, labels = None, None
+        exists = labels is not None and cache["hash"] == key  # identical files
+        if not exists:  # run cache ops, only for new and changed files if the cache exists
+            previous = dict(cache, columns=labels.columns) if labels is not None else None
+            cache = self.cache_labels(cache_path, stats, previous)
+            columns = cache["columns"] if cache["index"] is None else None  # in memory if the store was not saved
+            labels = LabelStore(store_path, cache["index"], self.im_files, columns)
 
         # Display cache
         nf, nm, ne, nc, n = cache.pop("results")  # found, missing, empty, corrupt, total
@@ -147,26 +216,24 @@ class YOLODataset(BaseDataset):
             d = f"Scanning {cache_path}... {nf} images, {nm + ne} backgrounds, {nc} corrupt"
             TQDM(None, desc=self.prefix + d, total=n, initial=n)  # display results
             if cache["msgs"]:
-                LOGGER.info("\n".join(cache["msgs"]))  # display warnings
+                LOGGER.info("\n".join(cache["msgs"].values()))  # display warnings
 
         # Read cache
-        [cache.pop(k) for k in ("hash", "version", "msgs")]  # remove items
-        labels = cache["labels"]
-        if not labels:
+        if len(labels) < len(self.im_files):  # drop corrupt images
+            valid = labels.columns["file_results"][:, 3] == 0
+            self.im_files = labels.im_files = [f for f, v in zip(self.im_files, valid) if v]
+        if not len(labels):
             LOGGER.warning(f"WARNING ⚠️ No images found in {cache_path}, training may not work correctly. {HELP_URL}")
-        self.im_files = [lb["im_file"] for lb in labels]  # update im_files
 
         # Check if the dataset is all boxes or all segments
-        lengths = ((len(lb["cls"]), len(lb["bboxes"]), len(lb["segments"])) for lb in labels)
-        len_cls, len_boxes, len_segments = (sum(x) for x in zip(*lengths))
+        len_cls, len_boxes, len_segments = cache["counts"]
         if len_segments and len_boxes != len_segments:
             LOGGER.warning(
                 f"WARNING ⚠️ Box and segment counts should be equal, but got len(segments) = {len_segments}, "
                 f"len(boxes) = {len_boxes}. To resolve this only boxes will be used and all segments will be removed. "
                 "To avoid this please supply either a detect or segment dataset, not a detect-segment mixed dataset."
             )
-            for lb in labels:
-                lb["segments"] = []
+            labels.use_segments = False
         if len_cls == 0:
             LOGGER.warning(f"WARNING ⚠️ No labels found in {cache_path}, training may not work correctly. {HELP_URL}")
         return labels
@@ -189,6 +256,8 @@ class YOLODataset(BaseDataset):
                 batch_idx=True,
                 mask_ratio=hyp.mask_ratio,
                 mask_overlap=hyp.overlap_mask,
+                return_cls_mask=self.use_segments and hyp.combine_mask and self.augment,  # only read by the loss
+                mask_crops=hyp.mask_crops and self.augment,  # validators expect dense masks
                 bgr=hyp.bgr if self.augment else 0.0,  # only affect training.
             )
         )
@@ -239,16 +308,108 @@ class YOLODataset(BaseDataset):
             value = values[i]
             if k == "img":
                 value = torch.stack(value, 0)
-            if k in {"masks", "keypoints", "bboxes", "cls", "segments", "obb"}:
+            if k in {
+                "masks",
+                "keypoints",
+                "bboxes",
+                "cls",
+                "segments",
+                "obb",
+                "cls_masks",
+                "cls_masks_cls",
+                "mask_crops",
+                "mask_rois",
+                "cls_mask_crops",
+                "cls_mask_rois",
+            }:
                 value = torch.cat(value, 0)
             new_batch[k] = value
-        new_batch["batch_idx"] = list(new_batch["batch_idx"])
-        for i in range(len(new_batch["batch_idx"])):
-            new_batch["batch_idx"][i] += i  # add target image index for build_targets()
-        new_batch["batch_idx"] = torch.cat(new_batch["batch_idx"], 0)
+        for k in {"batch_idx", "cls_masks_idx"} & set(keys):
+            new_batch[k] = list(new_batch[k])
+            for i in range(len(new_batch[k])):
+                new_batch[k][i] += i  # add target image index for build_targets()
+            new_batch[k] = torch.cat(new_batch[k], 0)
         return new_batch
 
 
+class YOLOShardDataset(Dataset):
+    """
+    Dataset reading the preprocessed samples of a validation YOLODataset from a memory-mapped shard.
+
+    The shard is built once: every formatted sample (letterboxed image, boxes, classes, masks, ratio_pad, ...) is
+    written to a flat file next to the labels *.cache, with binary tensors such as GT masks bit-packed, and indexed
+    by a *.shard.cache file. Later validations read the samples zero-copy with np.memmap instead of decoding,
+    letterboxing and rasterizing them again. The shard is rebuilt when the dataset files or the preprocessing
+    settings change.
+
+    Args:
+        dataset (YOLODataset): Dataset without augmentation whose samples are stored in the shard.
+
+    Attributes:
+        dataset (YOLODataset): The source dataset, also used for any attribute the shard does not define.
+        path (Path): Path of the shard file.
+        index (List[List[tuple]]): Per sample (key, is_tensor, value) entries, where the value of a tensor is its
+            (offset, nbytes, dtype, shape, packed) location in the shard.
+    """
+
+    def __init__(self, dataset):
+        """Initializes the shard of a dataset, building it if it is missing or stale."""
+        self.dataset = dataset
+        self.path = Path(dataset.label_files[0]).parent.with_suffix(".shard")
+        self.shard = None  # opened lazily in each dataloader worker
+        cache_path, key = self.path.with_suffix(".shard.cache"), self.get_hash()
+        try:
+            cache = load_dataset_cache_file(cache_path)
+            assert cache["version"] == DATASET_CACHE_VERSION  # matches current version
+            assert cache["hash"] == key and self.path.exists()  # identical dataset and preprocessing
+        except (FileNotFoundError, AssertionError, AttributeError):
+            cache = self.build_shard(cache_path, key)
+        self.index = cache["index"]
+
+    def get_hash(self):
+        """Returns a hash of the dataset files and of the settings that change the preprocessed samples."""
+        d = self.dataset
+        settings = [d.imgsz, d.rect, d.stride, d.pad, d.single_cls, d.batch_shapes.tolist() if d.rect else None]
+        settings += [vars(t) for t in d.transforms.transforms]  # e.g. LetterBox and Format parameters
+        h = hashlib.sha256(get_hash(d.label_files + d.im_files).encode())
+        h.update(str(settings).encode())
+        return h.hexdigest()
+
+    def build_shard(self, cache_path, key):
+        """Writes the preprocessed samples of the dataset to the shard and saves its index to cache_path."""
+        index, offset, tmp = [], 0, self.path.with_suffix(".shard.tmp")
+        desc = f"{self.dataset.prefix}Building {self.path}..."
+        with open(tmp, "wb") as f, ThreadPool(NUM_THREADS) as pool:
+            samples = pool.imap(self.dataset.__getitem__, range(len(self.dataset)))
+            for sample in TQDM(samples, desc=desc, total=len(self.dataset)):
+                entry, offset = write_tensors(f, offset, sample)
+                index.append(entry)
+        tmp.replace(self.path)
+        x = {"hash": key, "index": index}
+        save_dataset_cache_file(self.dataset.prefix, cache_path, x, DATASET_CACHE_VERSION)
+        return x
+
+    def __getitem__(self, index):
+        """Returns the preprocessed sample at index read from the shard."""
+        if self.shard is None:
+            self.shard = np.memmap(self.path, dtype=np.uint8, mode="c")  # copy-on-write keeps views writable
+        return read_tensors(self.shard, self.index[index])
+
+    def __len__(self):
+        """Returns the number of samples in the shard."""
+        return len(self.index)
+
+    def __getstate__(self):
+        """Drops the memory map when pickled to dataloader workers, which open their own."""
+        return {**self.__dict__, "shard": None}
+
+    def __getattr__(self, name):
+        """Falls back to the source dataset, e.g. for collate_fn, labels and im_files."""
+        if name == "dataset":  # not set yet, e.g. while unpickling
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+
 class YOLOMultiModalDataset(YOLODataset):
     """
     Dataset class for loading object detection and/or segmentation labels in YOLO format.
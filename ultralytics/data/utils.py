@@ -4,15 +4,18 @@ import hashlib
 import json
 import os
 import random
+import struct
 import subprocess
 import time
 import zipfile
+from copy import copy
 from multiprocessing.pool import ThreadPool
 from pathlib import Path
 from tarfile import is_tarfile
 
 import cv2
 import numpy as np
+import torch
 from PIL import Image, ImageOps
 import pycocotools.mask as maskUtils
 from ultralytics.nn.autobackend import check_class_names
@@ -55,6 +58,20 @@ def get_hash(paths):
     return h.hexdigest()  # return hash
 
 
+def get_file_stats(paths):
+    """Returns the size and modification time in ns of each path as an (n, 2) int64 array, -1 for missing files."""
+
+    def stat(p):
+        """Returns the size and modification time of one path."""
+        try:
+            s = os.stat(p)
+            return s.st_size, s.st_mtime_ns
+        except OSError:
+            return -1, -1
+
+    return np.array([stat(p) for p in paths], dtype=np.int64).reshape(-1, 2)
+
+
 def exif_size(img: Image.Image):
     """Returns exif-corrected PIL size."""
     s = img.size  # (width, height)
@@ -69,6 +86,64 @@ def exif_size(img: Image.Image):
     return s
 
 
+def exif_orientation(tiff):
+    """Returns the orientation tag of the first IFD of EXIF TIFF data, or None."""
+    try:
+        e = "<" if tiff[:2] == b"II" else ">"  # byte order
+        ifd = struct.unpack(f"{e}I", tiff[4:8])[0]
+        for i in range(struct.unpack(f"{e}H", tiff[ifd : ifd + 2])[0]):
+            tag, _, _, value = struct.unpack(f"{e}HHI4s", tiff[ifd + 2 + 12 * i : ifd + 14 + 12 * i])
+            if tag == 274:  # the EXIF key for the orientation tag is 274
+                return struct.unpack(f"{e}H", value[:2])[0]
+    except struct.error:
+        pass
+    return None
+
+
+def read_image_header(im_file):
+    """
+    Returns the format and exif-corrected (width, height) of a JPEG or PNG image parsed from its header.
+
+    Only the markers and chunks before the image data are read, so this is much faster than opening the image with PIL
+    and matches `exif_size`. Returns None for other formats, PNGs with EXIF data or unparsable headers, for which PIL
+    should be used.
+    """
+    try:
+        with open(im_file, "rb") as f:
+            head = f.read(24)
+            if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+                f.seek(33)  # chunk after IHDR
+                while (chunk := f.read(8))[4:] not in {b"IDAT", b"IEND"}:  # chunks before the image data
+                    if chunk[4:] == b"eXIf" or len(chunk) < 8:  # EXIF orientation or truncated file
+                        return None
+                    f.seek(struct.unpack(">I", chunk[:4])[0] + 4, 1)  # skip data and CRC
+                return "png", struct.unpack(">II", head[16:24])
+            if head[:2] != b"\xff\xd8":
+                return None
+            f.seek(2)
+            rotation = None
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                if marker[1] == 0xFF:  # fill byte
+                    f.seek(-1, 1)
+                    continue
+                if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD8:  # markers without payload
+                    continue
+                n = struct.unpack(">H", f.read(2))[0]
+                if marker[1] in {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}:  # SOF
+                    h, w = struct.unpack(">xHH", f.read(5))
+                    return "jpeg", (h, w) if rotation in {6, 8} else (w, h)  # rotation 270 or 90
+                if marker[1] == 0xDA:  # image data before any frame header
+                    return None
+                data = f.read(n - 2)
+                if marker[1] == 0xE1 and rotation is None and data[:6] == b"Exif\x00\x00":
+                    rotation = exif_orientation(data[6:]) or 0
+    except (OSError, struct.error):
+        return None
+
+
 def verify_image(args):
     """Verify one image."""
     (im_file, cls), prefix = args
@@ -96,18 +171,20 @@ def verify_image(args):
 
 def verify_image_label(args):
     """Verify one image-label pair."""
-    im_file, lb_file, prefix, keypoint, num_cls, nkpt, ndim = args
+    im_file, lb_file, prefix, keypoint, num_cls, nkpt, ndim, check = args
     # Number (missing, found, empty, corrupt), message, segments, keypoints
     nm, nf, ne, nc, msg, segments, keypoints = 0, 0, 0, 0, "", [], None
     try:
-        # Verify images
-        im = Image.open(im_file)
-        im.verify()  # PIL verify
-        shape = exif_size(im)  # image size
+        # Verify images, reading only the header unless checked with PIL
+        if check or (header := read_image_header(im_file)) is None:
+            im = Image.open(im_file)
+            im.verify()  # PIL verify
+            header = im.format.lower(), exif_size(im)
+        fmt, shape = header
         shape = (shape[1], shape[0])  # hw
         assert (shape[0] > 9) & (shape[1] > 9), f"image size {shape} <10 pixels"
-        assert im.format.lower() in IMG_FORMATS, f"invalid image format {im.format}. {FORMATS_HELP_MSG}"
-        if im.format.lower() in {"jpg", "jpeg"}:
+        assert fmt in IMG_FORMATS, f"invalid image format {fmt}. {FORMATS_HELP_MSG}"
+        if fmt in {"jpg", "jpeg"}:
             with open(im_file, "rb") as f:
                 f.seek(-2, 2)
                 if f.read() != b"\xff\xd9":  # corrupt JPEG
@@ -214,6 +291,42 @@ def visualize_image_annotations(image_path, txt_path, label_map):
     plt.show()
 
 
+def polygon2crop(imgsz, polygon, downsample_ratio=1):
+    """
+    Rasterize a polygon inside its bounding box at the downsampled resolution, setting pixels covered at least half.
+
+    The polygon is filled with sub-pixel precision at the image resolution only inside its bounding box, then reduced by
+    area interpolation, so no image-sized canvas is allocated.
+
+    Args:
+        imgsz (tuple): The size of the image as (height, width).
+        polygon (np.ndarray): A polygon of shape [M, 2] or [2 * M] in image pixel coordinates.
+        downsample_ratio (int, optional): Factor by which to downsample the mask. Defaults to 1.
+
+    Returns:
+        crop (np.ndarray): A bool mask of the polygon's bounding box at the downsampled resolution.
+        offset (tuple): The (x, y) position of the crop in the downsampled mask.
+    """
+    r = downsample_ratio
+    nh, nw = (imgsz[0] // r, imgsz[1] // r)
+    points = (np.asarray(polygon, dtype=np.float32).reshape(-1, 2) * 256 - 128).astype(np.int32)  # 8-bit sub-pixels
+    if len(points) == 0:
+        return np.zeros((0, 0), dtype=bool), (0, 0)
+    x, y, w, h = cv2.boundingRect(points)  # cv2 pixel centers are integers, hence the -0.5 above
+    x0, y0 = max((x >> 8) // r, 0), max((y >> 8) // r, 0)
+    x1, y1 = min(((x + w - 1) >> 8) // r + 1, nw), min(((y + h - 1) >> 8) // r + 1, nh)
+    if x1 <= x0 or y1 <= y0:  # outside the image
+        return np.zeros((0, 0), dtype=bool), (0, 0)
+    crop = np.zeros(((y1 - y0) * r, (x1 - x0) * r), dtype=np.uint8)
+    cv2.fillPoly(crop, [points - ((x0 * r) << 8, (y0 * r) << 8)], color=255, shift=8)
+    while r > 1:  # average pixel blocks, halving is exact and faster with bilinear interpolation
+        f = 2 if r % 2 == 0 else r
+        size = (crop.shape[1] // f, crop.shape[0] // f)
+        crop = cv2.resize(crop, size, interpolation=cv2.INTER_LINEAR if f == 2 else cv2.INTER_AREA)
+        r //= f
+    return crop >= 128, (x0, y0)
+
+
 def polygon2mask(imgsz, polygons, color=1, downsample_ratio=1):
     """
     Convert a list of polygons to a binary mask of the specified image size.
@@ -228,13 +341,11 @@ def polygon2mask(imgsz, polygons, color=1, downsample_ratio=1):
     Returns:
         (np.ndarray): A binary mask of the specified image size with the polygons filled in.
     """
-    mask = np.zeros(imgsz, dtype=np.uint8)
-    polygons = np.asarray(polygons, dtype=np.int32)
-    polygons = polygons.reshape((polygons.shape[0], -1, 2))
-    cv2.fillPoly(mask, polygons, color=color)
-    nh, nw = (imgsz[0] // downsample_ratio, imgsz[1] // downsample_ratio)
-    # Note: fillPoly first then resize is trying to keep the same loss calculation method when mask-ratio=1
-    return cv2.resize(mask, (nw, nh))
+    mask = np.zeros((imgsz[0] // downsample_ratio, imgsz[1] // downsample_ratio), dtype=np.uint8)
+    for polygon in np.asarray(polygons, dtype=np.float32).reshape(len(polygons), -1, 2):
+        crop, (x, y) = polygon2crop(imgsz, polygon, downsample_ratio)
+        mask[y : y + crop.shape[0], x : x + crop.shape[1]][crop] = color
+    return mask
 
 
 def polygons2masks(imgsz, polygons, color, downsample_ratio=1):
@@ -251,28 +362,29 @@ def polygons2masks(imgsz, polygons, color, downsample_ratio=1):
     Returns:
         (np.ndarray): A set of binary masks of the specified image size with the polygons filled in.
     """
-    return np.array([polygon2mask(imgsz, [x.reshape(-1)], color, downsample_ratio) for x in polygons])
+    masks = np.zeros((len(polygons), imgsz[0] // downsample_ratio, imgsz[1] // downsample_ratio), dtype=np.uint8)
+    for mask, polygon in zip(masks, polygons):
+        crop, (x, y) = polygon2crop(imgsz, polygon, downsample_ratio)
+        mask[y : y + crop.shape[0], x : x + crop.shape[1]] = crop * np.uint8(color)
+    return masks
 
 
 def polygons2masks_overlap(imgsz, segments, downsample_ratio=1):
-    """Return a (640, 640) overlap mask."""
+    """
+    Return a (640, 640) overlap mask, where each pixel holds 1 + the index of the smallest instance covering it.
+
+    Instances are rasterized within their bounding boxes, sorted by area and drawn largest first in a single pass.
+    """
     masks = np.zeros(
         (imgsz[0] // downsample_ratio, imgsz[1] // downsample_ratio),
         dtype=np.int32 if len(segments) > 255 else np.uint8,
     )
-    areas = []
-    ms = []
-    for si in range(len(segments)):
-        mask = polygon2mask(imgsz, [segments[si].reshape(-1)], downsample_ratio=downsample_ratio, color=1)
-        ms.append(mask.astype(masks.dtype))
-        areas.append(mask.sum())
-    areas = np.asarray(areas)
+    crops = [polygon2crop(imgsz, segment, downsample_ratio) for segment in segments]
+    areas = np.asarray([crop.sum() for crop, _ in crops], dtype=np.int64)
     index = np.argsort(-areas)
-    ms = np.array(ms)[index]
-    for i in range(len(segments)):
-        mask = ms[i] * (i + 1)
-        masks = masks + mask
-        masks = np.clip(masks, a_min=0, a_max=i + 1)
+    for i, j in enumerate(index):
+        crop, (x, y) = crops[j]
+        masks[y : y + crop.shape[0], x : x + crop.shape[1]][crop] = i + 1
     return masks, index
 
 
@@ -719,3 +831,232 @@ def save_dataset_cache_file(prefix, path, x, version):
         LOGGER.info(f"{prefix}New cache created: {path}")
     else:
         LOGGER.warning(f"{prefix}WARNING ⚠️ Cache directory {path.parent} is not writeable, cache not saved.")
+
+
+def write_tensors(f, offset, sample):
+    """
+    Append the tensors of a dictionary to a binary file for zero-copy reading with `read_tensors`.
+
+    Tensors are 8-byte aligned and any 0/1 tensor is bit-packed, which is lossless; other values stay in the entry.
+
+    Args:
+        f (file): Binary file opened for writing, positioned at `offset`.
+        offset (int): Current size of the file.
+        sample (dict): Values to store.
+
+    Returns:
+        entry (List[tuple]): Per item (key, is_tensor, value), where the value of a tensor is its
+            (offset, nbytes, dtype, shape, packed) location in the file.
+        offset (int): Size of the file after writing.
+    """
+    entry = []
+    for k, v in sample.items():
+        if not isinstance(v, torch.Tensor):
+            entry.append((k, False, v))
+            continue
+        x = v.numpy()
+        packed = x.size >= 8 and bool(((x == 0) | (x == 1)).all())  # lossless for any 0/1 tensor
+        data = np.packbits(x.astype(bool)) if packed else np.ascontiguousarray(x)
+        f.write(bytes(-offset % 8))  # align tensors for zero-copy views
+        offset += -offset % 8
+        f.write(data.tobytes())
+        entry.append((k, True, (offset, data.nbytes, x.dtype.str, x.shape, packed)))
+        offset += data.nbytes
+    return entry, offset
+
+
+def read_tensors(buffer, entry):
+    """Return the dictionary written by `write_tensors` as `entry`, with tensors viewing `buffer` where unpacked."""
+    sample = {}
+    for k, is_tensor, v in entry:
+        if is_tensor:
+            offset, nbytes, dtype, shape, packed = v
+            data = buffer[offset : offset + nbytes]
+            if packed:
+                x = np.unpackbits(data, count=int(np.prod(shape))).astype(dtype).reshape(shape)
+            else:
+                x = data.view(dtype).reshape(shape)
+            v = torch.from_numpy(x)
+        sample[k] = v
+    return sample
+
+
+def ragged_arange(lo, hi):
+    """Returns the concatenation of np.arange(lo[i], hi[i]) over all i, vectorized."""
+    n = hi - lo
+    return np.repeat(lo - np.cumsum(n) + n, n) + np.arange(n.sum(), dtype=np.int64)
+
+
+class LabelStore:
+    """
+    Columnar, memory-mapped YOLO labels that behave like the list of per-image label dictionaries.
+
+    The classes, boxes, polygon vertices and keypoints of all images are concatenated into flat arrays saved in one
+    file, with offset arrays indexing the instances of each image and the vertices of each instance. Opening the store
+    only maps the file, so it loads in constant time regardless of the dataset size, and DDP ranks and dataloader
+    workers share the same read-only pages instead of each unpickling their own copy. The labels of an image are
+    copied out of the columns when it is indexed.
+
+    Args:
+        path (Path): Path of the store file.
+        index (dict): Location of each column in the file, as returned by `LabelStore.save`.
+        im_files (List[str]): Image file of each row.
+        columns (dict, optional): In-memory columns returned by `LabelStore.pack`, used instead of the file.
+
+    Attributes:
+        keep (np.ndarray | None): Per instance mask of the labels to return, set by `update`.
+        single_cls (bool): Whether all classes are returned as 0.
+        use_segments (bool): Whether segments are returned.
+        order (np.ndarray | None): Row of each label, e.g. sorted by aspect ratio for rectangular training.
+
+    Examples:
+        >>> columns = LabelStore.pack(labels)
+        >>> store = LabelStore(path, LabelStore.save(path, columns), im_files)
+        >>> store[0]["bboxes"]  # same as labels[0]["bboxes"]
+    """
+
+    def __init__(self, path, index, im_files, columns=None):
+        """Opens the store at path, or wraps in-memory columns if they are given."""
+        self.path, self.index, self.im_files = Path(path), index, im_files
+        self._columns = columns if columns is not None else self.load(self.path, index)
+        self.keep, self.single_cls, self.use_segments, self.order = None, False, True, None
+
+    @staticmethod
+    def pack(labels):
+        """Concatenates a list of label dictionaries into columns."""
+        n, cls, bboxes, vertices, lengths, keypoints = [], [], [], [], [], []
+        for lb in labels:
+            n.append(len(lb["cls"]))
+            cls.append(lb["cls"])
+            bboxes.append(lb["bboxes"])
+            vertices.extend(lb["segments"])
+            lengths.extend([len(s) for s in lb["segments"]] if lb["segments"] else [0] * n[-1])  # vertices per instance
+            if lb["keypoints"] is not None:
+                keypoints.append(lb["keypoints"])
+        columns = {
+            "shapes": np.array([lb["shape"] for lb in labels], dtype=np.int32).reshape(-1, 2),
+            "label_offsets": np.cumsum([0, *n], dtype=np.int64),
+            "cls": np.concatenate(cls, 0) if cls else np.zeros((0, 1), dtype=np.float32),
+            "bboxes": np.concatenate(bboxes, 0) if bboxes else np.zeros((0, 4), dtype=np.float32),
+            "segment_offsets": np.cumsum([0, *lengths], dtype=np.int64),
+            "vertices": np.concatenate(vertices, 0) if vertices else np.zeros((0, 2), dtype=np.float32),
+        }
+        if keypoints:
+            columns["keypoints"] = np.concatenate(keypoints, 0)
+        return columns
+
+    @staticmethod
+    def take(columns, rows):
+        """Returns the label columns of the given rows in their order, e.g. to drop or reorder images."""
+        lo, hi = columns["label_offsets"][rows], columns["label_offsets"][rows + 1]
+        instances = ragged_arange(lo, hi)
+        so = columns["segment_offsets"]
+        out = {
+            "shapes": columns["shapes"][rows],
+            "label_offsets": np.cumsum(np.r_[0, hi - lo], dtype=np.int64),
+            "cls": columns["cls"][instances],
+            "bboxes": columns["bboxes"][instances],
+            "segment_offsets": np.cumsum(np.r_[0, so[instances + 1] - so[instances]], dtype=np.int64),
+            "vertices": columns["vertices"][ragged_arange(so[instances], so[instances + 1])],
+        }
+        if "keypoints" in columns:
+            out["keypoints"] = columns["keypoints"][instances]
+        return out
+
+    @staticmethod
+    def concat(a, b):
+        """Returns the label columns of the rows of `a` followed by the rows of `b`."""
+        out = {}
+        for k in ("shapes", "cls", "bboxes", "vertices", "keypoints"):
+            if x := [c[k] for c in (a, b) if k in c and len(c[k])]:
+                out[k] = np.concatenate(x, 0)
+            elif k in a or k in b:
+                out[k] = a[k] if k in a else b[k]  # empty
+        for k in ("label_offsets", "segment_offsets"):
+            out[k] = np.concatenate((a[k], b[k][1:] + a[k][-1]))
+        return out
+
+    @staticmethod
+    def save(path, columns):
+        """Writes 8-byte aligned columns to path and returns their (offset, dtype, shape) index."""
+        index, offset, tmp = {}, 0, Path(path).with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            for k, x in columns.items():
+                f.write(bytes(-offset % 8))  # align columns for zero-copy views
+                offset += -offset % 8
+                f.write(np.ascontiguousarray(x).tobytes())
+                index[k] = (offset, x.dtype.str, x.shape)
+                offset += x.nbytes
+        tmp.replace(path)
+        return index
+
+    @staticmethod
+    def load(path, index):
+        """Returns read-only views of the columns saved at path."""
+        buffer = np.memmap(path, dtype=np.uint8, mode="r").view(np.ndarray)  # views keep the map open
+        columns = {}
+        for k, (offset, dtype, shape) in index.items():
+            dtype = np.dtype(dtype)
+            columns[k] = buffer[offset : offset + dtype.itemsize * int(np.prod(shape))].view(dtype).reshape(shape)
+        return columns
+
+    @property
+    def columns(self):
+        """Returns the columns, mapping the file again after unpickling."""
+        if self._columns is None:
+            self._columns = self.load(self.path, self.index)
+        return self._columns
+
+    @property
+    def shapes(self):
+        """Returns the (h, w) image shapes of all labels as an array."""
+        shapes = self.columns["shapes"]
+        return shapes[self.order] if self.order is not None else shapes.copy()
+
+    def update(self, include_class=None, single_cls=False):
+        """Keeps only the instances of the included classes and optionally merges all classes into class 0."""
+        if include_class is not None:
+            self.keep = (self.columns["cls"] == np.array(include_class).reshape(1, -1)).any(1)
+        self.single_cls = single_cls
+
+    def select(self, index):
+        """Returns a store of the labels at index, which shares the columns of this store."""
+        store = copy(self)
+        store.order = (self.order if self.order is not None else np.arange(len(self)))[index]
+        return store
+
+    def __getitem__(self, i):
+        """Returns the label dictionary of image i with arrays copied from the columns."""
+        c = self.columns
+        i = int(self.order[i]) if self.order is not None else range(len(self))[i]
+        j = np.arange(c["label_offsets"][i], c["label_offsets"][i + 1])  # instances of the image
+        if self.keep is not None:
+            j = j[self.keep[j]]
+        cls = c["cls"][j]  # advanced indexing copies
+        if self.single_cls:
+            cls[:, 0] = 0
+        so, segments = c["segment_offsets"], []
+        if self.use_segments and len(j) and so[j[-1] + 1] > so[j[0]]:
+            segments = [c["vertices"][so[k] : so[k + 1]].copy() for k in j]
+        return {
+            "im_file": self.im_files[i],
+            "shape": tuple(int(x) for x in c["shapes"][i]),
+            "cls": cls,
+            "bboxes": c["bboxes"][j],
+            "segments": segments,
+            "keypoints": c["keypoints"][j] if "keypoints" in c else None,
+            "normalized": True,
+            "bbox_format": "xywh",
+        }
+
+    def __len__(self):
+        """Returns the number of labels."""
+        return len(self.order) if self.order is not None else len(self.columns["shapes"])
+
+    def __iter__(self):
+        """Iterates over the label dictionaries."""
+        return (self[i] for i in range(len(self)))
+
+    def __getstate__(self):
+        """Drops the mapped columns when pickled, e.g. to spawned dataloader workers, which map the file again."""
+        return {**self.__dict__, "_columns": None} if self.index is not None else self.__dict__
@@ -284,17 +284,20 @@ class BaseTrainer:
         # Dataloaders
         batch_size = self.batch_size // max(world_size, 1)
         self.train_loader = self.get_dataloader(self.trainset, batch_size=batch_size, rank=LOCAL_RANK, mode="train")
-        if RANK in {-1, 0}:
+        if RANK in {-1, 0} or self.args.dist_val:  # with dist_val every rank validates a shard of the val set
             # Note: When training DOTA dataset, double batch size could get OOM on images with >2000 objects.
             self.test_loader = self.get_dataloader(
-                self.testset, batch_size=batch_size if self.args.task == "obb" else batch_size * 2, rank=-1, mode="val"
+                self.testset,
+                batch_size=batch_size if self.args.task == "obb" else batch_size * 2,
+                rank=LOCAL_RANK if self.args.dist_val else -1,
+                mode="val",
             )
             self.validator = self.get_validator()
             metric_keys = self.validator.metrics.keys + self.label_loss_items(prefix="val")
             self.metrics = dict(zip(metric_keys, [0] * len(metric_keys)))
             self.ema = ModelEMA(self.model)
-            if self.args.plots:
-                self.plot_training_labels()
+        if RANK in {-1, 0} and self.args.plots:
+            self.plot_training_labels()
 
         # Optimizer
         self.accumulate = max(round(self.args.nbs / self.batch_size), 1)  # accumulate loss before optimizing
@@ -423,13 +426,17 @@ class BaseTrainer:
 
             self.lr = {f"lr/pg{ir}": x["lr"] for ir, x in enumerate(self.optimizer.param_groups)}  # for loggers
             self.run_callbacks("on_train_epoch_end")
-            if RANK in {-1, 0}:
-                final_epoch = epoch + 1 >= self.epochs
+            final_epoch = epoch + 1 >= self.epochs
+            if RANK in {-1, 0} or self.args.dist_val:
                 self.ema.update_attr(self.model, include=["yaml", "nc", "args", "names", "stride", "class_weights"])
 
                 # Validation
-                if self.args.val or final_epoch or self.stopper.possible_stop or self.stop:
+                run_val = [self.args.val or final_epoch or self.stopper.possible_stop or self.stop]
+                if RANK != -1 and self.args.dist_val:  # rank 0 owns the stopper, all ranks must validate together
+                    dist.broadcast_object_list(run_val, 0)
+                if run_val[0]:
                     self.metrics, self.fitness = self.validate()
+            if RANK in {-1, 0}:
                 self.save_metrics(metrics={**self.label_loss_items(self.tloss), **self.metrics, **self.lr})
                 self.stop |= self.stopper(epoch + 1, self.fitness) or final_epoch
                 if self.args.time:
@@ -688,11 +695,19 @@ class BaseTrainer:
                     k = "train_results"  # update best.pt train_metrics from last.pt
                     strip_optimizer(f, updates={k: ckpt[k]} if k in ckpt else None)
                     LOGGER.info(f"\nValidating {f}...")
+                    self.unshard_val_loader()
                     self.validator.args.plots = self.args.plots
                     self.metrics = self.validator(model=f)
                     self.metrics.pop("fitness", None)
                     self.run_callbacks("on_fit_epoch_end")
 
+    def unshard_val_loader(self):
+        """Gives the validator a dataloader of the whole val set if dist_val split it across the DDP ranks."""
+        if self.args.dist_val and RANK != -1:  # rank 0 validates alone after training, not only its shard
+            self.validator.dataloader = self.get_dataloader(
+                self.testset, batch_size=self.test_loader.batch_size, rank=-1, mode="val"
+            )
+
     def check_resume(self, overrides):
         """Check if resume checkpoint exists and update arguments accordingly."""
         resume = self.args.resume
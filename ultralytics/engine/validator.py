@@ -23,6 +23,7 @@ Usage - formats:
                           yolo11n_rknn_model         # Rockchip RKNN
 """
 
+import contextlib
 import json
 import time
 from pathlib import Path
@@ -33,9 +34,10 @@ import torch
 from ultralytics.cfg import get_cfg, get_save_dir
 from ultralytics.data.utils import check_cls_dataset, check_det_dataset
 from ultralytics.nn.autobackend import AutoBackend
-from ultralytics.utils import LOGGER, TQDM, callbacks, colorstr, emojis
+from ultralytics.utils import LOGGER, RANK, TQDM, callbacks, colorstr, emojis
 from ultralytics.utils.checks import check_imgsz
-from ultralytics.utils.ops import Profile
+from ultralytics.utils.dist import reduce_sum
+from ultralytics.utils.ops import Profile, StageProfiler
 from ultralytics.utils.torch_utils import de_parallel, select_device, smart_inference_mode
 
 
@@ -63,6 +65,9 @@ class BaseValidator:
         jdict (dict): Dictionary to store JSON validation results.
         speed (dict): Dictionary with keys 'preprocess', 'inference', 'loss', 'postprocess' and their respective
                       batch processing times in milliseconds.
+        profiler (StageProfiler): Per-image stage times and memory, recorded when `val_profile` is set.
+        resources (contextlib.ExitStack): Workers and files opened by `init_metrics`, released when a validation ends
+            or fails.
         save_dir (Path): Directory to save results.
         plots (dict): Dictionary to store plots for visualization.
         callbacks (dict): Dictionary to store various callback functions.
@@ -95,6 +100,8 @@ class BaseValidator:
         self.iouv = None
         self.jdict = None
         self.speed = {"preprocess": 0.0, "inference": 0.0, "loss": 0.0, "postprocess": 0.0}
+        self.profiler = StageProfiler(enabled=False)
+        self.resources = contextlib.ExitStack()
 
         self.save_dir = save_dir or get_save_dir(self.args)
         (self.save_dir / "labels" if self.args.save_txt else self.save_dir).mkdir(parents=True, exist_ok=True)
@@ -120,6 +127,7 @@ class BaseValidator:
             # self.model = model
             self.loss = torch.zeros_like(trainer.loss_items, device=trainer.device)
             self.args.plots &= trainer.stopper.possible_stop or (trainer.epoch == trainer.epochs - 1)
+            self.args.plots &= RANK in {-1, 0}  # dist_val runs on every rank
             model.eval()
         else:
             if str(self.args.model).endswith(".yaml") and model is None:
@@ -167,39 +175,54 @@ class BaseValidator:
             Profile(device=self.device),
             Profile(device=self.device),
         )
+        self.profiler = StageProfiler(device=self.device, enabled=self.args.val_profile)
+        profile = self.profiler
         bar = TQDM(self.dataloader, desc=self.get_desc(), total=len(self.dataloader))
-        self.init_metrics(de_parallel(model))
-        self.jdict = []  # empty before each val
-        for batch_i, batch in enumerate(bar):
-            self.run_callbacks("on_val_batch_start")
-            self.batch_i = batch_i
-            # Preprocess
-            with dt[0]:
-                batch = self.preprocess(batch)
-
-            # Inference
-            with dt[1]:
-                preds = model(batch["img"], augment=augment)
-
-            # Loss
-            with dt[2]:
-                if self.training:
-                    self.loss += model.loss(batch, preds)[1]
-
-            # Postprocess
-            with dt[3]:
-                preds = self.postprocess(preds)
-            self.update_metrics(preds, batch)
-            if self.args.plots and batch_i < 3:
-                self.plot_val_samples(batch, batch_i)
-                self.plot_predictions(batch, preds, batch_i)
-
-            self.run_callbacks("on_val_batch_end")
-        stats = self.get_stats()
-        self.check_stats(stats)
-        self.speed = dict(zip(self.speed.keys(), (x.t / len(self.dataloader.dataset) * 1e3 for x in dt)))
-        self.finalize_metrics()
+        with self.resources:  # release the workers and files of init_metrics, also if validation fails
+            self.init_metrics(de_parallel(model))
+            self.jdict = []  # empty before each val
+            t = time.perf_counter()
+            for batch_i, batch in enumerate(bar):
+                profile.batch = batch_i
+                profile.add("dataloader", (time.perf_counter() - t) * 1e3)  # wait for the batch
+                self.run_callbacks("on_val_batch_start")
+                self.batch_i = batch_i
+                # Preprocess
+                with dt[0], profile("preprocess"):
+                    batch = self.preprocess(batch)
+
+                # Inference
+                with dt[1], profile("inference"):
+                    preds = model(batch["img"], augment=augment)
+
+                # Loss
+                with dt[2], profile("loss"):
+                    if self.training:
+                        self.loss += model.loss(batch, preds)[1]
+
+                # Postprocess
+                with dt[3], profile("postprocess"):
+                    preds = self.postprocess(preds)
+                with profile("metrics"):
+                    self.update_metrics(preds, batch)
+                if self.args.plots and batch_i < 3:
+                    with profile("plots"):
+                        self.plot_val_samples(batch, batch_i)
+                        self.plot_predictions(batch, preds, batch_i)
+
+                self.run_callbacks("on_val_batch_end")
+                t = time.perf_counter()
+            if self.training and self.args.dist_val and RANK != -1:  # merge the shards validated by each DDP rank
+                nb = reduce_sum(len(self.dataloader), self.device)
+                self.loss = reduce_sum(self.loss) * len(self.dataloader) / nb  # divided by len(self.dataloader) below
+                self.reduce_states()
+            stats = self.get_stats()
+            self.check_stats(stats)
+            self.speed = dict(zip(self.speed.keys(), (x.t / len(self.dataloader.dataset) * 1e3 for x in dt)))
+            self.finalize_metrics()
         self.print_results()
+        if self.args.val_profile and RANK in {-1, 0}:
+            self.print_profile()
         self.run_callbacks("on_val_end")
         if self.training:
             model.float()
@@ -215,11 +238,22 @@ class BaseValidator:
                 with open(str(self.save_dir / "predictions.json"), "w") as f:
                     LOGGER.info(f"Saving {f.name}...")
                     json.dump(self.jdict, f)  # flatten and save
+            if self.args.save_json:
                 stats = self.eval_json(stats)  # update stats
             if self.args.plots or self.args.save_json:
                 LOGGER.info(f"Results saved to {colorstr('bold', self.save_dir)}")
             return stats
 
+    def print_profile(self):
+        """Saves the stage trace of this validation to val_profile.csv and val_profile.json and logs its summary."""
+        summary = self.profiler.save(self.save_dir / "val_profile.csv", len(self.dataloader.dataset))
+        LOGGER.info(("%22s" + "%11s" * 5) % ("Stage", "Calls", "Total(s)", "ms/image", "Share", "Mem(MB)"))
+        for x in summary:
+            LOGGER.info(
+                ("%22s" + "%11i" + "%11.3g" * 4)
+                % (x["stage"], x["calls"], x["ms"] / 1e3, x["ms_per_image"], x["share"], x["peak_mem"])
+            )
+
     def match_predictions(self, pred_classes, true_classes, iou, use_scipy=False):
         """
         Matches predictions to ground truth objects (pred_classes, true_classes) using IoU.
@@ -233,35 +267,55 @@ class BaseValidator:
         Returns:
             (torch.Tensor): Correct tensor of shape(N,10) for 10 IoU thresholds.
         """
-        # Dx10 matrix, where D - detections, 10 - IoU thresholds
-        correct = np.zeros((pred_classes.shape[0], self.iouv.shape[0])).astype(bool)
         # LxD matrix where L - labels (rows), D - detections (columns)
         correct_class = true_classes[:, None] == pred_classes
         iou = iou * correct_class  # zero out the wrong classes
+        if not use_scipy:
+            return self.match_greedy(iou)
+        # WARNING: known issue that reduces mAP in https://github.com/ultralytics/ultralytics/pull/4708
+        import scipy  # scope import to avoid importing for all commands
+
+        # Dx10 matrix, where D - detections, 10 - IoU thresholds
+        correct = np.zeros((pred_classes.shape[0], self.iouv.shape[0])).astype(bool)
         iou = iou.cpu().numpy()
         for i, threshold in enumerate(self.iouv.cpu().tolist()):
-            if use_scipy:
-                # WARNING: known issue that reduces mAP in https://github.com/ultralytics/ultralytics/pull/4708
-                import scipy  # scope import to avoid importing for all commands
-
-                cost_matrix = iou * (iou >= threshold)
-                if cost_matrix.any():
-                    labels_idx, detections_idx = scipy.optimize.linear_sum_assignment(cost_matrix)
-                    valid = cost_matrix[labels_idx, detections_idx] > 0
-                    if valid.any():
-                        correct[detections_idx[valid], i] = True
-            else:
-                matches = np.nonzero(iou >= threshold)  # IoU > threshold and classes match
-                matches = np.array(matches).T
-                if matches.shape[0]:
-                    if matches.shape[0] > 1:
-                        matches = matches[iou[matches[:, 0], matches[:, 1]].argsort()[::-1]]
-                        matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
-                        # matches = matches[matches[:, 2].argsort()[::-1]]
-                        matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
-                    correct[matches[:, 1].astype(int), i] = True
+            cost_matrix = iou * (iou >= threshold)
+            if cost_matrix.any():
+                labels_idx, detections_idx = scipy.optimize.linear_sum_assignment(cost_matrix)
+                valid = cost_matrix[labels_idx, detections_idx] > 0
+                if valid.any():
+                    correct[detections_idx[valid], i] = True
         return torch.tensor(correct, dtype=torch.bool, device=pred_classes.device)
 
+    def match_greedy(self, iou):
+        """
+        Greedily matches detections to labels at every IoU threshold at once, on the device of `iou`.
+
+        At each threshold, every detection is paired with the label it overlaps most, and every label keeps the first
+        of its paired detections whose IoU reaches the threshold. The label a detection overlaps most does not depend on
+        the threshold, so sorting the detections by that label once resolves all thresholds with a cumulative count.
+
+        Args:
+            iou (torch.Tensor): An LxD tensor of IoU between labels and detections, zero for mismatched classes.
+
+        Returns:
+            (torch.Tensor): Correct tensor of shape(D,10) for 10 IoU thresholds.
+        """
+        nl, nd = iou.shape
+        if nl == 0 or nd == 0:
+            return torch.zeros((nd, len(self.iouv)), dtype=torch.bool, device=iou.device)
+        best, label = iou.flip(0).max(0)  # the last of tied labels, as a stable descending sort of the pairs
+        label = nl - 1 - label
+        order = torch.sort(label, stable=True)[1]  # detections grouped by label, in index order
+        valid = (best[order, None] >= self.iouv.to(iou.device)).int()  # (D, 10), paired IoU reaches the threshold
+        count = valid.cumsum(0) - valid  # valid detections before each one
+        first = torch.ones(nd, dtype=torch.bool, device=iou.device)
+        first[1:] = label[order[1:]] != label[order[:-1]]
+        count -= count[first][first.cumsum(0) - 1]  # ... of the same label
+        correct = torch.empty((nd, len(self.iouv)), dtype=torch.bool, device=iou.device)
+        correct[order] = (valid == 1) & (count == 0)
+        return correct
+
     def add_callback(self, event: str, callback):
         """Appends the given callback."""
         self.callbacks[event].append(callback)
@@ -339,4 +393,4 @@ class BaseValidator:
 
     def eval_json(self, stats):
         """Evaluate and return JSON format of prediction statistics."""
-        pass
+        return stats
@@ -81,7 +81,8 @@ class ClassificationTrainer(BaseTrainer):
         with torch_distributed_zero_first(rank):  # init dataset *.cache only once if DDP
             dataset = self.build_dataset(dataset_path, mode)
 
-        loader = build_dataloader(dataset, batch_size, self.args.workers, rank=rank)
+        shard = self.args.dist_val and mode != "train"  # split the val set across the DDP ranks
+        loader = build_dataloader(dataset, batch_size, self.args.workers, rank=rank, shard=shard)
         # Attach inference transforms
         if mode != "train":
             if is_parallel(self.model):
@@ -136,6 +137,7 @@ class ClassificationTrainer(BaseTrainer):
                 strip_optimizer(f)  # strip optimizers
                 if f is self.best:
                     LOGGER.info(f"\nValidating {f}...")
+                    self.unshard_val_loader()
                     self.validator.args.data = self.args.data
                     self.validator.args.plots = self.args.plots
                     self.metrics = self.validator(model=f)
@@ -71,6 +71,14 @@ class ClassificationValidator(BaseValidator):
         self.metrics.confusion_matrix = self.confusion_matrix
         self.metrics.save_dir = self.save_dir
 
+    def reduce_states(self):
+        """Gathers the top-5 predictions and targets of all DDP ranks, each of which validated a disjoint shard."""
+        local = [torch.cat(self.pred, 0), torch.cat(self.targets, 0)] if self.pred else []
+        shards = [None] * torch.distributed.get_world_size()
+        torch.distributed.all_gather_object(shards, local)
+        self.pred = [shard[0] for shard in shards if shard]
+        self.targets = [shard[1] for shard in shards if shard]
+
     def postprocess(self, preds):
         """Preprocesses the classification predictions."""
         return preds[0] if isinstance(preds, (list, tuple)) else preds
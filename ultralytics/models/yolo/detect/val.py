@@ -10,6 +10,7 @@ from ultralytics.data import build_dataloader, build_yolo_dataset, converter
 from ultralytics.engine.validator import BaseValidator
 from ultralytics.utils import LOGGER, ops
 from ultralytics.utils.checks import check_requirements
+from ultralytics.utils.dist import reduce_sum
 from ultralytics.utils.metrics import ConfusionMatrix, DetMetrics, box_iou
 from ultralytics.utils.plotting import output_to_target, plot_images
 
@@ -93,18 +94,19 @@ class DetectionValidator(BaseValidator):
 
     def postprocess(self, preds):
         """Apply Non-maximum suppression to prediction outputs."""
-        return ops.non_max_suppression(
-            preds,
-            self.args.conf,
-            self.args.iou,
-            labels=self.lb,
-            nc=self.nc,
-            multi_label=True,
-            agnostic=self.args.single_cls or self.args.agnostic_nms,
-            max_det=self.args.max_det,
-            end2end=self.end2end,
-            rotated=self.args.task == "obb",
-        )
+        with self.profiler("nms"):
+            return ops.non_max_suppression(
+                preds,
+                self.args.conf,
+                self.args.iou,
+                labels=self.lb,
+                nc=self.nc,
+                multi_label=True,
+                agnostic=self.args.single_cls or self.args.agnostic_nms,
+                max_det=self.args.max_det,
+                end2end=self.end2end,
+                rotated=self.args.task == "obb",
+            )
 
     def _prepare_batch(self, si, batch):
         """Prepares a batch of images and annotations for validation."""
@@ -129,6 +131,7 @@ class DetectionValidator(BaseValidator):
 
     def update_metrics(self, preds, batch):
         """Metrics."""
+        cm = []  # (detections, gt_bboxes, gt_cls) per image for one confusion matrix update
         for si, pred in enumerate(preds):
             self.seen += 1
             npr = len(pred)
@@ -147,7 +150,7 @@ class DetectionValidator(BaseValidator):
                     for k in self.stats.keys():
                         self.stats[k].append(stat[k])
                     if self.args.plots:
-                        self.confusion_matrix.process_batch(detections=None, gt_bboxes=bbox, gt_cls=cls)
+                        cm.append((None, bbox, cls))
                 continue
 
             # Predictions
@@ -159,28 +162,43 @@ class DetectionValidator(BaseValidator):
 
             # Evaluate
             if nl:
-                stat["tp"] = self._process_batch(predn, bbox, cls)
+                with self.profiler("match", si):
+                    stat["tp"] = self._process_batch(predn, bbox, cls)
             if self.args.plots:
-                self.confusion_matrix.process_batch(predn, bbox, cls)
+                cm.append((predn, bbox, cls))
             for k in self.stats.keys():
                 self.stats[k].append(stat[k])
 
             # Save
             if self.args.save_json:
-                self.pred_to_json(predn, batch["im_file"][si])
+                with self.profiler("json", si):
+                    self.pred_to_json(predn, batch["im_file"][si])
             if self.args.save_txt:
-                self.save_one_txt(
-                    predn,
-                    self.args.save_conf,
-                    pbatch["ori_shape"],
-                    self.save_dir / "labels" / f"{Path(batch['im_file'][si]).stem}.txt",
-                )
+                with self.profiler("txt", si):
+                    self.save_one_txt(
+                        predn,
+                        self.args.save_conf,
+                        pbatch["ori_shape"],
+                        self.save_dir / "labels" / f"{Path(batch['im_file'][si]).stem}.txt",
+                    )
+        if cm:
+            with self.profiler("confusion_matrix"):
+                self.confusion_matrix.process_images(cm)
 
     def finalize_metrics(self, *args, **kwargs):
         """Set final values for metrics speed and confusion matrix."""
         self.metrics.speed = self.speed
         self.metrics.confusion_matrix = self.confusion_matrix
 
+    def reduce_states(self):
+        """Gathers the prediction statistics and sums the image counts and confusion matrices of all DDP ranks."""
+        local = {k: [torch.cat(v, 0).cpu()] if v else [] for k, v in self.stats.items()}
+        shards = [None] * torch.distributed.get_world_size()
+        torch.distributed.all_gather_object(shards, local)
+        self.stats = {k: [x for shard in shards for x in shard[k]] for k in self.stats}
+        self.seen = reduce_sum(self.seen, self.device)
+        self.confusion_matrix.matrix = reduce_sum(self.confusion_matrix.matrix, self.device)
+
     def get_stats(self):
         """Returns metrics statistics and results dictionary."""
         stats = {k: torch.cat(v, 0).cpu().numpy() for k, v in self.stats.items()}  # to numpy
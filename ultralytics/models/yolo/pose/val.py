@@ -92,6 +92,7 @@ class PoseValidator(DetectionValidator):
 
     def update_metrics(self, preds, batch):
         """Metrics."""
+        cm = []  # (detections, gt_bboxes, gt_cls) per image for one confusion matrix update
         for si, pred in enumerate(preds):
             self.seen += 1
             npr = len(pred)
@@ -111,7 +112,7 @@ class PoseValidator(DetectionValidator):
                     for k in self.stats.keys():
                         self.stats[k].append(stat[k])
                     if self.args.plots:
-                        self.confusion_matrix.process_batch(detections=None, gt_bboxes=bbox, gt_cls=cls)
+                        cm.append((None, bbox, cls))
                 continue
 
             # Predictions
@@ -126,7 +127,7 @@ class PoseValidator(DetectionValidator):
                 stat["tp"] = self._process_batch(predn, bbox, cls)
                 stat["tp_p"] = self._process_batch(predn, bbox, cls, pred_kpts, pbatch["kpts"])
             if self.args.plots:
-                self.confusion_matrix.process_batch(predn, bbox, cls)
+                cm.append((predn, bbox, cls))
 
             for k in self.stats.keys():
                 self.stats[k].append(stat[k])
@@ -142,6 +143,8 @@ class PoseValidator(DetectionValidator):
                     pbatch["ori_shape"],
                     self.save_dir / "labels" / f"{Path(batch['im_file'][si]).stem}.txt",
                 )
+        if cm:
+            self.confusion_matrix.process_images(cm)
 
     def _process_batch(self, detections, gt_bboxes, gt_cls, pred_kpts=None, gt_kpts=None):
         """
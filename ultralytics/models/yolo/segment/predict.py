@@ -4,6 +4,7 @@ from ultralytics.engine.results import Results
 from ultralytics.models.yolo.detect.predict import DetectionPredictor
 from ultralytics.utils import DEFAULT_CFG, ops
 import torch
+import torchvision
 
 class SegmentationPredictor(DetectionPredictor):
     """
@@ -26,8 +27,16 @@ class SegmentationPredictor(DetectionPredictor):
         self.args.task = "segment"
         self.combine_mask = True if self.args.combine_mask else False
 
+    def inference(self, im, *args, **kwargs):
+        """Runs inference, letting a combine_mask head defer its class mask planes to after NMS if `lazy_mask`."""
+        if self.combine_mask and (self.model.pt or self.model.nn_module):
+            self.model.model.model[-1].lazy_mask = self.args.lazy_mask
+        return super().inference(im, *args, **kwargs)
+
     def postprocess(self, preds, img, orig_imgs, **kwargs):
         """Applies non-max suppression and processes detections for each image in an input batch."""
+        if getattr(self.model, "mask_gather", False):  # exported top detections with box-local mask crops
+            return self.postprocess_mask_crops(preds, img, orig_imgs)
         if isinstance(preds[1], tuple) and len(preds[1]) == 2:
             pred, proto, mask_pred = preds[0], preds[1][1], preds[2]
         else:
@@ -38,6 +47,39 @@ class SegmentationPredictor(DetectionPredictor):
 
         return super().postprocess(pred, img, orig_imgs, mask_preds=mask_pred if self.combine_mask else None, protos=proto, **kwargs)
 
+    def postprocess_mask_crops(self, preds, img, orig_imgs):
+        """
+        Filters and suppresses the top detections of a model exported with mask_gather and pastes their mask crops.
+
+        Args:
+            preds (List[torch.Tensor]): Detections of shape (B, max_det, 6) as [x1, y1, x2, y2, score, class] and their
+                mask crops of shape (B, max_det, S, S).
+            img (torch.Tensor): The image after preprocessing.
+            orig_imgs (List[np.ndarray] | torch.Tensor): The original images before preprocessing.
+
+        Returns:
+            (list): List of result objects with the kept boxes and their masks.
+        """
+        if not isinstance(orig_imgs, list):  # input images are a torch.Tensor, not a list
+            orig_imgs = ops.convert_torch2numpy_batch(orig_imgs)
+        results = []
+        for det, crops, orig_img, img_path in zip(*preds[:2], orig_imgs, self.batch[0]):
+            keep = det[:, 4] > self.args.conf
+            if self.args.classes is not None:
+                keep &= (det[:, 5:6] == torch.tensor(self.args.classes, device=det.device)).any(1)
+            det, crops = det[keep], crops[keep]
+            groups = det[:, 5] * (0 if self.args.agnostic_nms else 1)
+            i = torchvision.ops.batched_nms(det[:, :4], det[:, 4], groups, self.args.iou)[: self.args.max_det]
+            det, crops = det[i], crops[i]
+            if self.args.retina_masks:
+                det[:, :4] = ops.scale_boxes(img.shape[2:], det[:, :4], orig_img.shape)
+                masks = ops.paste_mask_crops(crops, det[:, :4], orig_img.shape[:2])
+            else:
+                masks = ops.paste_mask_crops(crops, det[:, :4], img.shape[2:])
+                det[:, :4] = ops.scale_boxes(img.shape[2:], det[:, :4], orig_img.shape)
+            results.append(Results(orig_img, None, path=img_path, names=self.model.names, boxes=det, masks=masks))
+        return results
+
     def construct_results(self, preds, img, orig_imgs, protos, mask_preds=None):
         """
         Constructs a list of result objects from the predictions.
@@ -48,16 +90,29 @@ class SegmentationPredictor(DetectionPredictor):
             orig_imgs (List[np.ndarray]): List of original images before preprocessing.
             protos (List[torch.Tensor]): List of prototype masks.
             mask_pred(List[torch.Tensor]): List of predicted masks (optional).
-                not None if self.combine_mask is True.
+                not None if self.combine_mask is True, the mask_pred weight and bias if the head is lazy.
 
         Returns:
             (list): List of result objects containing the original images, image paths, class names, bounding boxes, and masks.
         """
         assert (mask_preds is not None) == self.combine_mask, "mask_preds should be None if self.combine_mask is False, or vise versa."
         if self.combine_mask:
+            if isinstance(mask_preds, tuple):  # lazy head, compute only the class planes of the kept detections
+                planes = [ops.combine_mask_planes(p, *mask_preds, x[:, 5]) for p, x in zip(protos, preds)]
+                mask_preds, index = map(list, zip(*planes))
+            else:
+                index = [x[:, 5] for x in preds]
+            if self.args.retina_masks:  # original image sizes differ, see construct_result
+                masks = [None] * len(preds)
+            else:  # gather, crop and upsample the class planes of the whole batch at once
+                masks = ops.process_combine_mask_batch(
+                    mask_preds, preds, img.shape[2:], per_class=self.args.mask_per_class, index=index
+                )
             return [
-                self.construct_result(pred, img, orig_img, img_path, proto, mask_pred)
-                for pred, orig_img, img_path, proto, mask_pred in zip(preds, orig_imgs, self.batch[0], protos, mask_preds)
+                self.construct_result(pred, img, orig_img, img_path, proto, mask_pred, masks=mask, mask_index=i)
+                for pred, orig_img, img_path, proto, mask_pred, mask, i in zip(
+                    preds, orig_imgs, self.batch[0], protos, mask_preds, masks, index
+                )
             ]
         else:
             return [
@@ -65,7 +120,9 @@ class SegmentationPredictor(DetectionPredictor):
                 for pred, orig_img, img_path, proto in zip(preds, orig_imgs, self.batch[0], protos)
             ]
 
-    def construct_result(self, pred, img, orig_img, img_path, proto, mask_pred=None, gt=None):
+    def construct_result(
+        self, pred, img, orig_img, img_path, proto, mask_pred=None, gt=None, masks=None, mask_index=None
+    ):
         """
         Constructs the result object from the prediction.
 
@@ -79,6 +136,8 @@ class SegmentationPredictor(DetectionPredictor):
             proto (torch.Tensor): The prototype masks.
             mask_pred (torch.Tensor): The predicted masks (optional).
                 not None if self.combine_mask is True.
+            masks (torch.Tensor): Masks already computed from mask_pred for the whole batch (optional).
+            mask_index (torch.Tensor): Index of each box's plane in mask_pred (optional), defaults to its class.
         Returns:
             (Results): The result object containing the original image, image path, class names, bounding boxes, and masks.
         """
@@ -91,7 +150,15 @@ class SegmentationPredictor(DetectionPredictor):
             else:
                 masks = ops.process_mask(proto, pred[:, 6:], pred[:, :4], img.shape[2:], upsample=True)  # HWC
                 pred[:, :4] = ops.scale_boxes(img.shape[2:], pred[:, :4], orig_img.shape)
+        elif self.args.retina_masks:
+            pred[:, :4] = ops.scale_boxes(img.shape[2:], pred[:, :4], orig_img.shape)
+            mask_index = pred[:, 5] if mask_index is None else mask_index
+            masks = ops.process_combine_mask_native(mask_pred, mask_index, pred[:, :4], orig_img.shape[:2])  # CHW
         else:
-            masks = ops.process_combine_mask(mask_pred, pred[:, 5], pred[:, :4], img.shape[2:], upsample=True)  # HWC
+            if masks is None:
+                mask_index = pred[:, 5] if mask_index is None else mask_index
+                masks = ops.process_combine_mask(
+                    mask_pred, mask_index, pred[:, :4], img.shape[2:], upsample=True, per_class=self.args.mask_per_class
+                )  # CHW
             pred[:, :4] = ops.scale_boxes(img.shape[2:], pred[:, :4], orig_img.shape)
         return Results(orig_img, gt, path=img_path, names=self.model.names, boxes=pred[:, :6], masks=masks)
@@ -4,7 +4,7 @@ from copy import copy
 
 from ultralytics.models import yolo
 from ultralytics.nn.tasks import SegmentationModel
-from ultralytics.utils import DEFAULT_CFG, RANK
+from ultralytics.utils import DEFAULT_CFG, RANK, ops
 from ultralytics.utils.plotting import plot_images, plot_results
 import torch
 
@@ -53,12 +53,30 @@ class SegmentationTrainer(yolo.detect.DetectionTrainer):
             batch["batch_idx"],
             batch["cls"].squeeze(-1),
             batch["bboxes"],
-            masks=batch["masks"],
+            masks=self.get_plot_masks(batch),
             paths=batch["im_file"],
             fname=self.save_dir / f"train_batch{ni}.jpg",
             on_plot=self.on_plot,
         )
 
+    def get_plot_masks(self, batch):
+        """
+        Returns the GT masks of a training batch for plotting, expanding the box-local crops loaded with mask_crops and
+        showing the union mask of its class for each instance if the batch holds combine_mask per-class masks.
+        """
+        key = "cls_mask" if "cls_masks_cls" in batch else "mask"
+        if f"{key}_rois" in batch:
+            h, w = batch["img"].shape[2:]
+            shape = (h // self.args.mask_ratio, w // self.args.mask_ratio)
+            masks = ops.crops2masks(batch[f"{key}_crops"], batch[f"{key}_rois"], shape)
+        else:
+            masks = batch[f"{key}s"]
+        if key == "cls_mask":  # (image, class) keys are sorted, find the union mask of each instance
+            nc = self.data["nc"]
+            planes = batch["cls_masks_idx"].long() * nc + batch["cls_masks_cls"].long()
+            masks = masks[torch.searchsorted(planes, batch["batch_idx"].long() * nc + batch["cls"].view(-1).long())]
+        return masks
+
     def plot_metrics(self):
         """Plots training/val metrics."""
         plot_results(file=self.csv, segment=True, on_plot=self.on_plot)  # save results.png
@@ -1,18 +1,171 @@
 # Ultralytics 🚀 AGPL-3.0 License - https://ultralytics.com/license
 
-from multiprocessing.pool import ThreadPool
+import itertools
+import json
+from collections import deque
+from copy import copy
+from multiprocessing.pool import Pool
 from pathlib import Path
 
 import numpy as np
 import torch
-import torch.nn.functional as F
 
+from ultralytics.data.dataset import DATASET_CACHE_VERSION
+from ultralytics.data.utils import load_dataset_cache_file, read_tensors, save_dataset_cache_file, write_tensors
 from ultralytics.models.yolo.detect import DetectionValidator
-from ultralytics.utils import LOGGER, NUM_THREADS, ops
+from ultralytics.utils import LOGGER, NUM_THREADS, TQDM, ops
 from ultralytics.utils.checks import check_requirements
-from ultralytics.utils.metrics import SegmentMetrics, box_iou, mask_iou
+from ultralytics.utils.dist import reduce_sum
+from ultralytics.utils.metrics import APHistogram, SegmentMetrics, ap_per_class, box_iou, pack_masks, packed_mask_iou
 from ultralytics.utils.plotting import output_to_target, plot_images
 
+
+def encode_json_masks(image_id, category_ids, bboxes, scores, masks, shape, ori_shape, ratio_pad=None):
+    """
+    Unpack bit-packed masks, scale them to the original image and return COCO JSON results with RLE segmentations.
+
+    Args:
+        image_id (int | str): COCO image id.
+        category_ids (List[int]): COCO category id of each prediction.
+        bboxes (List[List[float]]): Boxes in COCO xywh format (top-left corner), one per prediction.
+        scores (List[float]): Confidence of each prediction.
+        masks (np.ndarray): Flat `np.packbits` buffer of the binary masks with shape [N, *shape].
+        shape (tuple): Height and width of the masks at inference size.
+        ori_shape (tuple): Height and width of the original image.
+        ratio_pad (tuple, optional): Ratio and padding used by the letterbox, as passed to `ops.scale_image`.
+
+    Returns:
+        (List[dict]): One COCO result per prediction.
+    """
+    from pycocotools.mask import encode  # noqa
+
+    n = len(scores)
+    masks = np.unpackbits(masks, count=n * shape[0] * shape[1]).reshape(n, *shape)
+    masks = ops.scale_image(np.ascontiguousarray(masks.transpose(1, 2, 0)), ori_shape, ratio_pad=ratio_pad)
+    rles = encode(np.asfortranarray(masks))  # encodes all [H, W, N] masks in one call
+    for rle in rles:
+        rle["counts"] = rle["counts"].decode("utf-8")
+    return [
+        {"image_id": image_id, "category_id": c, "bbox": b, "score": s, "segmentation": rle}
+        for c, b, s, rle in zip(category_ids, bboxes, scores, rles)
+    ]
+
+
+class JSONWriter:
+    """
+    Run functions in a persistent process pool and stream the records they return to a JSON array file.
+
+    Records are written in submission order as soon as the oldest pending task completes, so only `max_pending` tasks
+    are held in memory at any time. The file is a regular JSON list of records, e.g. a COCO results file, once the
+    writer is closed. Used as a context manager, the pool is terminated if an exception interrupts the writing.
+
+    Attributes:
+        file (Path): Output JSON file.
+        pool (multiprocessing.pool.Pool): Worker pool running the submitted functions.
+        pending (collections.deque): Results of submitted tasks not yet written, oldest first.
+        max_pending (int): Number of tasks in flight above which `submit` waits for the oldest one.
+        count (int): Number of records written so far.
+    """
+
+    def __init__(self, file, workers=NUM_THREADS, max_pending=None):
+        """Open `file` for writing and start `workers` worker processes."""
+        self.file = Path(file)
+        self.f = open(self.file, "w", encoding="utf-8")  # noqa: SIM115, closed by close()
+        self.pool = Pool(max(workers, 1))
+        self.pending = deque()
+        self.max_pending = max_pending or 4 * max(workers, 1)
+        self.count = 0
+
+    def __enter__(self):
+        """Return the writer."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Write the pending records and close, or terminate the pool without waiting if an exception occurred."""
+        if exc_type is None:
+            self.close()
+        elif not self.f.closed:
+            self.pool.terminate()
+            self.f.close()
+
+    def submit(self, func, *args):
+        """Schedule `func(*args)`, which must return a list of JSON-serializable records, and write finished ones."""
+        self.pending.append(self.pool.apply_async(func, args))
+        while self.pending and (len(self.pending) > self.max_pending or self.pending[0].ready()):
+            self._write(self.pending.popleft().get())
+
+    def _write(self, records):
+        """Append records to the JSON list in the file."""
+        for x in records:
+            self.f.write(("," if self.count else "[") + json.dumps(x))
+            self.count += 1
+
+    def close(self):
+        """Wait for all pending tasks, write their records, end the JSON list and release the pool and file."""
+        if self.f.closed:
+            return
+        try:
+            while self.pending:
+                self._write(self.pending.popleft().get())
+            self.f.write("]" if self.count else "[]")
+        finally:
+            self.pool.close()
+            self.pool.join()
+            self.f.close()
+        LOGGER.info(f"Saved {self.count} predictions to {self.file}")
+
+
+class PredictionCache:
+    """
+    Memory-mapped per-image cache of what is needed to score a combine_mask segmentation model without running it.
+
+    Each image stores its pre-NMS candidates above the validation confidence, its class mask planes binarized at 0 for
+    the classes those candidates can take, its labels and its letterbox geometry, see
+    `SegmentationValidator.cache_image`. Tensors are written to a flat file with `write_tensors`, the index and the
+    settings needed for scoring to a *.cache file next to it.
+
+    Attributes:
+        path (Path): Path of the tensor file, the index is saved to `path.with_suffix(".cache")`.
+        meta (dict): Settings saved with the index, e.g. class names, conf and overlap_mask.
+        index (List[List[tuple]]): Per image entries returned by `write_tensors`.
+    """
+
+    def __init__(self, path, meta=None):
+        """Opens a new cache for writing at `path` if `meta` is given, otherwise loads the existing cache."""
+        self.path = Path(path)
+        if meta is not None:
+            self.meta, self.index, self.offset = meta, [], 0
+            self.f = open(self.path, "wb")  # noqa: SIM115, closed by close()
+        else:
+            cache = load_dataset_cache_file(self.path.with_suffix(".cache"))
+            assert cache["version"] == DATASET_CACHE_VERSION, (
+                f"{self.path} was saved by another version, validate again"
+            )
+            self.meta, self.index, self.f = cache["meta"], cache["index"], None
+            self.buffer = np.memmap(self.path, dtype=np.uint8, mode="c")
+
+    def add(self, sample):
+        """Appends the sample of one image."""
+        entry, self.offset = write_tensors(self.f, self.offset, sample)
+        self.index.append(entry)
+
+    def close(self):
+        """Finishes writing and saves the index."""
+        if self.f is not None and not self.f.closed:
+            self.f.close()
+            save_dataset_cache_file(
+                "", self.path.with_suffix(".cache"), {"meta": self.meta, "index": self.index}, DATASET_CACHE_VERSION
+            )
+
+    def __getitem__(self, i):
+        """Returns the sample of image `i`."""
+        return read_tensors(self.buffer, self.index[i])
+
+    def __len__(self):
+        """Returns the number of cached images."""
+        return len(self.index)
+
+
 class SegmentationValidator(DetectionValidator):
     """
     A class extending the DetectionValidator class for validation based on a segmentation model.
@@ -31,7 +184,6 @@ class SegmentationValidator(DetectionValidator):
         """Initialize SegmentationValidator and set task to 'segment', metrics to SegmentMetrics."""
         super().__init__(dataloader, save_dir, pbar, args, _callbacks)
         self.plot_masks = None
-        self.process = None
         self.args.task = "segment"
         self.combine_mask = True if self.args.combine_mask else False
         self.metrics = SegmentMetrics(save_dir=self.save_dir, on_plot=self.on_plot)
@@ -48,9 +200,32 @@ class SegmentationValidator(DetectionValidator):
         self.plot_masks = []
         if self.args.save_json:
             check_requirements("pycocotools>=2.0.6")
-        # more accurate vs faster
-        self.process = ops.process_mask_native if self.args.save_json or self.args.save_txt else ops.process_mask
+            self.json_writer = self.resources.enter_context(JSONWriter(self.save_dir / "predictions.json"))
+        if self.combine_mask and not self.training and (model.pt or model.nn_module):  # the loss needs every plane
+            model.model.model[-1].lazy_mask = self.args.lazy_mask
         self.stats = dict(tp_m=[], tp=[], conf=[], pred_cls=[], target_cls=[], target_img=[])
+        self.pred_cache = None
+        if self.args.pred_cache and not self.training:
+            if self.combine_mask:
+                meta = dict(
+                    names=self.names,
+                    conf=self.args.conf,
+                    overlap_mask=self.args.overlap_mask,
+                    single_cls=self.args.single_cls,
+                    agnostic=self.args.single_cls or self.args.agnostic_nms,
+                )
+                self.pred_cache = PredictionCache(self.save_dir / "pred_cache.bin", meta)
+            else:
+                LOGGER.warning("WARNING ⚠️ pred_cache requires a combine_mask model, predictions are not cached.")
+        self.res_check, self.mask_res_error = None, None  # stats of the images sampled for mask_res_check, report
+        if self.args.mask_res_check and not (self.args.save_json or self.args.save_txt):  # masks are low-res
+            self.res_check = []
+            self.res_check_stride = max(len(self.dataloader.dataset) // self.args.mask_res_check, 1)
+        if self.args.ap_bins:  # fixed-memory running statistics instead of per-prediction lists
+            self.ap_hist = {k: APHistogram(self.nc, self.niou, self.args.ap_bins) for k in ("tp", "tp_m")}
+            self.nt_per_image = np.zeros(self.nc, dtype=np.int64)
+        else:
+            self.ap_hist = None
 
     def get_desc(self):
         """Return a formatted description of evaluation metrics."""
@@ -77,8 +252,12 @@ class SegmentationValidator(DetectionValidator):
 
         if not self.combine_mask:
             pred = torch.cat((pred, mask_pred), dim=1)
+        if self.pred_cache is not None:  # for cache_image, taken before NMS converts the boxes in place
+            self.candidates = [x.T[x[4:].amax(0) > self.args.conf].float() for x in pred]
         p = super().postprocess(pred)
         if self.combine_mask:
+            if isinstance(mask_pred, tuple):  # lazy head, planes are computed per image in _prepare_pred
+                mask_pred = [mask_pred] * len(p)
             p = (p, mask_pred)
         return p, proto
 
@@ -89,18 +268,34 @@ class SegmentationValidator(DetectionValidator):
         prepared_batch["masks"] = batch["masks"][midx]
         return prepared_batch
 
-    def _prepare_pred(self, pred, pbatch, proto):
-        """Prepares a batch for training or inference by processing images and targets."""
+    def _prepare_pred(self, pred, pbatch, proto, upsample=None):
+        """Prepares a batch for training or inference by processing images and targets, `upsample` overrides whether
+        masks are upsampled to the input image size, which by default they are with save_json or save_txt.
+        """
         if self.combine_mask:
             _pred, pred_combine_mask = pred
         else:
             _pred = pred
         predn = super()._prepare_pred(_pred, pbatch)
+        if upsample is None:
+            upsample = self.args.save_json or self.args.save_txt  # more accurate vs faster
 
         if not self.combine_mask:
-            pred_masks = self.process(proto, _pred[:, 6:], _pred[:, :4], shape=pbatch["imgsz"])
+            process = ops.process_mask_native if upsample else ops.process_mask
+            pred_masks = process(proto, _pred[:, 6:], _pred[:, :4], shape=pbatch["imgsz"])
         else:
-            pred_masks = ops.process_combine_mask(pred_combine_mask, _pred[:, 5], _pred[:, :4], shape=pbatch["imgsz"])
+            if isinstance(pred_combine_mask, tuple):  # lazy head, compute only the class planes of the kept boxes
+                pred_combine_mask, mask_index = ops.combine_mask_planes(proto, *pred_combine_mask, _pred[:, 5])
+            else:
+                mask_index = _pred[:, 5]
+            pred_masks = ops.process_combine_mask(
+                pred_combine_mask,
+                mask_index,
+                _pred[:, :4],
+                shape=pbatch["imgsz"],
+                upsample=upsample,
+                per_class=self.args.mask_per_class,
+            )
 
         return predn, pred_masks
 
@@ -110,6 +305,7 @@ class SegmentationValidator(DetectionValidator):
             (_preds, pred_combine_masks), protos = preds[0], preds[1]
         else:
             _preds, protos = preds[0], preds[1]
+        cm = []  # (detections, gt_bboxes, gt_cls) per image for one confusion matrix update
         for si, (pred, proto) in enumerate(zip(_preds, protos)):
             self.seen += 1
             npr = len(pred)
@@ -121,15 +317,20 @@ class SegmentationValidator(DetectionValidator):
             )
             pbatch = self._prepare_batch(si, batch)
             cls, bbox = pbatch.pop("cls"), pbatch.pop("bbox")
+            if self.pred_cache is not None:
+                self.cache_image(si, batch, pbatch, cls, bbox, proto, pred_combine_masks[si])
             nl = len(cls)
             stat["target_cls"] = cls
             stat["target_img"] = cls.unique()
+            i, stride = self.seen - 1, self.res_check_stride if self.res_check is not None else 0
+            check = stride and i % stride == 0 and i // stride < self.args.mask_res_check
             if npr == 0:
                 if nl:
-                    for k in self.stats.keys():
-                        self.stats[k].append(stat[k])
+                    self._accumulate(stat)
+                    if check:
+                        self.res_check.append(dict(stat, tp_f=stat["tp_m"]))
                     if self.args.plots:
-                        self.confusion_matrix.process_batch(detections=None, gt_bboxes=bbox, gt_cls=cls)
+                        cm.append((None, bbox, cls))
                 continue
 
             # Masks
@@ -140,21 +341,30 @@ class SegmentationValidator(DetectionValidator):
 
             if self.combine_mask:
                 pred = (pred, pred_combine_masks[si])
-            predn, pred_masks = self._prepare_pred(pred, pbatch, proto)
+            with self.profiler("mask", si):
+                predn, pred_masks = self._prepare_pred(pred, pbatch, proto)
             stat["conf"] = predn[:, 4]
             stat["pred_cls"] = predn[:, 5]
 
             # Evaluate
             if nl:
-                stat["tp"] = self._process_batch(predn, bbox, cls)
-                stat["tp_m"] = self._process_batch(
-                    predn, bbox, cls, pred_masks, gt_masks, self.args.overlap_mask, masks=True
-                )
+                with self.profiler("match", si):
+                    stat["tp"] = self._process_batch(predn, bbox, cls)
+                    stat["tp_m"] = self._process_batch(
+                        predn, bbox, cls, pred_masks, gt_masks, self.args.overlap_mask, masks=True
+                    )
+            if check:  # mask stats at the input image resolution
+                tp_f = stat["tp_m"]
+                if nl:
+                    full_masks = self._prepare_pred(pred, pbatch, proto, upsample=True)[1]
+                    tp_f = self._process_batch(
+                        predn, bbox, cls, full_masks, self.full_res_gt_masks(batch, si), self.args.overlap_mask, True
+                    )
+                self.res_check.append(dict(stat, tp_f=tp_f))
             if self.args.plots:
-                self.confusion_matrix.process_batch(predn, bbox, cls)
+                cm.append((predn, bbox, cls))
 
-            for k in self.stats.keys():
-                self.stats[k].append(stat[k])
+            self._accumulate(stat)
 
             pred_masks = torch.as_tensor(pred_masks, dtype=torch.uint8)
             if self.args.plots and self.batch_i < 3:
@@ -162,28 +372,206 @@ class SegmentationValidator(DetectionValidator):
 
             # Save
             if self.args.save_json:
-                self.pred_to_json(
-                    predn,
-                    batch["im_file"][si],
-                    ops.scale_image(
-                        pred_masks.permute(1, 2, 0).contiguous().cpu().numpy(),
-                        pbatch["ori_shape"],
-                        ratio_pad=batch["ratio_pad"][si],
-                    ),
-                )
+                with self.profiler("json", si):
+                    self.pred_to_json(
+                        predn, batch["im_file"][si], pred_masks, pbatch["ori_shape"], ratio_pad=batch["ratio_pad"][si]
+                    )
             if self.args.save_txt:
-                self.save_one_txt(
-                    predn,
-                    pred_masks,
-                    self.args.save_conf,
-                    pbatch["ori_shape"],
-                    self.save_dir / "labels" / f"{Path(batch['im_file'][si]).stem}.txt",
-                )
+                with self.profiler("txt", si):
+                    self.save_one_txt(
+                        predn,
+                        pred_masks,
+                        self.args.save_conf,
+                        pbatch["ori_shape"],
+                        self.save_dir / "labels" / f"{Path(batch['im_file'][si]).stem}.txt",
+                    )
+        if cm:
+            with self.profiler("confusion_matrix"):
+                self.confusion_matrix.process_images(cm)
+
+    def cache_image(self, si, batch, pbatch, cls, bbox, proto, mask_pred):
+        """Adds the pre-NMS candidates, binarized class mask planes and labels of image `si` to the prediction cache."""
+        candidates = self.candidates[si]  # (n, 4 + nc) xywh boxes and class scores above conf
+        classes = (candidates[:, 4:] > self.args.conf).any(0).nonzero()[:, 0]  # every class NMS can assign
+        if isinstance(mask_pred, tuple):  # lazy head
+            planes = ops.combine_mask_planes(proto, *mask_pred, classes)[0]
+        else:
+            planes = mask_pred[classes]
+        gt_masks = pbatch["masks"]
+        small = gt_masks.numel() == 0 or gt_masks.max() < 256
+        self.pred_cache.add(
+            {
+                "im_file": batch["im_file"][si],
+                "candidates": candidates.cpu(),
+                "classes": classes.cpu(),
+                "planes": planes.gt(0.0).cpu(),  # masks are planes cropped to the box and thresholded at 0
+                "cls": cls.cpu(),
+                "bbox": bbox.float().cpu(),
+                "masks": gt_masks.to(torch.uint8 if small else torch.int32).cpu(),
+                "imgsz": tuple(pbatch["imgsz"]),
+                "ori_shape": pbatch["ori_shape"],
+                "ratio_pad": pbatch["ratio_pad"],
+            }
+        )
+
+    def sweep(self, conf=None, iou=None, max_det=None, cache=None):
+        """
+        Re-runs NMS, mask cropping, matching and metrics from a prediction cache for every combination of thresholds.
+
+        Runs on the CPU without the model or the dataset. For confidences not below the one the cache was saved with,
+        each result equals a validation at those settings without the upsampled masks of save_json/save_txt.
+
+        Args:
+            conf (float | List[float], optional): Confidence thresholds, defaults to the validator's.
+            iou (float | List[float], optional): NMS IoU thresholds, defaults to the validator's.
+            max_det (int | List[int], optional): Maximum detections per image, defaults to the validator's.
+            cache (str | Path | PredictionCache, optional): Cache to score, defaults to the one saved by the last
+                validation with `pred_cache=True`.
+
+        Returns:
+            (List[dict]): Per combination its conf, iou and max_det together with the `SegmentMetrics.results_dict`.
+
+        Examples:
+            >>> validator = SegmentationValidator(
+            ...     args=dict(model="yolo11n-seg.pt", data="coco8-seg.yaml", pred_cache=True)
+            ... )
+            >>> validator()
+            >>> results = validator.sweep(conf=[0.001, 0.01], iou=[0.6, 0.7], max_det=[100, 300])
+        """
+        if not isinstance(cache, PredictionCache):
+            cache = PredictionCache(cache or self.save_dir / "pred_cache.bin")
+        meta = cache.meta
+        defaults = self.args.conf, self.args.iou, self.args.max_det
+        grid = [
+            x if isinstance(x, (list, tuple)) else [d if x is None else x]
+            for x, d in zip((conf, iou, max_det), defaults)
+        ]
+        grid = list(itertools.product(*grid))
+        assert min(c for c, _, _ in grid) >= meta["conf"], f"conf must be >= {meta['conf']}, the conf of the cache"
+        stats = [dict(tp_m=[], tp=[], conf=[], pred_cls=[], target_cls=[]) for _ in grid]
+        for i in TQDM(range(len(cache)), desc=f"Sweeping {len(grid)} thresholds"):
+            x = cache[i]
+            cls, bbox = x["cls"], x["bbox"]
+            for stat, (c, t, m) in zip(stats, grid):
+                pred = ops.non_max_suppression(
+                    x["candidates"].T[None],
+                    c,
+                    t,
+                    nc=len(meta["names"]),
+                    multi_label=True,
+                    agnostic=meta["agnostic"],
+                    max_det=m,
+                    in_place=False,  # the candidates are reused for every combination
+                )[0]
+                if len(pred) == 0 and len(cls) == 0:
+                    continue
+                if meta["single_cls"]:
+                    pred[:, 5] = 0
+                tp = tp_m = torch.zeros(len(pred), self.niou, dtype=torch.bool)
+                if len(pred) and len(cls):
+                    predn = pred.clone()
+                    ops.scale_boxes(x["imgsz"], predn[:, :4], x["ori_shape"], ratio_pad=x["ratio_pad"])
+                    index = torch.searchsorted(x["classes"], pred[:, 5].long())  # plane of each detection
+                    pred_masks = ops.process_combine_mask(x["planes"].float(), index, pred[:, :4], shape=x["imgsz"])
+                    tp = self._process_batch(predn, bbox, cls)
+                    tp_m = self._process_batch(
+                        predn, bbox, cls, pred_masks, x["masks"].float(), meta["overlap_mask"], masks=True
+                    )
+                for k, v in zip(stat, (tp_m, tp, pred[:, 4], pred[:, 5], cls)):
+                    stat[k].append(v)
+        results = []
+        for stat, (c, t, m) in zip(stats, grid):
+            metrics = SegmentMetrics(names=meta["names"])
+            stat = {k: torch.cat(v, 0).numpy() for k, v in stat.items() if v}
+            if stat and stat["tp"].any():
+                metrics.process(**stat)
+            results.append({"conf": c, "iou": t, "max_det": m, **metrics.results_dict})
+        return results
+
+    def _accumulate(self, stat):
+        """Add one image's statistics to the lists, or to the AP histograms when `ap_bins` is set."""
+        if self.ap_hist is None:
+            for k in self.stats.keys():
+                self.stats[k].append(stat[k])
+            return
+        stat = {k: v.cpu().numpy() for k, v in stat.items()}
+        for k, hist in self.ap_hist.items():
+            hist.update(stat[k], stat["conf"], stat["pred_cls"], stat["target_cls"])
+        self.nt_per_image[stat["target_img"].astype(int)] += 1
+
+    def reduce_states(self):
+        """Merges the states of all DDP ranks, summing the AP histograms instead of gathering statistics if present."""
+        if self.ap_hist is not None:
+            for hist in self.ap_hist.values():
+                hist.tp, hist.n, hist.nt = (reduce_sum(x, self.device) for x in (hist.tp, hist.n, hist.nt))
+            self.nt_per_image = reduce_sum(self.nt_per_image, self.device)
+        super().reduce_states()
+
+    def get_stats(self):
+        """Returns metrics statistics and results dictionary, computed from the AP histograms if `ap_bins` is set."""
+        if self.ap_hist is None:
+            return super().get_stats()
+        self.nt_per_class = self.ap_hist["tp"].nt.copy()
+        if self.ap_hist["tp"].tp.any():
+            self.metrics.process_histograms(self.ap_hist["tp"], self.ap_hist["tp_m"])
+        return self.metrics.results_dict
 
     def finalize_metrics(self, *args, **kwargs):
         """Sets speed and confusion matrix for evaluation metrics."""
         self.metrics.speed = self.speed
         self.metrics.confusion_matrix = self.confusion_matrix
+        if self.args.save_json:
+            self.json_writer.close()
+        if self.pred_cache is not None:
+            self.pred_cache.close()
+        if self.res_check:
+            self.check_mask_res()
+
+    def full_res_gt_masks(self, batch, si):
+        """
+        Rasterizes the GT polygons of image `si` of the batch at the input image resolution for `mask_res_check`, by
+        loading it again through the dataset transforms with a `Format` of mask_ratio 1.
+
+        Returns:
+            (torch.Tensor): GT masks in the layout and instance order of `batch["masks"]`, at the input resolution.
+        """
+        dataset = self.dataloader.dataset
+        index = dataset.im_files.index(batch["im_file"][si])
+        *transforms, fmt = dataset.transforms.transforms
+        fmt = copy(fmt)
+        fmt.mask_ratio = 1
+        labels = dataset.get_image_and_label(index)
+        for t in transforms + [fmt]:
+            labels = t(labels)
+        return labels["masks"].to(self.device)
+
+    def check_mask_res(self):
+        """
+        Logs the deviation of the mask mAP computed at the mask resolution from the mAP at the input image resolution,
+        measured on the images sampled for `mask_res_check`.
+
+        Returns:
+            (dict): Mask mAP50 and mAP50-95 of the sampled images at low and full resolution, and the largest
+                absolute deviation of the mAP at a single IoU threshold.
+        """
+        keys = ("tp_m", "tp_f", "conf", "pred_cls", "target_cls")
+        stats = {k: torch.cat([x[k] for x in self.res_check], 0).cpu().numpy() for k in keys}
+        low, full = (ap_per_class(stats[k], *(stats[x] for x in keys[2:]))[5] for k in keys[:2])  # (nc, 10) AP
+        if not len(low):
+            return {}
+        self.mask_res_error = dict(
+            images=len(self.res_check),
+            map50=(float(low[:, 0].mean()), float(full[:, 0].mean())),
+            map=(float(low.mean()), float(full.mean())),
+            max_dev=float(np.abs(low.mean(0) - full.mean(0)).max()),
+        )
+        LOGGER.info(
+            f"Mask mAP50-95 {low.mean():.4g} at mask resolution vs {full.mean():.4g} at input resolution on "
+            f"{len(self.res_check)} sampled images, deviation {low.mean() - full.mean():+.4g} "
+            f"(mAP50 {low[:, 0].mean() - full[:, 0].mean():+.4g}, at most {self.mask_res_error['max_dev']:.4g} "
+            f"per IoU threshold)"
+        )
+        return self.mask_res_error
 
     def _process_batch(self, detections, gt_bboxes, gt_cls, pred_masks=None, gt_masks=None, overlap=False, masks=False):
         """
@@ -220,12 +608,11 @@ class SegmentationValidator(DetectionValidator):
             if overlap:
                 nl = len(gt_cls)
                 index = torch.arange(nl, device=gt_masks.device).view(nl, 1, 1) + 1
-                gt_masks = gt_masks.repeat(nl, 1, 1)  # shape(1,640,640) -> (n,640,640)
-                gt_masks = torch.where(gt_masks == index, 1.0, 0.0)
-            if gt_masks.shape[1:] != pred_masks.shape[1:]:
-                gt_masks = F.interpolate(gt_masks[None], pred_masks.shape[1:], mode="bilinear", align_corners=False)[0]
-                gt_masks = gt_masks.gt_(0.5)
-            iou = mask_iou(gt_masks.view(gt_masks.shape[0], -1), pred_masks.view(pred_masks.shape[0], -1))
+                gt_masks = gt_masks == index  # shape(1,640,640) -> (n,640,640)
+            # bit-packed masks, only pairs with overlapping masks are intersected
+            gt_masks, gt_boxes = pack_masks(gt_masks, pred_masks.shape[1:])
+            pred_masks, pred_boxes = pack_masks(pred_masks)
+            iou = packed_mask_iou(gt_masks, pred_masks, gt_boxes, pred_boxes)
         else:  # boxes
             iou = box_iou(gt_bboxes, detections[:, :4])
 
@@ -270,44 +657,36 @@ class SegmentationValidator(DetectionValidator):
             masks=pred_masks,
         ).save_txt(file, save_conf=save_conf)
 
-    def pred_to_json(self, predn, filename, pred_masks):
+    def pred_to_json(self, predn, filename, pred_masks, ori_shape, ratio_pad=None):
         """
-        Save one JSON result.
+        Queue one image's predictions for RLE encoding and writing to the predictions JSON file.
+
+        Masks are sent to the worker bit-packed at inference size; scaling to `ori_shape` and RLE encoding happen there.
 
         Examples:
              >>> result = {"image_id": 42, "category_id": 18, "bbox": [258.15, 41.29, 348.26, 243.78], "score": 0.236}
         """
-        from pycocotools.mask import encode  # noqa
-
-        def single_encode(x):
-            """Encode predicted masks as RLE and append results to jdict."""
-            rle = encode(np.asarray(x[:, :, None], order="F", dtype="uint8"))[0]
-            rle["counts"] = rle["counts"].decode("utf-8")
-            return rle
-
         stem = Path(filename).stem
         image_id = int(stem) if stem.isnumeric() else stem
         box = ops.xyxy2xywh(predn[:, :4])  # xywh
         box[:, :2] -= box[:, 2:] / 2  # xy center to top-left corner
-        pred_masks = np.transpose(pred_masks, (2, 0, 1))
-        with ThreadPool(NUM_THREADS) as pool:
-            rles = pool.map(single_encode, pred_masks)
-        for i, (p, b) in enumerate(zip(predn.tolist(), box.tolist())):
-            self.jdict.append(
-                {
-                    "image_id": image_id,
-                    "category_id": self.class_map[int(p[5])],
-                    "bbox": [round(x, 3) for x in b],
-                    "score": round(p[4], 5),
-                    "segmentation": rles[i],
-                }
-            )
+        self.json_writer.submit(
+            encode_json_masks,
+            image_id,
+            [self.class_map[int(c)] for c in predn[:, 5].tolist()],
+            [[round(x, 3) for x in b] for b in box.tolist()],
+            [round(x, 5) for x in predn[:, 4].tolist()],
+            np.packbits(pred_masks.cpu().numpy()),
+            tuple(pred_masks.shape[1:]),
+            tuple(ori_shape),
+            ratio_pad,
+        )
 
     def eval_json(self, stats):
         """Return COCO-style object detection evaluation metrics."""
-        if self.args.save_json and self.is_coco and len(self.jdict):
+        if self.args.save_json and self.is_coco and self.json_writer.count:
             anno_json = self.data["path"] / "annotations/instances_val2017.json"  # annotations
-            pred_json = self.save_dir / "predictions.json"  # predictions
+            pred_json = self.json_writer.file  # predictions
             LOGGER.info(f"\nEvaluating pycocotools mAP using {pred_json} and {anno_json}...")
             try:  # https://github.com/cocodataset/cocoapi/blob/master/PythonAPI/pycocoEvalDemo.ipynb
                 check_requirements("pycocotools>=2.0.6")
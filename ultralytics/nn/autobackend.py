@@ -133,6 +133,7 @@ class AutoBackend(nn.Module):
         nhwc = coreml or saved_model or pb or tflite or edgetpu or rknn  # BHWC formats (vs torch BCWH)
         stride = 32  # default stride
         end2end = False  # default end2end
+        mask_gather = False  # combine_mask segment export with top detections and their mask crops
         model, metadata, task = None, None, None
 
         # Set device
@@ -517,6 +518,7 @@ class AutoBackend(nn.Module):
             names = metadata["names"]
             kpt_shape = metadata.get("kpt_shape")
             end2end = metadata.get("args", {}).get("nms", False)
+            mask_gather = metadata.get("args", {}).get("mask_gather", False)
         elif not (pt or triton or nn_module):
             LOGGER.warning(f"WARNING ⚠️ Metadata not found for 'model={weights}'")
 
@@ -6,6 +6,7 @@ import math
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torch.nn.init import constant_, xavier_uniform_
 
 from ultralytics.utils.tal import TORCH_1_10, dist2bbox, dist2rbox, make_anchors
@@ -175,6 +176,10 @@ class Detect(nn.Module):
 class Segment(Detect):
     """YOLO Segment head for segmentation models."""
 
+    mask_gather = False  # export top max_det detections with box-local crops of their class masks (combine_mask only)
+    mask_crop = 28  # side of the mask crops exported with mask_gather
+    lazy_mask = False  # return the mask_pred weight and bias instead of the class mask planes at inference
+
     def __init__(self, nc=80, nm=32, npr=256, combine_mask=False, ch=()):
         """Initialize the YOLO model attributes such as the number of masks, prototypes, and the convolution layers."""
         super().__init__(nc, ch)
@@ -204,16 +209,55 @@ class Segment(Detect):
             origin = (x, p)
         else:
             if self.export:
+                if getattr(self, "combine_mask", False) and self.mask_gather:
+                    return self.gather_masks(x, p)
                 origin = (x, p)
             else:
                 origin = (x[0], (x[1], p))
 
         if hasattr(self, 'combine_mask') and self.combine_mask:
+            if self.lazy_mask and not self.training and not self.export:  # planes are computed after NMS
+                return origin + ((self.mask_pred.weight, self.mask_pred.bias),)
             mask = self.mask_pred(p)
             return origin + (mask, )
         else:
             return origin + (mc, )
 
+    def gather_masks(self, y, p):
+        """
+        Select the top detections without NMS and sample their class mask logits on a fixed grid inside their boxes.
+
+        The protos are sampled before the linear 1x1 class projection, so each crop equals the class mask plane of the
+        detection bilinearly resampled over its box. The crops hold max_det * mask_crop**2 values per image instead of
+        nc * mask_h * mask_w for the dense class planes, about 1/9 at imgsz 640 with max_det=300 and nc=80.
+
+        Args:
+            y (torch.Tensor): Decoded predictions of shape (batch_size, 4 + nc, num_anchors).
+            p (torch.Tensor): Mask protos of shape (batch_size, nm, mask_h, mask_w).
+
+        Returns:
+            (torch.Tensor): Detections of shape (batch_size, max_det, 6) as [x1, y1, x2, y2, score, class].
+            (torch.Tensor): Mask logits of the detections of shape (batch_size, max_det, mask_crop, mask_crop), sampled
+                at the centers of a mask_crop x mask_crop grid over each box, see `ops.paste_mask_crops`.
+        """
+        bs, nm = p.shape[:2]
+        s = self.mask_crop
+        det = self.postprocess(y.permute(0, 2, 1), self.max_det, self.nc)
+        k = det.shape[1]
+        xy, wh = det[..., :2], det[..., 2:4] / 2
+        boxes = torch.cat((xy - wh, xy + wh), -1)
+        x1, y1, x2, y2 = boxes[..., None].unbind(2)
+        t = (torch.arange(s, device=p.device, dtype=boxes.dtype) + 0.5) / s  # cell centers
+        w, h = self.shape[3] * self.stride[0], self.shape[2] * self.stride[0]  # input size, protos span the image
+        gx = ((x1 + (x2 - x1) * t) / w * 2 - 1)[:, :, None].expand(bs, k, s, s)  # grid_sample coordinates
+        gy = ((y1 + (y2 - y1) * t) / h * 2 - 1)[..., None].expand(bs, k, s, s)
+        grid = torch.stack((gx, gy), -1).view(bs, k * s, s, 2)
+        protos = F.grid_sample(p, grid, padding_mode="border", align_corners=False).view(bs, nm, k, s * s)  # bilinear
+        cls = det[..., 5].long()
+        weight, bias = self.mask_pred.weight.view(self.nc, nm)[cls], self.mask_pred.bias[cls]  # (bs, max_det, nm)
+        crops = (weight[:, :, None] @ protos.transpose(1, 2))[:, :, 0] + bias[..., None]  # (bs, max_det, s * s)
+        return torch.cat((boxes, det[..., 4:]), -1), crops.view(bs, k, s, s)
+
 
 class OBB(Detect):
     """YOLO OBB detection head for detection with rotation models."""
@@ -6,6 +6,10 @@ import socket
 import sys
 import tempfile
 
+import numpy as np
+import torch
+import torch.distributed as dist
+
 from . import USER_CONFIG_DIR
 from .torch_utils import TORCH_1_9
 
@@ -22,6 +26,24 @@ def find_free_network_port() -> int:
         return s.getsockname()[1]  # port
 
 
+def reduce_sum(x, device=None):
+    """
+    Sum a number, numpy array or tensor over all DDP ranks.
+
+    Args:
+        x (int | float | np.ndarray | torch.Tensor): Local value.
+        device (torch.device, optional): Device for the collective, must be CUDA for the NCCL backend.
+
+    Returns:
+        (int | float | np.ndarray | torch.Tensor): Sum over ranks, with the type (and device) of `x`.
+    """
+    t = torch.as_tensor(x, device=device).clone()
+    dist.all_reduce(t)
+    if isinstance(x, torch.Tensor):
+        return t.to(x.device)
+    return t.cpu().numpy() if isinstance(x, np.ndarray) else t.item()
+
+
 def generate_ddp_file(trainer):
     """Generates a DDP file and returns its file name."""
     module, name = f"{trainer.__class__.__module__}.{trainer.__class__.__name__}".rsplit(".", 1)
@@ -5,7 +5,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from ultralytics.utils.metrics import OKS_SIGMA
-from ultralytics.utils.ops import crop_mask, xywh2xyxy, xyxy2xywh
+from ultralytics.utils.ops import crop_mask_mean, crops2masks, xywh2xyxy, xyxy2xywh
 from ultralytics.utils.tal import RotatedTaskAlignedAssigner, TaskAlignedAssigner, dist2bbox, dist2rbox, make_anchors
 from ultralytics.utils.torch_utils import autocast
 
@@ -262,6 +262,29 @@ class v8DetectionLoss:
         return loss.sum() * batch_size, loss.detach()  # loss(box, cls, dfl)
 
 
+class MaskCrops:
+    """
+    Box-local ground truth masks of a batch, expanded on the device only for the masks that are indexed.
+
+    Attributes:
+        crops (torch.Tensor): The flat pixels of all crops, see `ops.crops2masks`.
+        rois (torch.Tensor): (N, 4) xyxy windows of the crops in the masks, end exclusive.
+        shape (tuple): The size of the masks the crops were taken from (h, w).
+        size (tuple): The size of the expanded masks (h, w).
+    """
+
+    def __init__(self, crops, rois, shape, size):
+        """Initialize MaskCrops with the collated crops and windows and the mask and output sizes."""
+        self.crops, self.rois, self.shape, self.size = crops, rois, tuple(shape), tuple(size)
+
+    def __getitem__(self, index):
+        """Return the float masks of the crops at the tensor of mask indices `index`, resized to `size`."""
+        masks = crops2masks(self.crops, self.rois, self.shape, index).float()
+        if self.shape != self.size:  # downsample
+            masks = F.interpolate(masks[None], self.size, mode="nearest")[0]
+        return masks
+
+
 class v8SegmentationLoss(v8DetectionLoss):
     """Criterion class for computing training losses."""
 
@@ -346,12 +369,25 @@ class v8SegmentationLoss(v8DetectionLoss):
                 fg_mask,
             )
             # Masks loss
-            masks = batch["masks"].to(self.device).float()
-            if tuple(masks.shape[-2:]) != (mask_h, mask_w):  # downsample
-                masks = F.interpolate(masks[None], (mask_h, mask_w), mode="nearest")[0]
+            mask_cls = None
+            if self.combine_mask and "cls_masks_cls" in batch:  # per-class union masks built by the dataloader
+                masks = self.get_gt_masks(batch, "cls_mask", (mask_h, mask_w))
+                mask_cls = (batch["cls_masks_idx"] * self.nc + batch["cls_masks_cls"]).long().to(self.device)
+            else:
+                masks = self.get_gt_masks(batch, "mask", (mask_h, mask_w))
 
             loss[1] = self.calculate_segmentation_loss(
-                fg_mask, masks, target_gt_idx, target_bboxes, target_labels, batch_idx, proto, pred_masks, imgsz, self.overlap
+                fg_mask,
+                masks,
+                target_gt_idx,
+                target_bboxes,
+                target_labels,
+                batch_idx,
+                proto,
+                pred_masks,
+                imgsz,
+                self.overlap,
+                mask_cls,
             )
 
         # WARNING: lines below prevent Multi-GPU DDP 'unused gradient' PyTorch errors, do not remove
@@ -365,50 +401,102 @@ class v8SegmentationLoss(v8DetectionLoss):
 
         return loss.sum() * batch_size, loss.detach()  # loss(box, cls, dfl)
 
-    def combine_mask_by_class(self, mask_gti, tcls, pmask):
+    def get_gt_masks(self, batch, key, size):
         """
-        combine masks by class
-        Args:
-            mask_gti: (torch.Tensor) [max_num_gt, mask_h, mask_w]
-            tcls: (torch.Tensor) [max_num_gt]
-            pmask: (torch.Tensor) [num_classes, mask_h, mask_w]
-
-        Returns:
-            mask_gt_cls: (torch.Tensor) [num_classes, mask_h, mask_w]
-
+        Return the ground truth masks `key` ('mask' or 'cls_mask') of the batch as float masks of `size`, or as lazily
+        expanded MaskCrops if the dataloader built box-local crops.
         """
-        cls_ind = (torch.arange(0, pmask.shape[0], device=mask_gti.device)[:, None] == tcls[None, :]).to(dtype=mask_gti.dtype)
-        mask_gt_cls = torch.clamp(torch.einsum('bi,ijk->bjk', cls_ind, mask_gti), min=0, max=1)
-        return mask_gt_cls
-
-    def extract_mask_by_anchor(self, masks, tcls):
+        if f"{key}_rois" in batch:
+            r = self.hyp.mask_ratio
+            shape = (batch["img"].shape[2] // r, batch["img"].shape[3] // r)
+            return MaskCrops(batch[f"{key}_crops"].to(self.device), batch[f"{key}_rois"].to(self.device), shape, size)
+        masks = batch[f"{key}s"].to(self.device).float()
+        if tuple(masks.shape[-2:]) != size:  # downsample
+            masks = F.interpolate(masks[None], size, mode="nearest")[0]
+        return masks
+
+    def comb_mask_loss(self, gt_mask, pred_mask, xyxy, area, index):
         """
-        Extract masks by class
-        Args:
-            masks: (torch.Tensor) masks of shape (num_classes, height, width)
-            tcls: (torch.Tensor) target classes of shape (max_num_gt, )
+        Calculate the combined mask loss between ground truth and predicted class masks.
 
-        Returns:
-            mask_anchor: (torch.Tensor) masks of shape (max_num_gt, height, width)
+        The BCE map is computed once per (image, class), and the cropped mean of every anchor is read from the
+        summed-area table of its map.
 
+        Args:
+            gt_mask (torch.Tensor): Union ground truth masks of shape (K, height, width), one per (image, class).
+            pred_mask (torch.Tensor): Predicted class masks of shape (K, height, width).
+            xyxy (torch.Tensor): Bounding box coordinates of each anchor in mask pixels of shape (n, 4).
+            area (torch.Tensor): Normalized bounding box area of each anchor of shape (n,).
+            index (torch.Tensor): Index of each anchor's (image, class) masks of shape (n,).
+        Returns:
+            torch.Tensor: Combined mask loss.
         """
-        mask_anchor = masks[tcls]
-        return mask_anchor
+        loss = F.binary_cross_entropy_with_logits(pred_mask, gt_mask, reduction="none")
+        return (crop_mask_mean(loss, xyxy, index) / area).sum()
 
-    def comb_mask_loss(self, gt_mask, pred_mask, xyxy, area):
+    def combine_mask_loss(
+        self,
+        fg_mask: torch.Tensor,
+        masks: torch.Tensor,
+        target_gt_idx: torch.Tensor,
+        target_labels: torch.Tensor,
+        batch_idx: torch.Tensor,
+        pred_masks: torch.Tensor,
+        mxyxy: torch.Tensor,
+        marea: torch.Tensor,
+        overlap: bool,
+        mask_cls: torch.Tensor = None,
+    ) -> torch.Tensor:
         """
-        Calculate the combined mask loss between ground truth and predicted masks.
+        Compute the combine_mask segmentation loss of the whole batch in one pass.
+
+        The masks of the ground truths assigned to foreground anchors are merged per (image, class) with a scatter-max,
+        and each foreground anchor is supervised on its class plane with the merged mask of its class. If `mask_cls` is
+        given, `masks` already hold the union mask of every (image, class) and are looked up directly. The loss map of
+        each (image, class) is computed once for all of its anchors, see `comb_mask_loss`.
+
         Args:
-            gt_mask (torch.Tensor): Ground truth masks of shape (max_num_gt, height, width).
-            pred_mask (torch.Tensor): Predicted masks of shape (max_num_gt, height, width).
-            xyxy (torch.Tensor): Bounding box coordinates of shape (max_num_gt, 4).
-            area (torch.Tensor): Bounding box coordinates of shape (max_num_gt, 4).
+            fg_mask (torch.Tensor): A binary tensor of shape (BS, N_anchors) indicating which anchors are positive.
+            masks (torch.Tensor): Ground truth masks of shape (BS, H, W) if `overlap` is True, otherwise
+                (N_labels_in_batch, H, W).
+            target_gt_idx (torch.Tensor): Indexes of ground truth objects for each anchor of shape (BS, N_anchors).
+            target_labels (torch.Tensor): Ground truth labels for each anchor of shape (BS, N_anchors).
+            batch_idx (torch.Tensor): Batch indices of shape (N_labels_in_batch, 1).
+            pred_masks (torch.Tensor): Predicted class mask planes of shape (BS, num_classes, H, W).
+            mxyxy (torch.Tensor): Target bounding boxes in mask coordinates of shape (BS, N_anchors, 4).
+            marea (torch.Tensor): Normalized areas of the target bounding boxes of shape (BS, N_anchors).
+            overlap (bool): Whether the masks in `masks` tensor overlap.
+            mask_cls (torch.Tensor, optional): Sorted keys batch_idx * num_classes + cls of per-class union `masks` of
+                shape (N_masks,).
+
         Returns:
-            torch.Tensor: Combined mask loss.
+            (torch.Tensor): The mask loss summed over all foreground anchors.
         """
-        # Mask loss for one image
-        loss = F.binary_cross_entropy_with_logits(pred_mask, gt_mask, reduction="none")
-        return (crop_mask(loss, xyxy).mean(dim=(1, 2)) / area).sum()
+        nc = pred_masks.shape[1]
+        img_idx = fg_mask.nonzero()[:, 0]  # image of each foreground anchor
+        labels = target_labels[fg_mask].long()
+        if mask_cls is not None:
+            keys, index = (img_idx * nc + labels).unique(return_inverse=True)  # (image, class) of each anchor
+            gt_mask = masks[torch.searchsorted(mask_cls, keys)]
+            return self.comb_mask_loss(gt_mask, pred_masks.flatten(0, 1)[keys], mxyxy[fg_mask], marea[fg_mask], index)
+
+        # Distinct ground truths assigned to foreground anchors
+        gts, gt_inv = torch.stack((img_idx, target_gt_idx[fg_mask]), 1).unique(dim=0, return_inverse=True)
+        gt_img, gt_idx = gts.unbind(1)
+        if overlap:
+            gt_masks = (masks[gt_img] == (gt_idx + 1).view(-1, 1, 1)).float()
+        else:
+            counts = torch.bincount(batch_idx.view(-1).long(), minlength=len(fg_mask))
+            gt_masks = masks[(counts.cumsum(0) - counts)[gt_img] + gt_idx]
+        gt_labels = labels.new_zeros(len(gts)).scatter_(0, gt_inv, labels)
+
+        # Union of the ground truth masks per (image, class)
+        keys, key_inv = (gt_img * nc + gt_labels).unique(return_inverse=True)
+        index = key_inv.view(-1, 1, 1).expand_as(gt_masks)
+        gt_union = gt_masks.new_zeros(len(keys), *gt_masks.shape[1:]).scatter_reduce_(0, index, gt_masks, "amax")
+
+        pred_mask = pred_masks.flatten(0, 1)[keys]
+        return self.comb_mask_loss(gt_union, pred_mask, mxyxy[fg_mask], marea[fg_mask], key_inv[gt_inv])
 
     @staticmethod
     def single_mask_loss(
@@ -433,7 +521,7 @@ class v8SegmentationLoss(v8DetectionLoss):
         """
         pred_mask = torch.einsum("in,nhw->ihw", pred, proto)  # (n, 32) @ (32, 80, 80) -> (n, 80, 80)
         loss = F.binary_cross_entropy_with_logits(pred_mask, gt_mask, reduction="none")
-        return (crop_mask(loss, xyxy).mean(dim=(1, 2)) / area).sum()
+        return (crop_mask_mean(loss, xyxy) / area).sum()
 
     def calculate_segmentation_loss(
         self,
@@ -447,6 +535,7 @@ class v8SegmentationLoss(v8DetectionLoss):
         pred_masks: torch.Tensor,
         imgsz: torch.Tensor,
         overlap: bool,
+        mask_cls: torch.Tensor = None,
     ) -> torch.Tensor:
         """
         Calculate the loss for instance segmentation.
@@ -466,6 +555,8 @@ class v8SegmentationLoss(v8DetectionLoss):
                     Predicted masks for each anchor of shape (BS, num_classes, H, W).
             imgsz (torch.Tensor): Size of the input image as a tensor of shape (2), i.e., (H, W).
             overlap (bool): Whether the masks in `masks` tensor overlap.
+            mask_cls (torch.Tensor, optional): Keys batch_idx * num_classes + cls if `masks` are the per-class union
+                masks of shape (N_masks, H, W) built by the dataloader (combine_mask only).
 
         Returns:
             (torch.Tensor): The calculated loss for instance segmentation.
@@ -487,24 +578,23 @@ class v8SegmentationLoss(v8DetectionLoss):
         # Normalize to mask size
         mxyxy = target_bboxes_normalized * torch.tensor([mask_w, mask_h, mask_w, mask_h], device=proto.device)
 
-        for i, single_i in enumerate(zip(fg_mask, target_gt_idx, target_labels, pred_masks, proto, mxyxy, marea, masks)):
-            fg_mask_i, target_gt_idx_i, target_label_i, pred_masks_i, proto_i, mxyxy_i, marea_i, masks_i = single_i
+        if self.combine_mask:
+            loss = self.combine_mask_loss(
+                fg_mask, masks, target_gt_idx, target_labels, batch_idx, pred_masks, mxyxy, marea, overlap, mask_cls
+            )
+            return loss / fg_mask.sum()
+
+        for i, single_i in enumerate(zip(fg_mask, target_gt_idx, pred_masks, proto, mxyxy, marea)):
+            fg_mask_i, target_gt_idx_i, pred_masks_i, proto_i, mxyxy_i, marea_i = single_i
             if fg_mask_i.any():
                 mask_idx = target_gt_idx_i[fg_mask_i]
                 if overlap:
-                    gt_mask = masks_i == (mask_idx + 1).view(-1, 1, 1)
+                    gt_mask = masks[i] == (mask_idx + 1).view(-1, 1, 1)
                     gt_mask = gt_mask.float()
-                else:
-                    gt_mask = masks[batch_idx.view(-1) == i][mask_idx]
-
-                if self.combine_mask:
-                    # merge mask for mask_gti
-                    mask_gti_cls = self.combine_mask_by_class(gt_mask, target_label_i[fg_mask_i], pred_masks_i)
-                    mask_gti_anchor = self.extract_mask_by_anchor(mask_gti_cls, target_label_i[fg_mask_i])
-                    pmask_anchor = self.extract_mask_by_anchor(pred_masks_i, target_label_i[fg_mask_i])
-                    loss += self.comb_mask_loss(mask_gti_anchor, pmask_anchor, mxyxy_i[fg_mask_i], marea_i[fg_mask_i])
-                else:
-                    loss += self.single_mask_loss(gt_mask, pred_masks_i[fg_mask_i], proto_i, mxyxy_i[fg_mask_i], marea_i[fg_mask_i])
+                else:  # global mask indices, so only these are expanded from crops
+                    gt_mask = masks[(batch_idx.view(-1) == i).nonzero()[:, 0][mask_idx]]
+
+                loss += self.single_mask_loss(gt_mask, pred_masks_i[fg_mask_i], proto_i, mxyxy_i[fg_mask_i], marea_i[fg_mask_i])
 
 
             # WARNING: lines below prevents Multi-GPU DDP 'unused gradient' PyTorch errors, do not remove
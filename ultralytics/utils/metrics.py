@@ -8,6 +8,7 @@ from pathlib import Path
 import matplotlib.pyplot as plt
 import numpy as np
 import torch
+import torch.nn.functional as F
 
 from ultralytics.utils import LOGGER, SimpleClass, TryExcept, plt_settings
 
@@ -153,6 +154,95 @@ def mask_iou(mask1, mask2, eps=1e-7):
     return intersection / (union + eps)
 
 
+def popcount(x):
+    """
+    Count the set bits of each element of an int64 tensor.
+
+    Args:
+        x (torch.Tensor): An int64 tensor.
+
+    Returns:
+        (torch.Tensor): An int64 tensor of the same shape with the number of set bits of each element.
+    """
+    x = x - ((x >> 1) & 0x5555555555555555)  # masks also drop the sign bits of the arithmetic shifts
+    x = (x & 0x3333333333333333) + ((x >> 2) & 0x3333333333333333)
+    x = (x + (x >> 4)) & 0x0F0F0F0F0F0F0F0F
+    x = x + (x >> 8)
+    x = x + (x >> 16)
+    return (x + (x >> 32)) & 0x7F
+
+
+def pack_masks(masks, shape=None, chunk=32):
+    """
+    Bit-pack binary masks along their width into 64-bit words, optionally resizing them first, a chunk at a time.
+
+    Args:
+        masks (torch.Tensor): A tensor of shape (N, H, W) of binary masks.
+        shape (tuple, optional): Size (h, w) the masks are resized to and thresholded at 0.5 before packing, with area
+            interpolation when downsampling and bilinear otherwise.
+        chunk (int, optional): Number of masks resized and packed at once. Defaults to 32.
+
+    Returns:
+        (torch.Tensor): An int64 tensor of shape (N, h, ceil(w / 64)) of bit-packed masks.
+        (torch.Tensor): A tensor of shape (N, 4) of the tight end-exclusive xyxy pixel boxes of the masks, zeros for
+            empty masks.
+    """
+    h, w = shape or masks.shape[1:]
+    bits = torch.tensor([128, 64, 32, 16, 8, 4, 2, 1], dtype=torch.uint8, device=masks.device)
+    packed = torch.zeros((len(masks), h, (w + 63) // 64), dtype=torch.int64, device=masks.device)
+    boxes = torch.zeros((len(masks), 4), dtype=torch.long, device=masks.device)
+    for i in range(0, len(masks), chunk):
+        m = masks[i : i + chunk]
+        if tuple(m.shape[1:]) != (h, w):
+            if m.shape[1] >= h and m.shape[2] >= w:  # pixel coverage
+                m = F.interpolate(m[None].float(), (h, w), mode="area")[0].gt_(0.5)
+            else:
+                m = F.interpolate(m[None].float(), (h, w), mode="bilinear", align_corners=False)[0].gt_(0.5)
+        m = m.bool()
+        rows, cols = m.any(2).byte(), m.any(1).byte()
+        x1, y1 = cols.argmax(1), rows.argmax(1)
+        x2, y2 = w - cols.flip(1).argmax(1), h - rows.flip(1).argmax(1)
+        boxes[i : i + chunk] = torch.stack((x1, y1, x2, y2), 1) * rows.any(1, keepdim=True)
+        m = F.pad(m.byte(), (0, -w % 64)).view(len(m), h, -1, 8)
+        packed[i : i + chunk] = (m * bits).sum(3, dtype=torch.uint8).view(torch.int64)
+    return packed, boxes
+
+
+def packed_mask_iou(mask1, mask2, box1, box2, max_bytes=1 << 26, eps=1e-7):
+    """
+    Calculate masks IoU on bit-packed masks, intersecting only the pairs whose boxes overlap, in bounded-memory chunks.
+
+    Args:
+        mask1 (torch.Tensor): An int64 tensor of shape (N, h, wb) of bit-packed ground truth masks, see `pack_masks`.
+        mask2 (torch.Tensor): An int64 tensor of shape (M, h, wb) of bit-packed predicted masks.
+        box1 (torch.Tensor): A tensor of shape (N, 4) of end-exclusive xyxy pixel boxes enclosing the mask1 pixels.
+        box2 (torch.Tensor): A tensor of shape (M, 4) of end-exclusive xyxy pixel boxes enclosing the mask2 pixels.
+        max_bytes (int, optional): Approximate size of the bitwise intersections computed at once. Defaults to 64 MB.
+        eps (float, optional): A small value to avoid division by zero. Defaults to 1e-7.
+
+    Returns:
+        (torch.Tensor): A tensor of shape (N, M) representing masks IoU.
+    """
+    step = max(1, max_bytes // (8 * max(mask1.shape[1] * mask1.shape[2], 1)))  # mask pairs per chunk
+    area1, area2 = (
+        torch.cat([popcount(m).sum((1, 2)) for m in x.split(step)] + [x.new_zeros(0)]).float() for x in (mask1, mask2)
+    )
+    lt = torch.maximum(box1[:, None, :2], box2[None, :, :2])
+    rb = torch.minimum(box1[:, None, 2:], box2[None, :, 2:])
+    i, j = (rb > lt).all(2).nonzero(as_tuple=True)  # pairs whose boxes overlap
+    intersection = torch.zeros((len(mask1), len(mask2)), device=mask1.device)
+    if len(i):
+        lt, rb = lt[i, j], rb[i, j]
+        order = lt[:, 1].argsort()  # neighbouring pairs share a small window
+        i, j, lt, rb = i[order], j[order], lt[order], rb[order]
+        for k in range(0, len(i), step):
+            ik, jk = i[k : k + step], j[k : k + step]
+            (x1, y1), (x2, y2) = lt[k : k + step].amin(0).tolist(), rb[k : k + step].amax(0).tolist()
+            rows, cols = slice(y1, y2), slice(x1 // 64, (x2 + 63) // 64)  # window of the chunk
+            intersection[ik, jk] = popcount(mask1[ik, rows, cols] & mask2[jk, rows, cols]).sum((1, 2)).float()
+    return intersection / (area1[:, None] + area2[None] - intersection + eps)
+
+
 def kpt_iou(kpt1, kpt2, area, sigma, eps=1e-7):
     """
     Calculate Object Keypoint Similarity (OKS).
@@ -323,7 +413,7 @@ class ConfusionMatrix:
         for p, t in zip(preds.cpu().numpy(), targets.cpu().numpy()):
             self.matrix[p][t] += 1
 
-    def process_batch(self, detections, gt_bboxes, gt_cls):
+    def process_batch(self, detections, gt_bboxes, gt_cls, det_idx=None, gt_idx=None):
         """
         Update confusion matrix for object detection task.
 
@@ -333,53 +423,59 @@ class ConfusionMatrix:
                                       or with an additional element `angle` when it's obb.
             gt_bboxes (Array[M, 4]| Array[N, 5]): Ground truth bounding boxes with xyxy/xyxyr format.
             gt_cls (Array[M]): The class labels.
+            det_idx (Array[N], optional): Image index of each detection, only boxes of the same image are matched.
+            gt_idx (Array[M], optional): Image index of each ground truth box, required with `det_idx`.
         """
-        if gt_cls.shape[0] == 0:  # Check if labels is empty
-            if detections is not None:
-                detections = detections[detections[:, 4] > self.conf]
-                detection_classes = detections[:, 5].int()
-                for dc in detection_classes:
-                    self.matrix[dc, self.nc] += 1  # false positives
-            return
+        gt_classes = gt_cls.int().cpu().numpy()
         if detections is None:
-            gt_classes = gt_cls.int()
-            for gc in gt_classes:
-                self.matrix[self.nc, gc] += 1  # background FN
-            return
-
-        detections = detections[detections[:, 4] > self.conf]
-        gt_classes = gt_cls.int()
-        detection_classes = detections[:, 5].int()
-        is_obb = detections.shape[1] == 7 and gt_bboxes.shape[1] == 5  # with additional `angle` dimension
-        iou = (
-            batch_probiou(gt_bboxes, torch.cat([detections[:, :4], detections[:, -1:]], dim=-1))
-            if is_obb
-            else box_iou(gt_bboxes, detections[:, :4])
-        )
-
-        x = torch.where(iou > self.iou_thres)
-        if x[0].shape[0]:
-            matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]), 1).cpu().numpy()
-            if x[0].shape[0] > 1:
-                matches = matches[matches[:, 2].argsort()[::-1]]
-                matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
-                matches = matches[matches[:, 2].argsort()[::-1]]
-                matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
-        else:
-            matches = np.zeros((0, 3))
-
-        n = matches.shape[0] > 0
-        m0, m1, _ = matches.transpose().astype(int)
-        for i, gc in enumerate(gt_classes):
-            j = m0 == i
-            if n and sum(j) == 1:
-                self.matrix[detection_classes[m1[j]], gc] += 1  # correct
-            else:
-                self.matrix[self.nc, gc] += 1  # true background
+            detections, det_idx = gt_bboxes.new_zeros((0, 6)), None
+        keep = detections[:, 4] > self.conf
+        detections = detections[keep]
+        detection_classes = detections[:, 5].int().cpu().numpy()
+
+        matches = np.zeros((0, 3))
+        if len(gt_classes) and len(detection_classes):
+            is_obb = detections.shape[1] == 7 and gt_bboxes.shape[1] == 5  # with additional `angle` dimension
+            iou = (
+                batch_probiou(gt_bboxes, torch.cat([detections[:, :4], detections[:, -1:]], dim=-1))
+                if is_obb
+                else box_iou(gt_bboxes, detections[:, :4])
+            )
+            if det_idx is not None:
+                iou = iou * (gt_idx[:, None] == det_idx[keep][None])  # never match across images
+            x = torch.where(iou > self.iou_thres)
+            if x[0].shape[0]:
+                matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]), 1).cpu().numpy()
+                if x[0].shape[0] > 1:
+                    matches = matches[matches[:, 2].argsort()[::-1]]
+                    matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+                    matches = matches[matches[:, 2].argsort()[::-1]]
+                    matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+
+        m0, m1 = matches[:, 0].astype(int), matches[:, 1].astype(int)
+        gt_pred = np.full(len(gt_classes), self.nc)  # true background unless matched
+        gt_pred[m0] = detection_classes[m1]  # correct
+        unmatched = np.ones(len(detection_classes), dtype=bool)
+        unmatched[m1] = False  # predicted background
+        rows = np.concatenate((gt_pred, detection_classes[unmatched]))
+        cols = np.concatenate((gt_classes, np.full(unmatched.sum(), self.nc)))
+        self.matrix += np.bincount(rows * (self.nc + 1) + cols, minlength=self.matrix.size).reshape(self.matrix.shape)
+
+    def process_images(self, images):
+        """
+        Update confusion matrix for object detection task with the images of a batch in one `process_batch` call.
 
-        for i, dc in enumerate(detection_classes):
-            if not any(m1 == i):
-                self.matrix[dc, self.nc] += 1  # predicted background
+        Args:
+            images (List[tuple]): Per image (detections, gt_bboxes, gt_cls) as taken by `process_batch`, detections may
+                be None.
+        """
+        dets = [(i, d) for i, (d, _, _) in enumerate(images) if d is not None]
+        gt_bboxes, gt_cls = torch.cat([x[1] for x in images]), torch.cat([x[2] for x in images])
+        gt_idx = torch.cat([torch.full_like(x[2], i, dtype=torch.long) for i, x in enumerate(images)])
+        if not dets:
+            return self.process_batch(None, gt_bboxes, gt_cls)
+        det_idx = torch.cat([torch.full((len(d),), i, dtype=torch.long, device=d.device) for i, d in dets])
+        self.process_batch(torch.cat([d for _, d in dets]), gt_bboxes, gt_cls, det_idx, gt_idx)
 
     def matrix(self):
         """Returns the confusion matrix."""
@@ -604,8 +700,13 @@ def ap_per_class(
             if j == 0:
                 prec_values.append(np.interp(x, mrec, mpre))  # precision at mAP@0.5
 
-    prec_values = np.array(prec_values)  # (nc, 1000)
+    return _pr_summary(
+        x, np.array(prec_values), ap, p_curve, r_curve, nt, unique_classes, plot, on_plot, save_dir, names, eps, prefix
+    )
+
 
+def _pr_summary(x, prec_values, ap, p_curve, r_curve, nt, unique_classes, plot, on_plot, save_dir, names, eps, prefix):
+    """Compute F1 curves, optionally plot all curves and pick the max-F1 operating point for `ap_per_class`."""
     # Compute F1 (harmonic mean of precision and recall)
     f1_curve = 2 * p_curve * r_curve / (p_curve + r_curve + eps)
     names = [v for k, v in names.items() if k in unique_classes]  # list: only classes that have data
@@ -623,6 +724,106 @@ def ap_per_class(
     return tp, fp, p, r, f1, ap, unique_classes.astype(int), p_curve, r_curve, f1_curve, x, prec_values
 
 
+class APHistogram:
+    """
+    Incremental, fixed-memory accumulator of the statistics used by `ap_per_class`.
+
+    Predictions are binned by confidence into `bins` equal-width bins per class, keeping only the number of predictions
+    and of true positives per IoU threshold in each bin, so memory is O(nc * bins * niou) however many images are
+    added. `ap_per_class` can be called at any time for interim results. Ranking within a bin is lost, which is
+    equivalent to rounding confidences down to the bin edge; `ap_error` bounds the resulting change in AP.
+
+    Attributes:
+        bins (int): Number of confidence bins.
+        tp (np.ndarray): True positive counts per class, bin and IoU threshold. Shape: (nc, bins, niou).
+        n (np.ndarray): Prediction counts per class and bin. Shape: (nc, bins).
+        nt (np.ndarray): Target counts per class. Shape: (nc,).
+
+    Examples:
+        >>> hist = APHistogram(nc=80)
+        >>> hist.update(tp, conf, pred_cls, target_cls)  # once per image or batch
+        >>> tp, fp, p, r, f1, ap, *_ = hist.ap_per_class()
+    """
+
+    def __init__(self, nc, niou=10, bins=1000):
+        """Initialize empty histograms for `nc` classes, `niou` IoU thresholds and `bins` confidence bins."""
+        self.bins = bins
+        self.tp = np.zeros((nc, bins, niou), dtype=np.int64)
+        self.n = np.zeros((nc, bins), dtype=np.int64)
+        self.nt = np.zeros(nc, dtype=np.int64)
+
+    def update(self, tp, conf, pred_cls, target_cls):
+        """
+        Add predictions and targets to the histograms.
+
+        Args:
+            tp (np.ndarray): Binary array of true positives per prediction and IoU threshold. Shape: (N, niou).
+            conf (np.ndarray): Confidence scores of the predictions. Shape: (N,).
+            pred_cls (np.ndarray): Predicted classes. Shape: (N,).
+            target_cls (np.ndarray): Target classes. Shape: (M,).
+        """
+        cls = pred_cls.astype(int)
+        b = np.clip((conf * self.bins).astype(int), 0, self.bins - 1)
+        np.add.at(self.tp, (cls, b), tp.astype(np.int64))
+        np.add.at(self.n, (cls, b), 1)
+        self.nt += np.bincount(target_cls.astype(int), minlength=len(self.nt))
+
+    def _cumulative(self, c):
+        """Return bin lower edges and cumulative TP and prediction counts of class `c` in descending confidence."""
+        i = np.flatnonzero(self.n[c])[::-1]  # non-empty bins, highest confidence first
+        return i / self.bins, self.tp[c, i].cumsum(0), self.n[c, i].cumsum(0)
+
+    def ap_per_class(self, plot=False, on_plot=None, save_dir=Path(), names={}, eps=1e-16, prefix=""):
+        """Compute the same outputs as `ap_per_class` from the histograms, see that function for arguments."""
+        unique_classes = np.flatnonzero(self.nt)
+        nt = self.nt[unique_classes]
+        nc, niou = unique_classes.shape[0], self.tp.shape[2]
+        x, prec_values = np.linspace(0, 1, 1000), []
+        ap, p_curve, r_curve = np.zeros((nc, niou)), np.zeros((nc, 1000)), np.zeros((nc, 1000))
+        for ci, c in enumerate(unique_classes):
+            if not self.n[c].any():
+                continue
+            conf, tpc, npc = self._cumulative(c)
+            recall = tpc / (nt[ci] + eps)
+            precision = tpc / npc[:, None]
+            r_curve[ci] = np.interp(-x, -conf, recall[:, 0], left=0)
+            p_curve[ci] = np.interp(-x, -conf, precision[:, 0], left=1)
+            for j in range(niou):
+                ap[ci, j], mpre, mrec = compute_ap(recall[:, j], precision[:, j])
+                if j == 0:
+                    prec_values.append(np.interp(x, mrec, mpre))
+        prec_values = np.array(prec_values)
+        return _pr_summary(
+            x, prec_values, ap, p_curve, r_curve, nt, unique_classes, plot, on_plot, save_dir, names, eps, prefix
+        )
+
+    def ap_error(self):
+        """
+        Bound the AP change caused by binning, per class with targets and IoU threshold.
+
+        Inside a bin going from (T, F) to (T', F') cumulative true and false positives, any ordering of its predictions
+        gives each of its true positives a precision within [(T + 1) / (T + 1 + F'), T' / (T' + F)] over a recall span
+        of (T' - T) / nt. Summing span times precision range over the bins bounds the area between the best and worst
+        orderings of the PR curve; it is zero when no bin holds more than one prediction.
+
+        Returns:
+            (np.ndarray): Upper bound of the absolute AP error. Shape: (nc, niou) over classes with targets.
+        """
+        unique_classes = np.flatnonzero(self.nt)
+        err = np.zeros((len(unique_classes), self.tp.shape[2]))
+        for ci, c in enumerate(unique_classes):
+            if not self.n[c].any():
+                continue
+            _, t1, n1 = self._cumulative(c)
+            f1 = n1[:, None] - t1
+            t0, f0 = np.roll(t1, 1, 0), np.roll(f1, 1, 0)
+            t0[0], f0[0] = 0, 0
+            hi = t1 / np.maximum(t1 + f0, 1)
+            lo = (t0 + 1) / (t0 + 1 + f1)
+            err[ci] = ((t1 - t0) * (hi - lo)).sum(0) / self.nt[c]
+        return err
+
+
 class Metric(SimpleClass):
     """
     Class for computing evaluation metrics for YOLOv8 model.
@@ -917,6 +1118,7 @@ class SegmentMetrics(SimpleClass):
 
     Methods:
         process(tp_m, tp_b, conf, pred_cls, target_cls): Processes metrics over the given set of predictions.
+        process_histograms(box, seg): Processes metrics from incrementally accumulated APHistogram instances.
         mean_results(): Returns the mean of the detection and segmentation metrics over all the classes.
         class_result(i): Returns the detection and segmentation metrics of class `i`.
         maps: Returns the mean Average Precision (mAP) scores for IoU thresholds ranging from 0.50 to 0.95.
@@ -974,6 +1176,20 @@ class SegmentMetrics(SimpleClass):
         self.box.nc = len(self.names)
         self.box.update(results_box)
 
+    def process_histograms(self, box, seg):
+        """
+        Processes the detection and segmentation metrics from incrementally accumulated histograms.
+
+        Args:
+            box (APHistogram): Histograms of the box true positives.
+            seg (APHistogram): Histograms of the mask true positives.
+        """
+        kwargs = dict(plot=self.plot, on_plot=self.on_plot, save_dir=self.save_dir, names=self.names)
+        self.seg.nc = len(self.names)
+        self.seg.update(seg.ap_per_class(**kwargs, prefix="Mask")[2:])
+        self.box.nc = len(self.names)
+        self.box.update(box.ap_per_class(**kwargs, prefix="Box")[2:])
+
     @property
     def keys(self):
         """Returns a list of keys for accessing metrics."""
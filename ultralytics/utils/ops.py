@@ -1,9 +1,11 @@
 # Ultralytics 🚀 AGPL-3.0 License - https://ultralytics.com/license
 
 import contextlib
+import json
 import math
 import re
 import time
+from itertools import accumulate
 
 import cv2
 import numpy as np
@@ -62,6 +64,136 @@ class Profile(contextlib.ContextDecorator):
         return time.perf_counter()
 
 
+class StageProfiler:
+    """
+    Records the time and memory of every call of named, possibly nested, stages such as those of a validation loop.
+
+    The self time of a stage excludes the stages nested in it, so self times add up to the profiled time. Memory is the
+    peak CUDA memory allocated during the stage on CUDA devices, else the resident memory of the process after it.
+
+    Attributes:
+        enabled (bool): Whether stages are recorded, a disabled profiler only yields.
+        batch (int): Batch index stored with the records.
+        records (list): One dict per stage call with its batch, image (-1 for whole batches), stage, ms, self_ms and mem
+            in MB.
+
+    Example:
+        ```python
+        from ultralytics.utils.ops import StageProfiler
+
+        profiler = StageProfiler(device=device)
+        with profiler("postprocess"):
+            with profiler("nms", image=0):
+                pass  # slow operation here
+        print(profiler.summary(images=1))
+        ```
+    """
+
+    def __init__(self, device: torch.device = None, enabled=True):
+        """
+        Initialize the StageProfiler class.
+
+        Args:
+            device (torch.device): Device used for model inference. Defaults to None (cpu).
+            enabled (bool): Whether to record stages. Defaults to True.
+        """
+        self.enabled = enabled
+        self.device = device
+        self.cuda = bool(device and str(device).startswith("cuda"))
+        self.batch = -1
+        self.records = []
+        self.stack = []  # [nested ms, nested peak memory] of the open stages
+        self.process = None
+        if enabled and not self.cuda:
+            import psutil  # scope import, only needed when profiling
+
+            self.process = psutil.Process()
+
+    @contextlib.contextmanager
+    def __call__(self, stage, image=-1):
+        """Time the stage `stage` of image `image` of the current batch."""
+        if not self.enabled:
+            yield
+            return
+        if self.cuda:
+            torch.cuda.synchronize(self.device)
+            if self.stack:  # the peak of the enclosing stage so far, before resetting it
+                self.stack[-1][1] = max(self.stack[-1][1], torch.cuda.max_memory_allocated(self.device))
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self.stack.append([0.0, 0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.cuda:
+                torch.cuda.synchronize(self.device)
+            ms = (time.perf_counter() - start) * 1e3
+            nested_ms, nested_mem = self.stack.pop()
+            self._record(stage, image, ms, ms - nested_ms, max(self.memory(), nested_mem))
+
+    def add(self, stage, ms, image=-1):
+        """Record a stage timed by the caller, e.g. the wait for the next batch of a dataloader."""
+        if self.enabled:
+            self._record(stage, image, ms, ms, self.memory())
+
+    def _record(self, stage, image, ms, self_ms, mem):
+        """Append a record and add its time and memory to the enclosing stage."""
+        if self.stack:
+            self.stack[-1][0] += ms
+            self.stack[-1][1] = max(self.stack[-1][1], mem)
+        self.records.append(dict(batch=self.batch, image=image, stage=stage, ms=ms, self_ms=self_ms, mem=mem / 2**20))
+
+    def memory(self):
+        """Return the peak CUDA memory allocated since the last reset, or the process resident memory, in bytes."""
+        return torch.cuda.max_memory_allocated(self.device) if self.cuda else self.process.memory_info().rss
+
+    def summary(self, images):
+        """
+        Summarize the records per stage, in order of first call.
+
+        Args:
+            images (int): Number of images profiled, to express times per image.
+
+        Returns:
+            (list): Dicts with the stage, calls, total self time `ms`, self time per image `ms_per_image`, `share` of
+                the profiled time and `peak_mem` in MB.
+        """
+        stages = {}
+        for r in self.records:
+            x = stages.setdefault(r["stage"], dict(stage=r["stage"], calls=0, ms=0.0, peak_mem=0.0))
+            x["calls"] += 1
+            x["ms"] += r["self_ms"]
+            x["peak_mem"] = max(x["peak_mem"], r["mem"])
+        total = sum(x["ms"] for x in stages.values()) or 1.0
+        for x in stages.values():
+            x["ms_per_image"] = x["ms"] / max(images, 1)
+            x["share"] = x["ms"] / total
+        return list(stages.values())
+
+    def save(self, file, images):
+        """
+        Save the records as a CSV trace to `file` and the summary as JSON next to it.
+
+        Args:
+            file (Path): CSV file to write.
+            images (int): Number of images profiled.
+
+        Returns:
+            (list): The summary, see `summary`.
+        """
+        summary = self.summary(images)
+        keys = ("batch", "image", "stage", "ms", "self_ms", "mem")
+        with open(file, "w", encoding="utf-8") as f:
+            f.write(",".join(keys) + "\n")
+            f.writelines(
+                ",".join(f"{r[k]:.4f}" if isinstance(r[k], float) else str(r[k]) for k in keys) + "\n"
+                for r in self.records
+            )
+        with open(file.with_suffix(".json"), "w", encoding="utf-8") as f:
+            json.dump(dict(images=images, device=str(self.device), stages=summary), f, indent=2)
+        return summary
+
+
 def segment2box(segment, width=640, height=640):
     """
     Convert 1 segment label to 1 box label, applying inside-image constraint, i.e. (xy1, xy2, ...) to (xyxy).
@@ -625,11 +757,15 @@ def segments2boxes(segments):
     Returns:
         (np.ndarray): The xywh coordinates of the bounding boxes.
     """
-    boxes = []
-    for s in segments:
-        x, y = s.T  # segment xy
-        boxes.append([x.min(), y.min(), x.max(), y.max()])  # cls, xyxy
-    return xyxy2xywh(np.array(boxes))  # cls, xywh
+    lengths = [len(s) for s in segments]
+    if not lengths:
+        return np.zeros((0, 4), dtype=np.float32)
+    if 0 in lengths:
+        raise ValueError(f"segment {lengths.index(0)} has no points, every segment needs at least one point")
+    xy = np.concatenate(segments, 0)  # all segments at once
+    i = np.cumsum([0, *lengths[:-1]])  # start of each segment
+    boxes = np.concatenate((np.minimum.reduceat(xy, i), np.maximum.reduceat(xy, i)), 1)  # xyxy
+    return xyxy2xywh(boxes)  # cls, xywh
 
 
 def resample_segments(segments, n=1000):
@@ -675,6 +811,31 @@ def crop_mask(masks, boxes):
     return masks * ((r >= x1) * (r < x2) * (c >= y1) * (c < y2))
 
 
+def crop_mask_mean(masks, boxes, index=None):
+    """
+    Compute `crop_mask(masks, boxes).mean(dim=(1, 2))` from summed-area tables, without materializing cropped masks.
+
+    Args:
+        masks (torch.Tensor): [k, h, w] tensor of masks, e.g. per-pixel loss maps.
+        boxes (torch.Tensor): [n, 4] tensor of bbox coordinates in relative point form.
+        index (torch.Tensor, optional): [n] index of the mask each box is applied to. Defaults to box i on mask i.
+
+    Returns:
+        (torch.Tensor): [n] sums of the masks inside the boxes divided by h * w.
+    """
+    k, h, w = masks.shape
+    if index is None:
+        index = torch.arange(k, device=masks.device)
+    sat = F.pad(masks.cumsum(1).cumsum(2), (1, 0, 1, 0)).view(-1)  # (k, h + 1, w + 1) flattened
+    x1, y1, x2, y2 = boxes.ceil().long().unbind(1)  # crop_mask keeps pixels with x1 <= c < x2
+    x1, x2 = x1.clamp(0, w), x2.clamp(0, w)
+    y1, y2 = y1.clamp(0, h), y2.clamp(0, h)
+    x2, y2 = torch.maximum(x1, x2), torch.maximum(y1, y2)
+    y1, y2 = index * (h + 1) + y1, index * (h + 1) + y2  # rows in the flattened tables
+    total = sat[y2 * (w + 1) + x2] - sat[y1 * (w + 1) + x2] - sat[y2 * (w + 1) + x1] + sat[y1 * (w + 1) + x1]
+    return total / (h * w)
+
+
 def process_mask(protos, masks_in, bboxes, shape, upsample=False):
     """
     Apply masks to bounding boxes using the output of the mask head.
@@ -707,21 +868,253 @@ def process_mask(protos, masks_in, bboxes, shape, upsample=False):
         masks = F.interpolate(masks[None], shape, mode="bilinear", align_corners=False)[0]  # CHW
     return masks.gt_(0.0)
 
-def process_combine_mask(protos, pred_classes, pred_bboxes, shape, upsample=False):
+
+def combine_mask_rois(bboxes, mask_shape, shape):
+    """
+    Compute the windows of the upsampled grid that masks cropped to `bboxes` can reach after bilinear upsampling.
+
+    Args:
+        bboxes (torch.Tensor): [n, 4] xyxy boxes in mask coordinates, as passed to `crop_mask`.
+        mask_shape (tuple): The size of the masks (mask_h, mask_w).
+        shape (tuple): The size of the upsampled grid (h, w).
+
+    Returns:
+        (torch.Tensor): [n, 4] integer xyxy windows on the upsampled grid, end exclusive. Pixels outside a window are
+            zero after upsampling.
+    """
+    (mh, mw), (h, w) = mask_shape, shape
+    limit = torch.tensor([mw - 1, mh - 1], device=bboxes.device)
+    lo = bboxes[:, :2].ceil().clamp_(min=0)  # first mask pixel kept by crop_mask
+    hi = torch.minimum(bboxes[:, 2:].ceil() - 1, limit)  # last mask pixel kept by crop_mask
+    scale = torch.tensor([w / mw, h / mh], device=bboxes.device)
+    # output pixel d samples mask pixels floor(s) and floor(s) + 1 with s = (d + 0.5) / scale - 0.5
+    start = ((lo - 0.5) * scale - 0.5).floor().clamp_(min=0)
+    end = torch.minimum(((hi + 1.5) * scale - 0.5).ceil() + 1, torch.tensor([w, h], device=bboxes.device))
+    end = torch.where(hi >= lo, end, start)  # empty crops
+    return torch.cat([start, end.clamp(min=start)], 1).long()
+
+
+def interpolate_rois(masks, rois, shape, index=None, bboxes=None, chunk=32):
+    """
+    Bilinearly upsample masks to `shape`, evaluating only the output pixels inside each mask's window.
+
+    The values match `F.interpolate(masks[None], shape, mode="bilinear", align_corners=False)[0]` inside the windows
+    up to floating point rounding, without allocating the full-resolution [n, h, w] tensor. Each window is computed
+    as `Wy @ window @ Wx.T`, where `window` is the part of the mask the output window samples from and `Wy`, `Wx` hold
+    the bilinear weights.
+
+    Args:
+        masks (torch.Tensor): [m, mask_h, mask_w] masks.
+        rois (torch.Tensor): [n, 4] integer xyxy windows on the upsampled grid, end exclusive.
+        shape (tuple): The size of the upsampled grid (h, w).
+        index (torch.Tensor, optional): [n] index of the mask each window is taken from, defaults to `arange(m)`.
+        bboxes (torch.Tensor, optional): [n, 4] xyxy boxes in mask coordinates; the masks are cropped to them before
+            upsampling, as with `crop_mask`.
+        chunk (int): Number of windows evaluated together. Windows are sorted by area so padding stays small.
+
+    Returns:
+        (List[torch.Tensor]): n float tensors of shape [y2 - y1, x2 - x1] with the upsampled values of each window.
+    """
+    _, mh, mw = masks.shape
+    h, w = shape
+    n = len(rois)
+    if n == 0:
+        return []
+    crops = [None] * n
+    sizes = (rois[:, 2:] - rois[:, :2]).tolist()
+
+    def weights(start, size, length, src_length):
+        """Bilinear weights [k, size, window] of `size` output pixels from `start` and the source window indices."""
+        d = (start[:, None] + torch.arange(size, device=start.device)).clamp_(max=length - 1)
+        s = ((d + 0.5) * (src_length / length) - 0.5).clamp_(min=0)
+        i0 = s.long()
+        lam = s - i0
+        i1 = (i0 + 1).clamp_(max=src_length - 1)
+        first = i0[:, :1]
+        i0, i1 = i0 - first, i1 - first
+        wt = torch.zeros((len(start), size, int(i1.max()) + 1 if size else 1), device=start.device)
+        wt.scatter_add_(2, i0[..., None], (1 - lam)[..., None]).scatter_add_(2, i1[..., None], lam[..., None])
+        src = (first + torch.arange(wt.shape[2], device=start.device)).clamp_(max=src_length - 1)
+        return wt, src
+
+    order = ((rois[:, 2] - rois[:, 0]) * (rois[:, 3] - rois[:, 1])).argsort()
+    for idx in order.split(chunk):
+        r = rois[idx]
+        rw, rh = (r[:, 2:] - r[:, :2]).amax(0).tolist()
+        wy, ys = weights(r[:, 1], rh, h, mh)  # ys: mask rows of each window
+        wx, xs = weights(r[:, 0], rw, w, mw)  # xs: mask columns of each window
+        k = idx if index is None else index[idx]
+        window = masks[k[:, None, None], ys[:, :, None], xs[:, None, :]].float()
+        if bboxes is not None:
+            x1, y1, x2, y2 = bboxes[idx, :, None].unbind(1)
+            window *= ((ys >= y1) & (ys < y2))[:, :, None] & ((xs >= x1) & (xs < x2))[:, None, :]
+        values = wy @ window @ wx.transpose(1, 2)
+        for i, v in zip(idx.tolist(), values):
+            crops[i] = v[: sizes[i][1], : sizes[i][0]]
+    return crops
+
+
+def paste_masks(crops, rois, shape):
+    """
+    Rasterize box-local masks into full-size masks.
+
+    Args:
+        crops (List[torch.Tensor]): n masks of shape [y2 - y1, x2 - x1].
+        rois (torch.Tensor): [n, 4] integer xyxy windows of the crops, end exclusive.
+        shape (tuple): The size of the full masks (h, w).
+
+    Returns:
+        (torch.Tensor): A bool tensor of shape [n, h, w].
+    """
+    masks = torch.zeros((len(crops), *shape), dtype=torch.bool, device=rois.device)
+    for mask, crop, (x1, y1, x2, y2) in zip(masks, crops, rois.tolist()):
+        mask[y1:y2, x1:x2] = crop
+    return masks
+
+
+def crops2masks(crops, rois, shape, index=None):
+    """
+    Expand flattened box-local masks into full-size masks in one vectorized pass, optionally only some of them.
+
+    Args:
+        crops (torch.Tensor): The row-major pixels of all crops concatenated into one flat tensor.
+        rois (torch.Tensor): [n, 4] integer xyxy windows of the crops, end exclusive.
+        shape (tuple): The size of the full masks (h, w).
+        index (torch.Tensor, optional): [k] indices of the crops to expand. Defaults to all crops.
+
+    Returns:
+        (torch.Tensor): A tensor of shape [k, h, w] with the dtype of `crops`.
+    """
+    rois = rois.long()
+    widths = rois[:, 2] - rois[:, 0]
+    sizes = widths * (rois[:, 3] - rois[:, 1])
+    starts = sizes.cumsum(0) - sizes  # offset of each crop in `crops`
+    if index is not None:
+        rois, widths, sizes, starts = rois[index], widths[index], sizes[index], starts[index]
+    masks = torch.zeros((len(rois), *shape), dtype=crops.dtype, device=crops.device)
+    n = int(sizes.sum())
+    if n:
+        i = torch.repeat_interleave(torch.arange(len(rois), device=crops.device), sizes, output_size=n)
+        pixel = torch.arange(n, device=crops.device) - (sizes.cumsum(0) - sizes)[i]  # pixel index inside its crop
+        masks[i, rois[i, 1] + pixel // widths[i], rois[i, 0] + pixel % widths[i]] = crops[starts[i] + pixel]
+    return masks
+
+
+def paste_mask_crops(crops, bboxes, shape):
+    """
+    Resample fixed-size mask crops, as exported by a combine_mask head with mask_gather, into their boxes of full masks.
+
+    Each crop holds the mask logits at the centers of a regular grid over its box. The full masks are interpolated
+    bilinearly from the crops, one separable matrix product per mask, and are empty outside the boxes.
+
+    Args:
+        crops (torch.Tensor): [n, s, s] mask logits of the crops.
+        bboxes (torch.Tensor): [n, 4] xyxy boxes of the crops in pixels of the full masks.
+        shape (tuple): The size of the full masks (h, w).
+
+    Returns:
+        (torch.Tensor): A binary mask tensor of shape [n, h, w].
+    """
+    s = crops.shape[-1]
+    j = torch.arange(s, device=crops.device, dtype=crops.dtype)
+
+    def weights(lo, hi, size):
+        """Returns the [n, size, s] bilinear weights of the crop cells for the pixel centers along one axis."""
+        c = torch.arange(size, device=crops.device, dtype=crops.dtype)[None] + 0.5  # pixel centers
+        inside = (c >= lo[:, None]) & (c < hi[:, None])
+        t = ((c - lo[:, None]) / (hi - lo).clamp(min=1e-6)[:, None] * s - 0.5).clamp(0, s - 1)  # crop coordinates
+        return (1 - (t[..., None] - j).abs()).clamp(min=0) * inside[..., None]
+
+    wy = weights(bboxes[:, 1], bboxes[:, 3], shape[0])
+    wx = weights(bboxes[:, 0], bboxes[:, 2], shape[1])
+    return (wy @ crops @ wx.transpose(1, 2)).gt_(0.0)
+
+
+def crop_class_planes(planes, pred_classes, bboxes, shape):
+    """
+    Upsample each referenced class plane once and crop the instance masks from it.
+
+    Every class plane is upsampled only inside the union of its boxes and thresholded once; the instance masks are
+    views of the thresholded plane, so the cost scales with the number of classes present rather than the number of
+    boxes.
+
+    Args:
+        planes (torch.Tensor): [num_classes, mask_h, mask_w] class mask planes.
+        pred_classes (torch.Tensor): [n], classes of the boxes.
+        bboxes (torch.Tensor): [n, 4], xyxy boxes on the upsampled grid.
+        shape (tuple): The size of the upsampled grid (h, w).
+
+    Returns:
+        crops (List[torch.Tensor]): n box-local bool masks.
+        rois (torch.Tensor): [n, 4] integer xyxy windows of the crops, end exclusive.
+    """
+    h, w = shape
+    classes, inverse = pred_classes.long().unique(return_inverse=True)
+    rois = bboxes.ceil().clamp_(min=0)  # pixels x1 <= x < x2 as in crop_mask
+    rois[:, 2:] = torch.maximum(torch.minimum(rois[:, 2:], torch.tensor([w, h], device=bboxes.device)), rois[:, :2])
+    rois = rois.long()
+    index = inverse[:, None].expand(-1, 2)
+    union = torch.cat(
+        [
+            rois.new_full((len(classes), 2), max(h, w)).scatter_reduce_(0, index, rois[:, :2], "amin"),
+            rois.new_zeros((len(classes), 2)).scatter_reduce_(0, index, rois[:, 2:], "amax"),
+        ],
+        1,
+    )
+    class_crops = [x.gt_(0.0).bool() for x in interpolate_rois(planes, union, shape, index=classes)]
+    offsets = (rois - union[inverse][:, [0, 1, 0, 1]]).tolist()
+    crops = [class_crops[j][y1:y2, x1:x2] for j, (x1, y1, x2, y2) in zip(inverse.tolist(), offsets)]
+    return crops, rois
+
+
+def combine_mask_planes(protos, weight, bias, pred_classes):
+    """
+    Compute only the class mask planes used by the boxes from the protos and `mask_pred` conv of a combine_mask head.
+
+    Args:
+        protos (torch.Tensor): [mask_dim, mask_h, mask_w] mask protos of one image.
+        weight (torch.Tensor): [num_classes, mask_dim, 1, 1] weight of the 1x1 `mask_pred` conv.
+        bias (torch.Tensor): [num_classes] bias of the 1x1 `mask_pred` conv.
+        pred_classes (torch.Tensor): [n], classes of the boxes after NMS.
+
+    Returns:
+        planes (torch.Tensor): [k, mask_h, mask_w] mask planes of the k distinct classes in `pred_classes`.
+        index (torch.Tensor): [n], index of each box's plane in `planes`.
+    """
+    c, mh, mw = protos.shape  # CHW
+    classes, index = pred_classes.long().unique(return_inverse=True)
+    planes = weight.view(-1, c)[classes] @ protos.view(c, -1) + bias[classes, None]
+    return planes.view(-1, mh, mw), index
+
+
+def process_combine_mask(protos, pred_classes, pred_bboxes, shape, upsample=False, compact=False, per_class=False):
     """
-    Crop before upsample.
-    protos: [num_classes, mask_h, mask_w]  num_classes * 80 * 80
-    pred_classes: [n],  n is number of bboxes after nms
-    pred_bboxes: [n, 4], n is number of bboxes after nms
-    shape:input_image_size, (h, w)
+    Apply the class mask planes of a combine_mask head to the bounding boxes, cropping before upsampling.
 
-    return: h, w, n
+    When upsampling, only the window each box can reach is interpolated, so full-resolution per-instance masks are
+    never computed. With `per_class`, each referenced class plane is instead upsampled once and cropped after
+    upsampling, see `crop_class_planes`.
+
+    Args:
+        protos (torch.Tensor): [num_classes, mask_h, mask_w] predicted class mask planes.
+        pred_classes (torch.Tensor): [n], classes of the boxes after NMS.
+        pred_bboxes (torch.Tensor): [n, 4], xyxy boxes after NMS in input image coordinates.
+        shape (tuple): The size of the input image (h, w).
+        upsample (bool): Upsample the masks to the input image size. Default is False.
+        compact (bool): Return box-local masks instead of dense masks when upsampling, see `paste_masks`.
+        per_class (bool): Upsample each class plane once and crop the boxes from it when upsampling. Default is False.
+
+    Returns:
+        (torch.Tensor | tuple): [n, mask_h, mask_w] float masks without upsampling, [n, h, w] bool masks with
+            upsampling, or a tuple of box-local bool masks and their [n, 4] windows if `compact` is True.
     """
+    if upsample and per_class:
+        crops, rois = crop_class_planes(protos, pred_classes, pred_bboxes, shape)
+        return (crops, rois) if compact else paste_masks(crops, rois, shape)
 
     c, mh, mw = protos.shape  # CHW
     ih, iw = shape
-    classes_ind = pred_classes.clone().to(torch.int32)
-    masks = protos[classes_ind].view(-1, mh, mw).float()  # CHW
+    classes_ind = pred_classes.long()
 
     downsampled_bboxes = pred_bboxes.clone()
     downsampled_bboxes[:, 0] *= mw / iw
@@ -729,10 +1122,47 @@ def process_combine_mask(protos, pred_classes, pred_bboxes, shape, upsample=Fals
     downsampled_bboxes[:, 3] *= mh / ih
     downsampled_bboxes[:, 1] *= mh / ih
 
-    masks = crop_mask(masks, downsampled_bboxes)  # CHW
-    if upsample and len(masks):
-        masks = F.interpolate(masks[None], shape, mode='bilinear', align_corners=False)[0]  # CHW
-    return masks.gt_(0.0)  # threshold
+    if not upsample:
+        masks = crop_mask(protos[classes_ind].float(), downsampled_bboxes)  # CHW
+        return masks.gt_(0.0)  # threshold
+    rois = combine_mask_rois(downsampled_bboxes, (mh, mw), shape)
+    values = interpolate_rois(protos, rois, shape, index=classes_ind, bboxes=downsampled_bboxes)
+    crops = [x.gt_(0.0).bool() for x in values]
+    return (crops, rois) if compact else paste_masks(crops, rois, shape)
+
+
+def process_combine_mask_batch(protos, preds, shape, per_class=False, index=None):
+    """
+    Batched `process_combine_mask` with upsampling for the detections of every image in a batch.
+
+    The class planes of all detections are gathered, cropped and upsampled together, and the masks are split per image
+    afterwards.
+
+    Args:
+        protos (torch.Tensor | List[torch.Tensor]): [batch_size, num_classes, mask_h, mask_w] predicted class mask
+            planes, or [k, mask_h, mask_w] planes per image together with `index`.
+        preds (List[torch.Tensor]): Detections per image, each of shape [n, 6+] with xyxy, conf, cls.
+        shape (tuple): The size of the input images (h, w).
+        per_class (bool): Upsample each class plane once and crop the boxes from it. Default is False.
+        index (List[torch.Tensor], optional): [n] index of each detection's plane in `protos` per image, see
+            `combine_mask_planes`. Defaults to the detection classes.
+
+    Returns:
+        (List[torch.Tensor]): [n, h, w] bool masks per image.
+    """
+    if index is None:
+        index = [x[:, 5] for x in preds]
+    counts = [len(x) for x in preds]
+    offsets = [0, *accumulate(len(x) for x in protos)]  # first plane of each image in the flattened planes
+    classes = torch.cat([i.long() + o for i, o in zip(index, offsets)])
+    planes = protos.flatten(0, 1) if isinstance(protos, torch.Tensor) else torch.cat(protos)
+    pred = torch.cat(preds)
+    crops, rois = process_combine_mask(
+        planes, classes, pred[:, :4], shape, upsample=True, compact=True, per_class=per_class
+    )
+    splits = torch.tensor(counts).cumsum(0).tolist()
+    return [paste_masks(crops[i - n : i], rois[i - n : i], shape) for i, n in zip(splits, counts)]
+
 
 def process_mask_native(protos, masks_in, bboxes, shape):
     """
@@ -754,6 +1184,33 @@ def process_mask_native(protos, masks_in, bboxes, shape):
     return masks.gt_(0.0)
 
 
+def process_combine_mask_native(protos, pred_classes, bboxes, shape, compact=False):
+    """
+    Apply the class mask planes of a combine_mask head to the bounding boxes at the original image resolution.
+
+    The letterbox padding is removed from the class planes and only the planes referenced by the boxes are resized,
+    each once and only inside the union of its boxes, before cropping to the boxes as in `process_mask_native`.
+
+    Args:
+        protos (torch.Tensor): [num_classes, mask_h, mask_w] predicted class mask planes.
+        pred_classes (torch.Tensor): [n], classes of the boxes after NMS.
+        bboxes (torch.Tensor): [n, 4], xyxy boxes after NMS in original image coordinates.
+        shape (tuple): The size of the original image (h, w).
+        compact (bool): Return box-local masks instead of dense masks, see `paste_masks`.
+
+    Returns:
+        (torch.Tensor | tuple): [n, h, w] bool masks, or a tuple of box-local bool masks and their [n, 4] windows if
+            `compact` is True.
+    """
+    c, mh, mw = protos.shape  # CHW
+    gain = min(mh / shape[0], mw / shape[1])  # gain  = old / new
+    pad = (mw - shape[1] * gain) / 2, (mh - shape[0] * gain) / 2  # wh padding
+    top, left = int(pad[1]), int(pad[0])  # y, x
+    bottom, right = int(mh - pad[1]), int(mw - pad[0])
+    crops, rois = crop_class_planes(protos[:, top:bottom, left:right], pred_classes, bboxes, shape)
+    return (crops, rois) if compact else paste_masks(crops, rois, shape)
+
+
 def scale_masks(masks, shape, padding=True):
     """
     Rescale segment masks to shape.